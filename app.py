@@ -1,34 +1,67 @@
 # ─── Standard-Imports ────────────────────────────────────────────────
-import os, re, io, sys, traceback, io
-from pathlib import Path
-from datetime import date, datetime
+import hmac, os, re, sys, json, threading
+import click
+from datetime import date
 from functools import wraps
-from PIL import Image
-from pylibdmtx.pylibdmtx import encode as dmtx_encode
 
 from flask import (Flask, render_template, request, send_file, session,
-                   flash, redirect, url_for, abort, jsonify)
-from sqlalchemy import select, insert, func, or_
-from sqlalchemy.orm import Session
-from fpdf import FPDF
+                   flash, redirect, url_for, abort, jsonify, Response,
+                   stream_with_context, stream_template)
+from sqlalchemy import select, insert
 from werkzeug.security import generate_password_hash, check_password_hash
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 
 # ─── DB / Hilfen ------------------------------------------------------
-from db       import engine, init_db, category, product, brand, slip, slip_item, serial
-from helpers  import get_or_fetch_product, _ensure_brand
-
-TRANSLATE = str.maketrans(
-    "ÄÖÜäöüß", "AOUaouB")     # Minimal-Ersatz, gern anpassen
-
-def slug(txt: str) -> str:
-    txt = (txt or "-").translate(TRANSLATE)
-    txt = re.sub(r"[^A-Za-z0-9_-]+", "_", txt.strip())
-    return txt or "-"
+from db       import session_scope, close_request_session, category, product, brand, slip, slip_item, serial
+from helpers  import (lookup_product, invalidate_product, _ensure_brand,
+                      count_misses, clear_misses)
+from prefetch import prefetch, parse_eans
+import pdf_jobs
+from slip_pdf  import load_slip, content_key, file_name, template as pdf_template
+from slip_export import slip_query, SLIP_KEYS, export_zip, export_pdf, export_key, submit_pdf, pdf_status as export_status
+import pdf_cache
+from paging    import keyset_page, ordered, stream_rows, as_dict, PAGE_SIZE, PAGE_MAX
+import metrics, refdata
+from migrations import (upgrade as upgrade_schema, status as schema_status,
+                        check as check_schema, MIGRATIONS)
+from product_search import init_search, apply_search
+from slip_numbers import preview as preview_number, insert_header, claim as claim_number
+from serial_search import normalize as normalize_sn, parse_serials, find as find_serials, MAX_TERMS
+import serial_index
+from catalogue import build as build_catalogue, parse_version as parse_catalogue_version
 
 # ─── Flask-App anlegen (MUSS vor Dekoratoren stehen!) ────────────────
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET", "super-secret-change-me")
-init_db()
+pdf_template()              # Schrift/Logo/Briefkopf einmal pro Worker vorbereiten
+
+_started    = False
+_start_lock = threading.Lock()
+
+def start_worker() -> None:
+    """Start-Arbeit eines Server-Prozesses (einmalig).
+
+    asgi.py ruft das beim Import auf (gunicorn-Worker); unter `flask run` oder
+    `gunicorn app:app` läuft es vor dem ersten Request. CLI-Befehle wie `upgrade`
+    oder `schema` importieren die App ebenfalls, starten aber keinen Worker.
+    """
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        # nur prüfen – migriert wird vorher per `flask --app app upgrade` (Dockerfile)
+        check_schema()
+        init_search()
+        serial_index.warm()  # Bloom-Filter der Seriennummern im Hintergrund aufbauen
+        _started = True
+
+@app.before_request
+def _start_on_first_request():
+    if not _started:
+        start_worker()
+
+app.teardown_appcontext(close_request_session)   # eine DB-Verbindung pro Request
+metrics.instrument_app(app)                      # Latenz + SQL je Request → /metrics
 
 # ─── Login-Konstanten + Decorator ────────────────────────────────────
 ADMIN_USER    = "admin"
@@ -50,10 +83,16 @@ def login_required(fn):
         return fn(*a, **kw)
     return wrapper
 
+STAFF_ROLES = ("admin", "tech")
+
+def is_staff(sess) -> bool:
+    """Admin oder Techniker angemeldet? (auch für asgi.py mit der dort gelesenen Session)"""
+    return sess.get("role") in STAFF_ROLES
+
 def tech_or_admin_required(fn):
     @wraps(fn)
     def wrapper(*a, **kw):
-        if session.get("role") not in ("admin", "tech"):
+        if not is_staff(session):
             flash("Bitte einloggen …", "warn")
             return redirect(url_for("login", next=request.full_path))
         return fn(*a, **kw)
@@ -88,21 +127,19 @@ def logout():
 # ─── Globaler Hook für alle Routen ───────────────────────────────────
 @app.before_request
 def require_login_for_everything():
-    exempt = ("static", "login", "logout", "admin_home",)
+    exempt = ("static", "login", "logout", "admin_home", "metrics",)
     if request.endpoint in exempt:
         return
     # Admin- und Techniker-Routen
-    if session.get("role") not in ("admin", "tech"):
+    if not is_staff(session):
         return redirect(url_for("login", next=request.full_path))
 
 # ─── Admin-Bereich (geschützt) ───────────────────────────────────────
-@app.get("/admin")
-@login_required
-def admin_home():
-    # ----- Filter aus Query-String lesen -----------------------------
-    q        = request.args.get("q", "").strip()          # Freitext (EAN / Produkt)
-    cat_id   = request.args.get("cat") or None            # Kategorie-ID
-    brand_q  = request.args.get("brand", "").strip()      # Hersteller-Teilstring
+def _product_query(args):
+    """Produkt-Select + Sortierschlüssel aus den Filtern (q, cat, brand) – für Seite und JSON-API."""
+    q        = args.get("q", "").strip()                  # Freitext (EAN / Produkt)
+    cat_id   = args.get("cat") or None                    # Kategorie-ID
+    brand_q  = args.get("brand", "").strip()              # Hersteller-Teilstring
 
     # ----- Grund-Select (holt gleich Kategorie & Brand) --------------
     stmt = (
@@ -114,56 +151,167 @@ def admin_home():
         .select_from(product)
         .join(category, category.c.id == product.c.category_id)
         .outerjoin(brand,   brand.c.id == product.c.brand_id)
-        .order_by(product.c.name)
+    )
+    if cat_id:
+        stmt = stmt.where(product.c.category_id == int(cat_id))
+    stmt, keys = apply_search(stmt, q, brand_q)   # Volltext/EAN-Präfix + Ranking
+    return stmt, keys
+
+def _page_links(next_cursor):
+    """URLs für „Anfang“, „Weiter“ und „Alle anzeigen“ mit den aktuellen Filtern."""
+    args   = {k: v for k, v in request.args.items() if k not in ("after", "all")}
+    paged  = bool(request.args.get("after")) or bool(next_cursor)
+    return dict(
+        first_url = url_for(request.endpoint, **args) if request.args.get("after") else None,
+        next_url  = url_for(request.endpoint, after=next_cursor, **args) if next_cursor else None,
+        all_url   = url_for(request.endpoint, all=1, **args) if paged else None,
     )
 
-    # ----- Wenn überhaupt gefiltert wird … ---------------------------
-    has_filter = q or cat_id or brand_q
-    if has_filter:
-        if q:
-            like = f"%{q}%"
-            stmt = stmt.where(or_(product.c.name.ilike(like),
-                                  product.c.ean.like(like)))
-        if cat_id:
-            stmt = stmt.where(product.c.category_id == int(cat_id))
-        if brand_q:
-            stmt = stmt.where(brand.c.name.ilike(f"%{brand_q}%"))
-
-        with Session(engine) as s:
-            rows = s.execute(stmt).all()
-    else:
-        rows = []       # → Erst nach einer Suche etwas anzeigen
+def _listing(template, stmt, keys, **ctx):
+    """Eine Keyset-Seite rendern – oder mit ?all=1 alle Zeilen gestreamt (yield_per)."""
+    if request.args.get("all"):
+        return stream_template(template, rows=stream_rows(ordered(stmt, keys)),
+                               **_page_links(None), **ctx)
+    try:
+        with session_scope() as s:
+            page = keyset_page(s, stmt, keys, request.args.get("after"))
+    except ValueError as e:
+        abort(400, str(e))
+    return render_template(template, rows=page.rows, **_page_links(page.next), **ctx)
+
+def _json_page(stmt, keys):
+    """JSON-API: {items, next}; ?after=<next> liefert die folgende Seite."""
+    try:
+        size = max(1, min(int(request.args.get("limit", PAGE_SIZE)), PAGE_MAX))
+        with session_scope() as s:
+            page = keyset_page(s, stmt, keys, request.args.get("after"), size)
+    except ValueError as e:
+        return jsonify(ok=False, msg=str(e)), 400
+    return jsonify(items=[as_dict(r) for r in page.rows], next=page.next)
+
+@app.get("/admin")
+@login_required
+def admin_home():
+    q        = request.args.get("q", "").strip()
+    cat_id   = request.args.get("cat") or None
+    brand_q  = request.args.get("brand", "").strip()
+
+    ctx = dict(title   = "Produkt­verwaltung",
+               q       = q,
+               cats    = refdata.categories(),   # Drop-down aus dem Stammdaten-Cache
+               cat_id  = cat_id,
+               brand_q = brand_q,
+               misses  = count_misses())
+
+    # ----- Erst nach einer Suche etwas anzeigen ----------------------
+    if not (q or cat_id or brand_q):
+        return render_template("admin_list.html", rows=[], **_page_links(None), **ctx)
+    stmt, keys = _product_query(request.args)
+    return _listing("admin_list.html", stmt, keys, **ctx)
+
+@app.get("/api/admin/products")
+@login_required
+def api_products():
+    stmt, keys = _product_query(request.args)
+    return _json_page(stmt, keys)
 
-    # ----- Kategorien für Drop-down ----------------------------------
-    with Session(engine) as s:
-        cats = s.execute(select(category)).all()
 
-    return render_template(
-        "admin_list.html",
-        title   = "Produkt­verwaltung",
-        rows    = rows,
-        q       = q,
-        cats    = cats,
-        cat_id  = cat_id,
-        brand_q = brand_q,
-    )
+# ── Negativ-Cache leeren (unbekannte EANs wieder extern suchen) ──────
+@app.post("/admin/lookup-misses/clear")
+@login_required
+def admin_clear_misses():
+    n = clear_misses()
+    flash(f"{n} unbekannte EAN(s) zurückgesetzt – werden beim nächsten Scan neu gesucht.", "ok")
+    return redirect(url_for("admin_home"))
 
 
+# ── EAN-Liste vorab importieren (Lieferschein-CSV) ───────────────────
+@app.post("/api/admin/prefetch")
+@login_required
+def api_prefetch():
+    """Nimmt Datei-Upload (`file`), JSON {"eans": [...]} oder Klartext an.
+    Antwort: NDJSON-Stream mit Fortschritts-Events."""
+    if "file" in request.files:
+        text = request.files["file"].read().decode("utf-8-sig", "replace")
+    elif request.is_json:
+        text = "\n".join(map(str, (request.get_json() or {}).get("eans", [])))
+    else:
+        text = request.get_data(as_text=True)
+
+    eans = parse_eans(text)
+    if not eans:
+        return jsonify(ok=False, msg="Keine EANs gefunden"), 400
+
+    events = (json.dumps(ev) + "\n" for ev in prefetch(eans))
+    return Response(stream_with_context(events), mimetype="application/x-ndjson")
+
+
+@app.cli.command("prefetch")
+@click.argument("file", type=click.File("r", encoding="utf-8-sig"))
+def prefetch_cmd(file):
+    """EANs aus FILE (CSV/Text, '-' = stdin) vorab in den Katalog importieren."""
+    for ev in prefetch(parse_eans(file.read())):
+        click.echo(json.dumps(ev))
+
+
+@app.cli.command("export-slips")
+@click.argument("out", type=click.File("wb"))
+@click.option("--q", default="", help="Suchbegriff (Kunde / Bestell-Nr.)")
+@click.option("--from", "date_from", help="YYYY-MM-DD")
+@click.option("--to", "date_to", help="YYYY-MM-DD (inkl.)")
+@click.option("--format", "fmt", type=click.Choice(["zip", "pdf"]), default="zip")
+def export_slips_cmd(out, q, date_from, date_to, fmt):
+    """Sammel-Export wie /slips/export nach OUT ('-' = stdout), ohne HTTP-Timeout."""
+    stmt = slip_query(q, date_from, date_to)
+    if fmt == "pdf":
+        export_pdf(stmt, out)
+        return
+    for block in export_zip(stmt):
+        out.write(block)
+
+
+@app.cli.command("icecat-reprocess")
+@click.option("--dry-run", is_flag=True, help="Nur zählen, nichts ändern")
+@click.option("--processes", type=int, default=None, help="Prozesse (Standard: REPROCESS_PROCESSES)")
+def icecat_reprocess_cmd(dry_run, processes):
+    """Gespeicherte Icecat-Antworten neu auswerten, statt alle Produkte neu abzufragen."""
+    from icecat_reprocess import reprocess, REPROCESS_PROCESSES
+    stats = reprocess(apply=not dry_run, processes=processes or REPROCESS_PROCESSES)
+    for key in ("payloads", "eans", "hits", "updated", "created", "unchanged"):
+        click.echo(f"{key:10s} {stats[key]}")
+
+
+def _echo_schema():
+    current, todo = schema_status()
+    for ver, title, _ in MIGRATIONS:
+        click.echo(f"{'✓' if ver <= current else ' '} {ver:3d}  {title}")
+    return todo
+
+@app.cli.command("schema")
+def schema_cmd():
+    """Schema-Stand anzeigen (nur lesend); offene Schritte spielt `upgrade` ein."""
+    if _echo_schema():
+        sys.exit(1)
+
+@app.cli.command("upgrade")
+def upgrade_cmd():
+    """Tabellen anlegen und offene Schema-Schritte einspielen (vor dem Start der Worker)."""
+    upgrade_schema()
+    _echo_schema()
+
 # ── Produkt-Form anzeigen / bearbeiten ───────────────────────────────
 @app.get("/admin/product/<int:pid>")
 @login_required
 def admin_product(pid):
-    with Session(engine) as s:
+    with session_scope() as s:
         row = s.execute(
                 select(
                     product.c.id,
                     product.c.ean,
                     product.c.name,
                     product.c.category_id,
-                    brand.c.name.label("brand")        # Hersteller
+                    product.c.brand_id
                 )
-                .select_from(product)
-                .outerjoin(brand, brand.c.id == product.c.brand_id)
                 .where(product.c.id == pid)
             ).first()
 
@@ -171,14 +319,12 @@ def admin_product(pid):
         abort(404)
 
     prod = dict(row._mapping)          #  ← ***JSON-fähig!***
-
-    with Session(engine) as s:
-        cats = s.execute(select(category)).all()
+    prod["brand"] = refdata.brand_name(prod.pop("brand_id"))   # Hersteller
 
     return render_template(
         "admin_form.html",
         prod=prod,                      #  ← wirklich ein dict
-        cats=cats,
+        cats=refdata.categories(),
         title="Produkt bearbeiten"
     )
 
@@ -187,9 +333,8 @@ def admin_product(pid):
 @app.get("/admin/product/new")
 @login_required
 def admin_product_new():
-    with Session(engine) as s:
-        cats = s.execute(select(category)).all()
-    return render_template("admin_form.html", prod=None, cats=cats, title="Produkt anlegen")
+    return render_template("admin_form.html", prod=None, cats=refdata.categories(),
+                           title="Produkt anlegen")
 
 
 # ── Speichern (AJAX JSON) ─────────────────────────────────────────────
@@ -198,16 +343,19 @@ def admin_product_new():
 def api_save_product():
     data = request.get_json()
 
-    # --- Brand auflösen -------------------------------------------------
     brand_name = (data.pop("brand", "") or "").strip()
-    brand_id   = _ensure_brand(brand_name) if brand_name else None
-    if brand_id:
-        data["brand_id"] = brand_id       # in die Daten für INSERT/UPDATE einfügen
 
     ok, msg = True, "Gespeichert"
+    old_ean = None
     try:
-        with Session(engine) as s, s.begin():
+        with session_scope() as s, s.begin():
+            # --- Brand auflösen (gleiche Transaktion) -------------------
+            if brand_name:
+                data["brand_id"] = _ensure_brand(brand_name, s)
+
             if data.get("id"):
+                old_ean = s.scalar(select(product.c.ean)
+                                   .where(product.c.id == data["id"]))
                 s.execute(product.update()
                           .where(product.c.id == data["id"])
                           .values(**data))
@@ -215,188 +363,331 @@ def api_save_product():
                 s.execute(insert(product).values(**data))
     except Exception as e:
         ok, msg = False, str(e)
-
-    return jsonify(ok=ok, msg=msg)
-
-# ---------------------------------------------------------
-def _next_slip_number(session) -> str:
-    """liefert YYYY-MM-DD-NNN (NNN = 001, 002 … pro Tag)"""
-    today = date.today().strftime("%Y-%m-%d")          # z. B. 2025-06-28
-    pattern = f"{today}-%"                             # LIKE-Pattern
-
-    max_num = session.scalar(
-        select(func.max(slip.c.number))
-        .where(slip.c.number.like(pattern))
-    )
-    if max_num:
-        # letzte Sequenz extrahieren, +1
-        last_idx = int(max_num.rsplit("-", 1)[1])
-        next_idx = f"{last_idx+1:03d}"
     else:
-        next_idx = "001"
-
-    return f"{today}-{next_idx}"
-# ---------------------------------------------------------
-
-# ───────────────────────── Ressourcen ──────────────────────────
-BASE_DIR  = Path(__file__).parent
-FONT_PATH = BASE_DIR / "fonts" / "DejaVuSans.ttf"
-LOGO_PATH = BASE_DIR / "logo.png"
-
-# ───────────────────────── Layout-Konstanten ────────────────────
-PAGE_MARGIN = 15
-LINE_H      = 7
-COLS   = ["Pos.", "Menge", "Kategorie", "Produkt", "Serien-Nr", "BC"]
-WIDTHS = [10,      13,       27,          85,       35,          10]
-
-ADDR_LEFT = (
-    "<FIRMENNAME>\n"
-    "<STANDORT-BEZEICHNUNG>\n"
-    "<STRASSE> <HAUSNUMMER>\n"
-    "<PLZ> <ORT>\n"
-    "Tel.: <LÄNDERVORWAHL> <TELEFONNUMMER>"
-)
+        invalidate_product(old_ean, data.get("ean"))    # Lookup-Cache
 
-ADDR_RIGHT = (
-    "<FIRMENNAME>\n"
-    "<STANDORT-BEZEICHNUNG>\n"
-    "<STRASSE> <HAUSNUMMER>\n"
-    "<PLZ> <ORT>\n"
-    "Tel.: <LÄNDERVORWAHL> <TELEFONNUMMER>"
-)
-
-
-# ────────────────────────────────────────────────────────────────
+    return jsonify(ok=ok, msg=msg)
 
 # ---------- AJAX-Lookup ----------
 @app.get("/lookup/<ean>")
 @tech_or_admin_required
 def lookup_ean(ean):
-    name, pid = get_or_fetch_product(ean)
-    if not name:
+    info = lookup_product(ean)          # Cache → DB (inkl. Kategorie/Brand) → Icecat
+    if not info:
         return {"ok": False}
 
-    with Session(engine) as s:
-        row = s.execute(
-            select(category.c.name.label("cat"),
-                   brand.c.name.label("brand"))
-            .select_from(product)
-            .join(category, category.c.id == product.c.category_id)
-            .outerjoin(brand,   brand.c.id   == product.c.brand_id)
-            .where(product.c.id == pid)
-        ).first()
-
     return {
         "ok":    True,
-        "pid":   pid,
-        "name":  name,
-        "cat":   row.cat,
-        "brand": row.brand        #  <── NEU
+        "pid":   info["pid"],
+        "name":  info["name"],
+        "cat":   info["cat"],
+        "brand": info["brand"]
     }
 
+# ---------- Katalog für die Scan-Maske (Offline / Delta) ----------
+@app.get("/api/catalogue")
+@tech_or_admin_required
+def api_catalogue():
+    """Vollabzug oder ?since=<version> nur Änderungen; ETag + gzip."""
+    try:
+        since = parse_catalogue_version(request.args.get("since"))
+    except ValueError as e:
+        return jsonify(ok=False, msg=str(e)), 400
+    etag, data, gzipped = build_catalogue(since, gz="gzip" in request.accept_encodings)
+    etag += "-gz" if gzipped else ""
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+    else:
+        resp = Response(data, mimetype="application/json")
+        if gzipped:
+            resp.headers["Content-Encoding"] = "gzip"
+    resp.set_etag(etag)
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.cache_control.no_cache = True                # immer neu prüfen, dann ggf. 304
+    return resp
+
 # ---------- Protokoll-Übersicht ----------
 @app.get("/slips")
 @tech_or_admin_required
 def list_slips():
-    """Tabelle aller erzeugten PDF-Protokolle mit Such- und Datumsfilter."""
+    """Tabelle aller erzeugten PDF-Protokolle mit Such- und Datumsfilter (seitenweise)."""
     q       = request.args.get("q", "").strip()         # Suchbegriff
     date_from = request.args.get("from")                # YYYY-MM-DD
     date_to   = request.args.get("to")
 
-    # --- Basis-Query ---------------------------------------------------
-    stmt = (
-        select(slip.c.number,
-               slip.c.order_no,
-               slip.c.customer,
-               slip.c.created_at)
-        .order_by(slip.c.created_at.desc())
-    )
-
-    # --- Freitext-Suche (LIKE auf Order-Nr. & Kunde) ------------------
-    if q:
-        like = f"%{q}%"
-        stmt = stmt.where(or_(slip.c.order_no.ilike(like),
-                              slip.c.customer.ilike(like)))
+    stmt = slip_query(q, date_from, date_to)
+    return _listing("slips.html", stmt, SLIP_KEYS,
+                    q=q,
+                    date_from=date_from,
+                    date_to=date_to)
 
-    # --- Datumsbereich -------------------------------------------------
-    if date_from:
-        stmt = stmt.where(slip.c.created_at >= date_from)
-    if date_to:
-        # “bis inkl.” → + 1 Tag
-        stmt = stmt.where(slip.c.created_at < f"{date_to} 23:59:59")
+@app.get("/api/slips")
+@tech_or_admin_required
+def api_slips():
+    stmt = slip_query(request.args.get("q", "").strip(),
+                      request.args.get("from"), request.args.get("to"))
+    return _json_page(stmt, SLIP_KEYS)
 
-    with Session(engine) as s:
-        rows = s.execute(stmt).all()
+# ---------- Seriennummern-Suche (Rückverfolgung) ----------
+@app.route("/serials", methods=["GET", "POST"])
+@tech_or_admin_required
+def serial_search():
+    """Eingefügte Seriennummern-Liste (oder ein Anfang mit „prefix“) → Protokoll je Nummer."""
+    text   = request.values.get("q", "")
+    prefix = bool(request.values.get("prefix"))
+    rows, missing, error = [], [], None
+    try:
+        terms = parse_serials(text)
+        if terms:
+            with session_scope() as s:
+                rows, missing = find_serials(s, terms, prefix)
+    except ValueError as e:
+        error = str(e)
+    return render_template("serials.html", title="Seriennummern", q=text, prefix=prefix,
+                           rows=rows, missing=missing, error=error)
+
+@app.route("/api/serials", methods=["GET", "POST"])
+@tech_or_admin_required
+def api_serials():
+    """GET ?q=<Nummer(n)>&prefix=1 · POST {"sns": [...], "prefix": true} → {items, missing}."""
+    data = request.get_json(silent=True) if request.method == "POST" else None
+    if isinstance(data, dict):
+        text   = "\n".join(map(str, data.get("sns") or []))
+        prefix = bool(data.get("prefix"))
+    else:
+        text   = request.values.get("q") or request.get_data(as_text=True)
+        prefix = bool(request.values.get("prefix"))
+    try:
+        terms = parse_serials(text)
+    except ValueError as e:
+        return jsonify(ok=False, msg=str(e)), 400
+    with session_scope() as s:
+        rows, missing = find_serials(s, terms, prefix)
+    return jsonify(items=[as_dict(r) for r in rows], missing=missing)
+
+# ---------- Sammel-Export (gleiche Filter wie /slips) ----------
+@app.get("/slips/export")
+@tech_or_admin_required
+def export_slips():
+    """
+    Alle Protokolle der Auswahl als ZIP (format=zip, gestreamt) oder ein Sammel-PDF
+    (format=pdf: rendert im Hintergrund, die Warteseite lädt es danach über einen Link).
+    """
+    stmt = slip_query(request.args.get("q", "").strip(),
+                      request.args.get("from"), request.args.get("to"))
+    fmt  = request.args.get("format", "zip")
+    name = "Protokolle_{}_{}".format(request.args.get("from") or "alle",
+                                     request.args.get("to") or date.today().isoformat())
+    if fmt == "pdf":
+        key     = export_key(stmt)
+        pdf_url = url_for("export_pdf_file", key=key, name=name + ".pdf")
+        if pdf_cache.get(key) is not None:
+            return redirect(pdf_url)
+        submit_pdf(stmt, key)
+        return render_template("export_wait.html", title="Sammel-PDF", pdf_url=pdf_url,
+                               status_url=url_for("export_pdf_status", key=key),
+                               back_url=url_for("list_slips", q=request.args.get("q", ""),
+                                                **{"from": request.args.get("from") or "",
+                                                   "to":   request.args.get("to") or ""})), 202
+    return Response(stream_with_context(export_zip(stmt)), mimetype="application/zip",
+                    headers={"Content-Disposition": f'attachment; filename="{name}.zip"'})
+
+_EXPORT_KEY = re.compile(r"[0-9a-f]{64}")
+
+@app.get("/api/export-status/<key>")
+@tech_or_admin_required
+def export_pdf_status(key):
+    if not _EXPORT_KEY.fullmatch(key):
+        abort(404)
+    return {"ok": True, **export_status(key)}
 
-    return render_template("slips.html",
-                           rows=rows,
-                           q=q,
-                           date_from=date_from,
-                           date_to=date_to)
+@app.get("/slips/export/<key>.pdf")
+@tech_or_admin_required
+def export_pdf_file(key):
+    """Fertiges Sammel-PDF aus dem PDF-Cache (Name kommt von der Warteseite)."""
+    f = pdf_cache.open_file(key) if _EXPORT_KEY.fullmatch(key) else None
+    if f is None:
+        return "Sammel-PDF nicht (mehr) vorhanden – bitte neu exportieren", 404
+    resp = send_file(f, download_name=request.args.get("name") or "Protokolle.pdf",
+                     as_attachment=True, mimetype="application/pdf")
+    resp.content_length = os.fstat(f.fileno()).st_size
+    return resp
 
     
 # ---------- Next-Number ----------
 @app.get("/api/next-number")
 @tech_or_admin_required
 def next_number():
-    with Session(engine) as s:
-        return {"number": _next_slip_number(s)}
+    """Voraussichtliche nächste Nummer – vergeben wird erst beim Speichern."""
+    with session_scope() as s:
+        return {"number": preview_number(s)}
 
 
 # ---------- Neue Maske ----------
 @app.get("/")
 @tech_or_admin_required
 def new_slip():
-    with Session(engine) as s:
-        cats  = s.execute(select(category)).all()
-        nr    = _next_slip_number(s)        # ← hier erzeugen
-    return render_template("new_slip.html", cats=cats, slip_no=nr)
+    with session_scope() as s:
+        nr    = preview_number(s)           # nur Anzeige, gezogen wird in save_slip
+    return render_template("new_slip.html", cats=refdata.categories(), slip_no=nr)
 
 # ---------- Speichern ----------
+def _parse_slip(data) -> tuple[dict, list[dict]]:
+    """Request-Body prüfen, bevor die Transaktion beginnt (ValueError → 400)."""
+    if not isinstance(data, dict):
+        raise ValueError("JSON-Objekt erwartet")
+
+    def text(key, col, required=False):
+        val = str(data.get(key) or "").strip()
+        if required and not val:
+            raise ValueError(f"{key} fehlt")
+        if len(val) > col.type.length:
+            raise ValueError(f"{key} ist länger als {col.type.length} Zeichen")
+        return val
+
+    hdr = dict(order_no=text("order_no", slip.c.order_no),
+               customer=text("customer", slip.c.customer))
+
+    raw = data.get("items")
+    if not isinstance(raw, list) or not raw:
+        raise ValueError("Keine Positionen")
+    items, seen = [], set()
+    for pos, it in enumerate(raw, 1):
+        try:
+            pid = int(it["product_id"])
+            qty = int(it.get("quantity", 1))
+        except (TypeError, KeyError, ValueError):
+            raise ValueError(f"Position {pos}: Produkt/Menge ungültig") from None
+        if qty < 1:
+            raise ValueError(f"Position {pos}: Menge muss ≥ 1 sein")
+        sns = it.get("sns") or []
+        if not isinstance(sns, list):
+            raise ValueError(f"Position {pos}: Seriennummern als Liste erwartet")
+        sns = [str(sn).strip() for sn in sns if str(sn).strip()]
+        if any(len(sn) > serial.c.sn.type.length for sn in sns):
+            raise ValueError(f"Position {pos}: Seriennummer zu lang")
+        for sn in sns:
+            if normalize_sn(sn) in seen:
+                raise ValueError(f"Position {pos}: Seriennummer {sn} doppelt im Protokoll")
+            seen.add(normalize_sn(sn))
+        items.append(dict(product_id=pid, quantity=qty, sns=sns))
+    return hdr, items
+
+def _insert_items(s, slip_id: int, items: list[dict]) -> list[int]:
+    """Alle Positionen mit einem Statement; IDs in Eingabe-Reihenfolge."""
+    rows = [dict(slip_id=slip_id, product_id=it["product_id"], quantity=it["quantity"])
+            for it in items]
+    if s.bind.dialect.insert_executemany_returning_sort_by_parameter_order:
+        return list(s.scalars(
+            insert(slip_item).returning(slip_item.c.id, sort_by_parameter_order=True),
+            rows,
+        ))
+    # Server ohne RETURNING (MySQL, MariaDB < 10.5): eine Zeile je Statement
+    return [s.execute(insert(slip_item).values(**r)).inserted_primary_key[0] for r in rows]
+
+# Bestätigung doppelter Seriennummern: die 409-Antwort liefert ein signiertes Token über genau
+# die gemeldeten Nummern – nur damit (oder als Admin mit allow_duplicates) wird gespeichert
+DUP_CONFIRM_TTL = 600                                 # s
+_dup_signer = URLSafeTimedSerializer(app.secret_key, salt="serial-duplicates")
+
+def _confirmed_duplicates(token) -> set:
+    if not token:
+        return set()
+    try:
+        return set(_dup_signer.loads(token, max_age=DUP_CONFIRM_TTL))
+    except (BadSignature, TypeError):
+        return set()
+
 @app.post("/api/save-slip")
 @tech_or_admin_required
 def save_slip():
-    data = request.get_json()
-    hdr   = dict(number=data["number"],
-                 order_no=data.get("order_no", ""),
-                 customer=data.get("customer", ""))
-    items = data["items"]
-
-    with Session(engine) as s, s.begin():
-        s.execute(insert(slip).values(**hdr).prefix_with("IGNORE"))
-        slip_id = s.scalar(select(slip.c.id).where(slip.c.number == hdr["number"]))
-
-        for it in items:
-            item_id = s.scalar(
-                insert(slip_item)
-                   .values(
-                      slip_id=slip_id,
-                      product_id=it["product_id"],
-                      quantity=it.get("quantity", 1)    # hier die Menge
-                    )
-                .prefix_with("IGNORE")
-                .returning(slip_item.c.id)
-            )
-            if it["sns"]:
-                s.execute(insert(serial),
-                          [{"item_id": item_id, "sn": sn} for sn in it["sns"]])
-
-    return {"ok": True, "pdf_url": f"/pdf/{hdr['number']}"}
+    data = request.get_json(silent=True)
+    try:
+        hdr, items = _parse_slip(data)
+    except ValueError as e:
+        return jsonify(ok=False, msg=str(e)), 400
+
+    pids  = {it["product_id"] for it in items}
+    norms = [normalize_sn(sn) for it in items for sn in it["sns"]]
+    override  = session.get("role") == "admin" and bool(data.get("allow_duplicates"))
+    confirmed = _confirmed_duplicates(data.get("confirm_duplicates"))
+    with session_scope() as s, s.begin():
+        # zuerst sperren: wer dieselbe Nummer gleichzeitig speichert, wartet bis zum Commit
+        serial_index.lock(s, norms)
+        known = set(s.scalars(select(product.c.id).where(product.c.id.in_(pids))))
+        if pids - known:
+            return jsonify(ok=False, msg=f"Unbekannte Produkt-IDs: {sorted(pids - known)}"), 400
+
+        # schon ausgeliefert? → 409, außer der Techniker bestätigt genau diese Nummern
+        dups = [] if override else serial_index.duplicates(s, norms, exact=True)
+        if {r.sn_norm for r in dups} - confirmed:
+            return jsonify(ok=False, duplicates=[as_dict(r) for r in dups],
+                           confirm=_dup_signer.dumps(sorted({r.sn_norm for r in dups})),
+                           msg="Bereits ausgelieferte Seriennummer(n): " +
+                               ", ".join(dict.fromkeys(r.sn for r in dups))), 409
+
+        slip_id  = insert_header(s, hdr)
+        item_ids = _insert_items(s, slip_id, items)
+        sns = [{"item_id": item_id, "sn": sn, "sn_norm": normalize_sn(sn)}
+               for item_id, it in zip(item_ids, items) for sn in it["sns"]]
+        if sns:
+            s.execute(insert(serial), sns)         # ein executemany für alle Seriennummern
+        number = claim_number(s, slip_id)         # zuletzt: Tageszähler nur bis zum Commit gesperrt
+
+    serial_index.add(norms)
+    pdf_jobs.submit(number)                           # PDF schon mal vorrendern
+    return {"ok": True, "number": number, "pdf_url": f"/pdf/{number}",
+            "status_url": f"/api/pdf-status/{number}"}
+
+# ---------- Seriennummer schon ausgeliefert? (beim Scannen) ----------
+@app.get("/api/serial-check")
+@tech_or_admin_required
+def serial_check():
+    """?sn=<Nr>[&sn=…] → {"duplicates": [...]}: frühere Protokolle zu diesen Nummern."""
+    norms = list(dict.fromkeys(n for n in map(normalize_sn, request.args.getlist("sn")) if n))
+    if len(norms) > MAX_TERMS:
+        return jsonify(ok=False, msg=f"Höchstens {MAX_TERMS} Seriennummern"), 400
+    with session_scope() as s:
+        dups = serial_index.duplicates(s, norms)
+    return jsonify(duplicates=[as_dict(r) for r in dups])
+
+# ---------- PDF-Status (Vorrendern) ----------
+@app.get("/api/pdf-status/<number>")
+@tech_or_admin_required
+def pdf_status(number):
+    st = pdf_jobs.status(number)
+    if st["state"] == "missing":
+        return {"ok": False, **st}, 404
+    return {"ok": True, "pdf_url": f"/pdf/{number}", **st}
 
 # ---------- Manuelles Produkt ----------
 @app.post("/api/manual-product")
 def manual_product():
     data = request.get_json()
-    brand_id = _ensure_brand(data.get("brand") or "")
-    with Session(engine) as s, s.begin():
+    with session_scope() as s, s.begin():
+        brand_id = _ensure_brand(data.get("brand") or "", s)
         pid = s.scalar(
             insert(product)
             .values(ean=data["ean"], name=data["name"],
                     category_id=data["category_id"], brand_id=brand_id)
             .prefix_with("IGNORE")
             .returning(product.c.id))
+    invalidate_product(data["ean"])
     return {"ok": True, "pid": pid, "name": data["name"]}
 
+# ---------- Betriebswerte (Prometheus-Textformat) ----------
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+@app.get("/metrics", endpoint="metrics")
+def metrics_view():
+    """Kennzahlen aller Worker – für Scraper per „Authorization: Bearer <METRICS_TOKEN>“,
+    sonst nur für angemeldete Admins. Ohne METRICS_TOKEN gibt es keinen anonymen Zugang."""
+    auth = request.headers.get("Authorization", "")
+    if not (METRICS_TOKEN and hmac.compare_digest(auth, f"Bearer {METRICS_TOKEN}")) \
+            and session.get("role") != "admin":
+        abort(401)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 # ---------------------------
 @app.context_processor
 def inject_year():
@@ -407,237 +698,33 @@ def inject_year():
 @app.get("/pdf/<number>")
 @tech_or_admin_required
 def pdf_slip(number):
+    """PDF aus dem Platten-Cache (Schlüssel = Inhalts-Hash = ETag), sonst rendern."""
     try:
-        pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=PAGE_MARGIN)
-        pdf.add_font("DejaVu", "",  str(FONT_PATH), uni=True)
-        pdf.add_font("DejaVu", "B", str(FONT_PATH), uni=True)
-        pdf.add_font("DejaVu", "I", str(FONT_PATH), uni=True)   # Italic  ← NEU
-        pdf.alias_nb_pages()
-        pdf.add_page()
-
-        # ── Briefkopf ────────────────────────────────────────────
-        pdf.set_font("DejaVu", "", 8)
-        
-        # linke Adresse  --------------------------------------------------------
-        pdf.set_xy(PAGE_MARGIN, PAGE_MARGIN)
-        pdf.multi_cell(60, 4, ADDR_LEFT)      # ganzer Block, 60 mm breit
-        
-        # Logo (40 mm) wirklich zentriert, 6 mm unter Seitenrand ---------------
-        logo_w = 40
-        logo_y = PAGE_MARGIN              
-        if LOGO_PATH.exists():
-            pdf.image(str(LOGO_PATH),
-                      x=(pdf.w - logo_w) / 2,
-                      y=logo_y,
-                      w=logo_w)
-        
-        # rechte Adresse  -------------------------------------------------------
-        pdf.set_xy(pdf.w - PAGE_MARGIN - 60, PAGE_MARGIN)
-        pdf.multi_cell(60, 4, ADDR_RIGHT, align="R")
-        
-        # Trennlinie unter Logo/Adressen  --------------------------------------
-        pdf.set_y(logo_y + logo_w + 0.1)
-        pdf.line(PAGE_MARGIN, pdf.get_y(),
-                 pdf.w - PAGE_MARGIN, pdf.get_y())
-        pdf.ln(4)
-
-        # ── Titel + Meta ─────────────────────────────────────────
-        with Session(engine) as s:
-            hdr = s.execute(
-                select(slip.c.order_no, slip.c.customer, slip.c.created_at)
-                .where(slip.c.number == number)
-            ).first()
+        pdf_jobs.wait(number)                        # läuft gerade das Vorrendern?
+        hdr, rows = load_slip(number)
         if not hdr:
             return "Dokument nicht gefunden", 404
-        
-        pdf.set_font("DejaVu", "B", 14)
-        pdf.set_x(PAGE_MARGIN)                       # ← Titel ausrichten
-        pdf.cell(0, 8, "Seriennummernprotokoll", ln=1)
-        
-        pdf.set_font("DejaVu", "B", 11)
-        LBL = 32                                     # Label-Spaltenbreite
-        
-        # Bestell-Nr.
-        pdf.set_x(PAGE_MARGIN)
-        pdf.cell(LBL, 6, "Bestell-Nr.:")
-        pdf.cell(0,   6, hdr.order_no or "-", ln=1)
-        
-        # Kunde
-        pdf.set_x(PAGE_MARGIN)
-        pdf.cell(LBL, 6, "Kunde:")
-        pdf.cell(0,   6, hdr.customer or "-", ln=1)
-        
-        # Datum
-        pdf.set_x(PAGE_MARGIN)
-        pdf.cell(LBL, 6, "Datum:")
-        pdf.cell(0,   6, f"{hdr.created_at:%d.%m.%Y}", ln=1)
-        
-        pdf.ln(4)
-
-        # ── Tabellen-Kopf ───────────────────────────────────────
-        pdf.set_fill_color(230, 230, 230)
-        pdf.set_font("DejaVu", "B", 9)
-        pdf.set_x(PAGE_MARGIN)
-        for w, label in zip(WIDTHS, COLS):
-            pdf.cell(w, LINE_H, label, 1, 0, "C", fill=True)
-        pdf.ln(LINE_H)
-        
-        pdf.set_font("DejaVu", "", 8)               # zurück auf Normal
-        
-        # ── Daten abfragen ──────────────────────────────────────
-        with Session(engine) as s:
-          stmt = (
-              select(
-                  slip_item.c.id.label("pos_id"),
-                  slip_item.c.quantity.label("qty"),              # neu
-                  category.c.name.label("cat"),
-                  product.c.name.label("prod"),
-                  func.group_concat(serial.c.sn.op("ORDER BY")(serial.c.sn))
-                      .label("sns")
-              )
-              .select_from(slip)
-              .join(slip_item, slip_item.c.slip_id == slip.c.id)
-              .join(product,   product.c.id       == slip_item.c.product_id)
-              .join(category,  category.c.id      == product.c.category_id)
-              .outerjoin(serial, serial.c.item_id == slip_item.c.id)
-              .where(slip.c.number == number)
-              .group_by(
-                  slip_item.c.id,
-                  slip_item.c.quantity,                           # neu
-                  category.c.name,
-                  product.c.name
-              )
-              .order_by(slip_item.c.id)
-          )
-      
-          # vorausgesetzt, stmt selektiert bereits auch slip_item.c.quantity.label("qty")
-          y   = pdf.get_y()
-          pos = 1     
-          with Session(engine) as s:
-              for row in s.execute(stmt):
-                  # ── Basisparameter ────────────────────────────────
-                  pdf.set_font("DejaVu", "", 8)
-                  general_h     = LINE_H               # Zeilenhöhe für Spalten 1–4
-                  padding       = 1                    # mm Innenabstand
-                  barcode_h     = 6                    # mm Barcode/DataMatrix-Höhe
-          
-                  # ── Spaltenbreiten ───────────────────────────────
-                  w1, w2, w3, w4 = WIDTHS[:4]          # Pos, Menge, Kategorie, Produkt
-                  w_sn           = WIDTHS[4]           # Seriennummern-Spalte
-                  w_bc           = WIDTHS[5] if len(WIDTHS) > 5 else 0  # optional DataMatrix
-          
-                  # ── Texte holen ───────────────────────────────────
-                  pos_text    = str(pos)
-                  qty_text    = str(row.qty)
-                  cat_text    = row.cat   or "-"
-                  prod_text   = row.prod  or "-"
-                  sns_list    = [sn.strip() for sn in (row.sns or "").split(",") if sn.strip()]
-                  serial_text = ", ".join(sns_list) if sns_list else "-"
-          
-                  # ── Höhe Spalten 1–4 ermitteln ────────────────────
-                  max_lines = max(
-                      len(pdf.multi_cell(w, general_h, t, split_only=True))
-                      for w, t in zip((w1, w2, w3, w4),
-                                      (pos_text, qty_text, cat_text, prod_text))
-                  )
-                  text_h = max_lines * general_h
-          
-                  # ── Höhe Serien-Text ermitteln ───────────────────
-                  pdf.set_font("DejaVu", "", 6)
-                  serial_line_h = pdf.font_size_pt * 25.4 / 72
-                  serial_lines  = pdf.multi_cell(w_sn, serial_line_h, serial_text, split_only=True)
-                  serial_h      = len(serial_lines) * serial_line_h
-          
-                  # ── Gesamt-Zellenhöhe ─────────────────────────────
-                  content_h = max(text_h, barcode_h, serial_h)
-                  row_h     = content_h + 2 * padding
-          
-                  # ── Spalten 1–4 zeichnen (zentriert) ─────────────
-                  x = PAGE_MARGIN
-                  for w, txt in zip((w1, w2, w3, w4), (pos_text, qty_text, cat_text, prod_text)):
-                      # 1) Zeilen nur zählen, nicht direkt ausgeben
-                      lines = pdf.multi_cell(w, general_h, txt, split_only=True)
-                      text_h = len(lines) * general_h
-                  
-                      # 2) Y so berechnen, dass der Textblock zentriert ist
-                      y_text = y + (row_h - text_h) / 2
-                  
-                      # 3) Für jede Zeile linksbündig ausgeben
-                      for line in lines:
-                          pdf.set_xy(x, y_text)
-                          pdf.cell(w, general_h, line, border=0, align="L")
-                          y_text += general_h
-                  
-                      # 4) Rahmen um die volle Zellenhöhe
-                      pdf.rect(x, y, w, row_h)
-                      x += w
-          
-                  # ── Seriennummern-Spalte ─────────────────────────
-                  x_sn = x
-                  pdf.set_xy(x_sn, y)
-                  pdf.rect(x_sn, y, w_sn, row_h)
-                  y_text = y + (row_h - serial_h) / 2
-                  pdf.set_font("DejaVu", "", 6)
-                  for line in serial_lines:
-                      pdf.set_xy(x_sn, y_text)
-                      pdf.cell(w_sn, serial_line_h, line, border=0, align="C")
-                      y_text += serial_line_h
-                  x += w_sn
-          
-                  # ── DataMatrix-Spalte (optional) ─────────────────
-                  if w_bc:
-                      pdf.set_xy(x, y)
-                      pdf.rect(x, y, w_bc, row_h)
-                      buf = io.BytesIO()
-                      dmtx = dmtx_encode(serial_text.encode("utf8"))
-                      img  = Image.frombytes("RGB", (dmtx.width, dmtx.height), dmtx.pixels)
-                      img.save(buf, format="PNG")
-                      buf.seek(0)
-                      inner_w = w_bc - 2 * padding
-                      aspect  = dmtx.width / dmtx.height
-                      bc_h    = barcode_h
-                      bc_w    = bc_h * aspect
-                      if bc_w > inner_w:
-                          bc_w = inner_w
-                          bc_h = bc_w / aspect
-                      bc_x = x + (w_bc - bc_w) / 2
-                      bc_y = y + (row_h - bc_h) / 2
-                      pdf.image(buf, x=bc_x, y=bc_y, w=bc_w, h=bc_h)
-                      x += w_bc
-          
-                  # ── Nächste Zeile ────────────────────────────────
-                  y += row_h
-                  pdf.set_y(y)
-                  pos += 1
-
-        # ── Footer (Seitennummer) ───────────────────────────────
-        pdf.set_auto_page_break(auto=False)    # für Footer-Korrektur
-        for page_no in range(1, pdf.page_no() + 1):
-            pdf.page = page_no
-            pdf.set_y(-15)
-            pdf.set_font("DejaVu", "I", 7)
-            pdf.cell(0, 5,
-                     f"Seite {page_no}/{pdf.page_no()}", 0, 0, "C")
-
-        # ---------- PDF ausliefern ----------
-        stream = io.BytesIO(pdf.output(dest="S"))
-        stream.seek(0)
-        
-        # ------- Dateiname bauen ------------
-        safe_order = slug(hdr.order_no)          # Bestell-Nr.
-        safe_cust  = slug(hdr.customer)
-        safe_date  = hdr.created_at.strftime("%d.%m.%Y")
-        
-        file_name = f"{safe_order}_{safe_cust}_{safe_date}_SNProtokoll.pdf"
-        
-        return send_file(
-            stream,
-            download_name=file_name,             # ← neu!
+
+        etag = content_key(number, hdr, rows)
+        if etag in request.if_none_match:            # Browser hat es schon
+            resp = app.response_class(status=304)
+            resp.set_etag(etag)
+            return resp
+
+        # offene Datei statt Pfad: räumt die Cache-Begrenzung sie gleich weg, wird trotzdem geliefert
+        f = pdf_jobs.open_pdf(number, hdr, rows)
+        resp = send_file(
+            f,
+            download_name=file_name(hdr),
             as_attachment=True,
-            mimetype="application/pdf"
+            mimetype="application/pdf",
+            etag=etag,
+            conditional=True,
         )
+        resp.content_length = os.fstat(f.fileno()).st_size
+        return resp
 
     except Exception:
-        traceback.print_exc(file=sys.stderr)
+        app.logger.exception("PDF %s", number)
+        metrics.errors_total.inc(where="pdf")
         return "Interner PDF-Fehler", 500
@@ -0,0 +1,48 @@
+"""
+barcode.py – DataMatrix-Symbole für die PDF-Protokolle
+
+• encode(payload)        → 1-Bit-PIL-Bild, LRU-gecacht pro Worker (über Requests hinweg)
+• kein PNG-Umweg: fpdf2 nimmt das PIL-Bild direkt und speichert es als CCITT-G4
+• encode_many(payloads)  → alle Symbole eines Protokolls; neue parallel über Threads
+  (libdmtx läuft per ctypes ohne GIL, nutzt also mehrere Kerne)
+"""
+
+from __future__ import annotations
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable
+
+from PIL import Image
+
+from cache import LRUCache
+import metrics
+
+BARCODE_CACHE_SIZE = int(os.getenv("BARCODE_CACHE_SIZE", "20000"))   # Symbole pro Worker
+BARCODE_THREADS    = int(os.getenv("BARCODE_THREADS", str(os.cpu_count() or 2)))
+PARALLEL_MIN       = 16          # darunter lohnt der Thread-Pool nicht
+
+_pool = ThreadPoolExecutor(max_workers=BARCODE_THREADS, thread_name_prefix="dmtx")
+
+def _dmtx_encode(data: bytes):
+    # libdmtx erst beim ersten Symbol laden – ohne libdmtx (Tests, CLI) bleibt das Modul importierbar
+    from pylibdmtx.pylibdmtx import encode
+    return encode(data)
+
+_cache = LRUCache(maxsize=BARCODE_CACHE_SIZE, ttl=float("inf"))   # Symbole veralten nie
+
+def encode(payload: str) -> Image.Image:
+    """DataMatrix für `payload` als Schwarz-Weiß-Bild (Modus "1")."""
+    img = _cache.get(payload)
+    metrics.cache_hit("barcode", img is not None)
+    if img is None:
+        dmtx = _dmtx_encode(payload.encode("utf8"))
+        img  = Image.frombytes("RGB", (dmtx.width, dmtx.height), dmtx.pixels).convert("1")
+        _cache.set(payload, img)
+    return img
+
+def encode_many(payloads: Iterable[str]) -> Dict[str, Image.Image]:
+    """{Payload: Bild} für alle (eindeutigen) Payloads."""
+    todo = list(dict.fromkeys(payloads))
+    if len(todo) < PARALLEL_MIN:
+        return {p: encode(p) for p in todo}
+    return dict(zip(todo, _pool.map(encode, todo)))
@@ -0,0 +1,221 @@
+"""
+cache.py – Kleine Cache-Bausteine für Lookups
+
+• LRUCache:     begrenzter LRU/TTL-Cache im Prozess (pro gunicorn-Worker)
+• SqliteStore:  optional geteilte Stufe in einer SQLite-Datei (alle Worker eines Hosts)
+• TieredCache:  fragt erst den Worker-Cache, dann die geteilte Stufe; bump() lässt alle
+                Worker ihren Cache verwerfen (Generation in der geteilten Stufe)
+Werte der geteilten Stufe müssen JSON-serialisierbar sein.
+"""
+
+from __future__ import annotations
+import json, os, sqlite3, threading, time
+from collections import OrderedDict
+from typing import Any, Optional
+
+_MISSING = object()          # Marker für "kein Eintrag" (None ist ein gültiger Wert)
+
+GEN_KEY   = "\0generation"   # Schlüssel der Generation in der geteilten Stufe
+GEN_TTL   = 10 * 365 * 86400
+GEN_CHECK = 1.0              # s – so oft schaut ein Worker nach der Generation
+PURGE_EVERY = 500            # nach so vielen set() je Prozess abgelaufene Zeilen löschen
+
+# ---------------------------------------------------------------------------
+# 1) Stufe 1: LRU + TTL im Prozess
+# ---------------------------------------------------------------------------
+
+class LRUCache:
+    """Thread-sicherer LRU-Cache mit Ablaufzeit je Eintrag."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl     = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock   = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+# ---------------------------------------------------------------------------
+# 2) Stufe 2: geteilter Speicher in einer SQLite-Datei
+# ---------------------------------------------------------------------------
+
+class SqliteStore:
+    """
+    Einfacher Key-Value-Speicher mit Ablaufzeit, den alle Worker-Prozesse
+    eines Hosts gemeinsam nutzen. Fehler werden geschluckt – ein Cache darf
+    einen Request nie scheitern lassen. Abgelaufene Zeilen räumt purge() weg,
+    automatisch alle PURGE_EVERY Schreibzugriffe.
+    """
+
+    def __init__(self, path: str, namespace: str, ttl: float = 3600.0):
+        self.path      = path
+        self.namespace = namespace
+        self.ttl       = ttl
+        self._local    = threading.local()
+        self._sets     = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        # eine Verbindung pro Thread und Prozess (gunicorn forkt nach dem Import)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " ns TEXT NOT NULL, key TEXT NOT NULL,"
+                " value TEXT NOT NULL, expires REAL NOT NULL,"
+                " PRIMARY KEY (ns, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires)")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            row = self._conn().execute(
+                "SELECT value FROM kv WHERE ns = ? AND key = ? AND expires > ?",
+                (self.namespace, key, time.time()),
+            ).fetchone()
+        except sqlite3.Error:
+            return default
+        return json.loads(row[0]) if row else default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO kv (ns, key, value, expires) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), expires),
+            )
+        except sqlite3.Error:
+            pass
+        self._sets += 1                      # ungefähr reicht (kein Lock nötig)
+        if self._sets >= PURGE_EVERY:
+            self._sets = 0
+            self.purge()
+
+    def purge(self) -> int:
+        """Abgelaufene Zeilen aller Namespaces löschen → Anzahl (die Datei wächst sonst ewig)."""
+        try:
+            return self._conn().execute(
+                "DELETE FROM kv WHERE expires < ?", (time.time(),)).rowcount
+        except sqlite3.Error:
+            return 0
+
+    def delete(self, key: str) -> None:
+        try:
+            self._conn().execute(
+                "DELETE FROM kv WHERE ns = ? AND key = ?", (self.namespace, key))
+        except sqlite3.Error:
+            pass
+
+    def clear(self) -> None:
+        try:
+            self._conn().execute("DELETE FROM kv WHERE ns = ?", (self.namespace,))
+        except sqlite3.Error:
+            pass
+
+# ---------------------------------------------------------------------------
+# 3) Kombination: Worker-Cache vor geteiltem Speicher
+# ---------------------------------------------------------------------------
+
+class TieredCache:
+    """
+    Lesen:      Worker → geteilt (Treffer wird in den Worker-Cache übernommen)
+    Schreiben / Invalidieren: immer beide Stufen
+    Andere Worker (und andere Prozesse wie die CLI) erfahren von einer Invalidierung über
+    bump(): jeder Worker vergleicht höchstens alle GEN_CHECK s die Generation der geteilten
+    Stufe und leert bei einer Änderung seinen Cache. Ohne geteilte Stufe gilt nur die
+    lokale TTL – daher die lokale TTL kurz halten.
+    """
+
+    def __init__(self, local: LRUCache, shared: Optional[SqliteStore] = None):
+        self.local  = local
+        self.shared = shared
+        self._gen: Any    = _MISSING        # zuletzt gesehene Generation
+        self._gen_checked = 0.0
+
+    def _sync(self) -> None:
+        now = time.monotonic()
+        if now - self._gen_checked < GEN_CHECK:
+            return
+        self._gen_checked = now
+        gen = self.shared.get(GEN_KEY)
+        if gen != self._gen:
+            if self._gen is not _MISSING:
+                self.local.clear()           # anderer Prozess hat invalidiert
+            self._gen = gen
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if self.shared is not None:
+            self._sync()
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.shared is not None:
+            value = self.shared.get(key, _MISSING)
+            if value is not _MISSING:
+                self.local.set(key, value)
+                return value
+        return default
+
+    def set(self, key: str, value: Any) -> None:
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def delete(self, key: str) -> None:
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self) -> None:
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def bump(self) -> None:
+        """Nach delete(): auch die Worker-Stufen der anderen Prozesse verwerfen lassen."""
+        if self.shared is not None:
+            self.shared.set(GEN_KEY, os.urandom(8).hex(), ttl=GEN_TTL)
+            self.shared.purge()              # seltener Anlass → gleich aufräumen
+
+
+def make_cache(namespace: str, size: int, ttl: float,
+               shared_path: str = "", shared_ttl: float = 3600.0) -> TieredCache:
+    """Baut einen TieredCache; ohne `shared_path` nur mit Worker-Stufe."""
+    shared = SqliteStore(shared_path, namespace, shared_ttl) if shared_path else None
+    return TieredCache(LRUCache(size, ttl), shared)
@@ -0,0 +1,76 @@
+"""
+catalogue.py – Produktkatalog für die Scan-Maske (offline nutzbar, Delta-Abgleich)
+
+• build(since, gz) → (ETag, Bytes, gzip?): alle Produkte oder nur die seit `since` geänderten,
+                    auf Wunsch gzip-komprimiert
+• parse_version() → `since` aus dem Request (ValueError bei Unsinn)
+
+Format: {"version", "full", "items": [[ean, pid, name, cat_id, brand_id], …],
+         "cats": {id: name}, "brands": {id: name}}
+Die Version ist die jüngste product.updated_at minus CATALOGUE_OVERLAP – so kommen auch Zeilen
+mit, deren Transaktion beim letzten Abgleich noch offen war; doppelte Zeilen überschreibt der
+Browser einfach. Der Vollabzug wird pro Worker gemerkt, bis sich der Katalog ändert.
+"""
+
+from __future__ import annotations
+import gzip, hashlib, json, os, threading, time
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import func, select
+
+import metrics, refdata
+from db import session_scope, product
+
+CATALOGUE_OVERLAP   = int(os.getenv("CATALOGUE_OVERLAP", "60"))        # Sekunden
+CATALOGUE_CACHE_TTL = float(os.getenv("CATALOGUE_CACHE_TTL", "300"))   # Vollabzug pro Worker
+
+_lock = threading.Lock()
+_full: Optional[Tuple[tuple, float, str, bytes]] = None       # (Stand, geladen, ETag, gzip-Body)
+
+def parse_version(raw: Optional[str]) -> Optional[datetime]:
+    if not raw:
+        return None
+    try:
+        return datetime.fromisoformat(raw)
+    except ValueError:
+        raise ValueError("Ungültige Katalog-Version") from None
+
+def _state(s) -> tuple:
+    """Änderungsstand – beides über Indizes, ohne den Katalog zu lesen."""
+    return tuple(s.execute(select(func.max(product.c.updated_at), func.max(product.c.id))).one())
+
+def _body(s, since: Optional[datetime], newest: Optional[datetime]) -> Tuple[str, bytes]:
+    stmt = select(product.c.ean, product.c.id, product.c.name,
+                  product.c.category_id, product.c.brand_id)
+    if since is not None:
+        stmt = stmt.where(product.c.updated_at >= since)
+    items = [list(r) for r in s.execute(stmt.order_by(product.c.id))]
+    version = (newest - timedelta(seconds=CATALOGUE_OVERLAP)) if newest else since
+    body = json.dumps({
+        "version": version.isoformat(sep=" ") if version else "",
+        "full":    since is None,
+        "items":   items,
+        "cats":    {i: refdata.category_name(i) for i in {r[3] for r in items}},
+        "brands":  {i: refdata.brand_name(i) for i in {r[4] for r in items} if i is not None},
+    }, ensure_ascii=False, separators=(",", ":")).encode()
+    return hashlib.blake2b(body, digest_size=12).hexdigest(), body
+
+def build(since: Optional[datetime] = None, gz: bool = True) -> Tuple[str, bytes, bool]:
+    global _full
+    with session_scope() as s:
+        state = _state(s)
+        if since is not None:
+            etag, body = _body(s, since, state[0])
+            return (etag, gzip.compress(body, 6), True) if gz else (etag, body, False)
+        full = _full
+        hit  = full is not None and full[0] == state and time.monotonic() - full[1] < CATALOGUE_CACHE_TTL
+        metrics.cache_hit("catalogue", hit)
+        if not hit:
+            with _lock:                        # nur ein Thread baut den Vollabzug
+                full = _full
+                if full is None or full[0] != state or time.monotonic() - full[1] >= CATALOGUE_CACHE_TTL:
+                    etag, body = _body(s, None, state[0])
+                    full = _full = (state, time.monotonic(), etag, gzip.compress(body, 6))
+    etag, data = full[2], full[3]
+    return (etag, data, True) if gz else (etag, gzip.decompress(data), False)
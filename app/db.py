@@ -1,10 +1,127 @@
-import os
+import os, threading, time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from flask import g, has_request_context
 from sqlalchemy import (create_engine, MetaData, Table, Column,
-                        Integer, String, DateTime, ForeignKey, func)
+                        Integer, String, DateTime, ForeignKey, Index, LargeBinary, func)
+from sqlalchemy.dialects.mysql import MEDIUMBLOB
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+import metrics
 
 DB_DSN = os.getenv("DB_DSN", "mysql+pymysql://eanapp:eanpass@db/ean")
-engine  = create_engine(DB_DSN, echo=False, future=True)
+
+# Verbindungs-Pool (pro Worker-Prozess)
+DB_POOL_SIZE       = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW    = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT    = float(os.getenv("DB_POOL_TIMEOUT", "10"))     # s auf freie Verbindung warten
+DB_POOL_RECYCLE    = int(os.getenv("DB_POOL_RECYCLE", "1800"))     # s, < MariaDB wait_timeout
+DB_PRE_PING        = os.getenv("DB_PRE_PING", "1") not in ("0", "false", "no")
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+
+# Zähler statt Gauges: bleiben über beendete Worker hinweg erhalten (metrics._collect)
+pool_checkouts = metrics.Counter("ean_db_pool_checkouts_total", "Entnahmen aus dem Pool")
+pool_wait      = metrics.Counter("ean_db_pool_wait_seconds_total",
+                                 "Summierte Wartezeit auf eine Verbindung")
+pool_timeouts  = metrics.Counter("ean_db_pool_timeouts_total",
+                                 "Requests ohne freie Verbindung (Timeout)")
+
+class _TimedPool(QueuePool):
+    """QueuePool, der die Wartezeit auf eine freie Verbindung mitschreibt (→ /metrics)."""
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self._stat_lock = threading.Lock()
+        self.wait_max   = 0.0
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeout:
+            pool_timeouts.inc()                  # keine Entnahme – zählt nur hier
+            raise
+        finally:
+            waited = time.perf_counter() - t0
+            with self._stat_lock:
+                self.wait_max = max(self.wait_max, waited)
+        pool_checkouts.inc()                     # Wartezeit / Entnahmen = Schnitt je Checkout
+        pool_wait.inc(waited)
+        return conn
+
+def _connect_args() -> Dict[str, int]:
+    if DB_DSN.startswith("mysql") or DB_DSN.startswith("mariadb"):
+        return {"connect_timeout": DB_CONNECT_TIMEOUT}
+    if DB_DSN.startswith("sqlite"):
+        return {"timeout": DB_CONNECT_TIMEOUT}             # Warten auf Schreibsperre
+    return {}
+
+engine  = create_engine(DB_DSN, echo=False, future=True,
+                        poolclass=_TimedPool,
+                        pool_size=DB_POOL_SIZE,
+                        max_overflow=DB_MAX_OVERFLOW,
+                        pool_timeout=DB_POOL_TIMEOUT,
+                        pool_recycle=DB_POOL_RECYCLE,
+                        pool_pre_ping=DB_PRE_PING,
+                        connect_args=_connect_args())
 metadata = MetaData()
+metrics.instrument_engine(engine)              # Dauer/Anzahl aller SQL-Abfragen
+
+def pool_stats() -> Dict[str, float]:
+    """Momentaufnahme des Pools dieses Workers."""
+    pool = engine.pool
+    return {
+        "size":         pool.size(),
+        "checked_out":  pool.checkedout(),
+        "checked_in":   pool.checkedin(),
+        "overflow":     max(pool.overflow(), 0),
+        "wait_max":     getattr(pool, "wait_max", 0.0),
+    }
+
+metrics.Gauge("ean_db_pool_size", "Dauerhafte DB-Verbindungen (DB_POOL_SIZE)",
+              lambda: pool_stats()["size"])
+metrics.Gauge("ean_db_pool_checked_out", "Belegte DB-Verbindungen",
+              lambda: pool_stats()["checked_out"])
+metrics.Gauge("ean_db_pool_checked_in", "Freie DB-Verbindungen im Pool",
+              lambda: pool_stats()["checked_in"])
+metrics.Gauge("ean_db_pool_overflow", "Verbindungen über DB_POOL_SIZE hinaus",
+              lambda: pool_stats()["overflow"])
+metrics.Gauge("ean_db_pool_wait_seconds_max", "Längste Wartezeit auf eine Verbindung",
+              lambda: pool_stats()["wait_max"], merge="max")
+
+# ---------------------------------------------------------------------------
+# Eine Verbindung pro Request
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """Session für einen Block. Im Flask-Request teilen sich alle Blöcke eine Verbindung
+    (ein Checkout/Ping statt einem je Block); am Blockende wird committet, damit der
+    nächste Block Änderungen anderer Transaktionen sieht. Außerhalb: eigene Session."""
+    if not has_request_context():
+        with Session(engine) as s:
+            yield s
+        return
+    if "db_session" not in g:
+        g.db_conn    = engine.connect()
+        g.db_session = Session(bind=g.db_conn)
+    s = g.db_session
+    try:
+        yield s
+        s.commit()
+    except BaseException:
+        s.rollback()
+        raise
+
+def close_request_session(exc=None) -> None:
+    """teardown_appcontext: Session schließen, Verbindung zurück in den Pool."""
+    s = g.pop("db_session", None)
+    if s is not None:
+        s.close()
+        g.pop("db_conn").close()
 
 category = Table(
     "category", metadata,
@@ -17,23 +134,31 @@ product = Table(
     Column("id", Integer, primary_key=True),
     Column("ean", String(32), unique=True, nullable=False),
     Column("name", String(255), nullable=False),
-    Column("category_id", Integer, ForeignKey("category.id"), nullable=False),
-    Column("brand_id",   Integer, ForeignKey("brand.id"),   nullable=True),
+    Column("category_id", Integer, ForeignKey("category.id"), nullable=False, index=True),
+    Column("brand_id",   Integer, ForeignKey("brand.id"),   nullable=True,  index=True),
+    # letzte Änderung (DB-Uhr) – Delta-Abgleich des Katalogs, siehe catalogue.py
+    Column("updated_at", DateTime, default=func.now(), onupdate=func.now(), index=True),
+    Index("ix_product_name_id", "name", "id"),            # Keyset-Blättern /admin
+    # Freitextsuche der Produktverwaltung (SQLite: FTS5 in product_search.py)
+    Index("ft_product_name", "name",
+          mysql_prefix="FULLTEXT", mariadb_prefix="FULLTEXT").ddl_if(dialect=("mysql", "mariadb")),
 )
+# EAN-Präfixsuche (LIKE '400…%') nutzt den Unique-Index auf product.ean
 
 slip = Table(
     "slip", metadata,
     Column("id", Integer, primary_key=True),
     Column("number", String(30), unique=True, nullable=False),
-    Column("order_no", String(30)),
-    Column("customer", String(120)),
-    Column("created_at", DateTime, server_default=func.now())
+    Column("order_no", String(30), index=True),
+    Column("customer", String(120), index=True),
+    Column("created_at", DateTime, server_default=func.now()),
+    Index("ix_slip_created_id", "created_at", "id"),        # Übersicht/Keyset, Datumsfilter
 )
 
 slip_item = Table(
     "slip_item", metadata,
     Column("id", Integer, primary_key=True),
-    Column("slip_id", Integer, ForeignKey("slip.id"), nullable=False),
+    Column("slip_id", Integer, ForeignKey("slip.id"), nullable=False, index=True),
     Column("product_id", Integer, ForeignKey("product.id"), nullable=False),
     Column("quantity",   Integer, nullable=False, default=1),  # neu
 )
@@ -41,8 +166,18 @@ slip_item = Table(
 serial = Table(
     "serial", metadata,
     Column("id", Integer, primary_key=True),
-    Column("item_id", Integer, ForeignKey("slip_item.id"), nullable=False),
+    Column("item_id", Integer, ForeignKey("slip_item.id"), nullable=False, index=True),
     Column("sn", String(100)),
+    Column("sn_norm", String(100), index=True),            # Suchform, siehe serial_search.py
+)
+
+# Sperr-Zeilen: save_slip sperrt je Seriennummer die Zeile crc32(sn_norm) % SERIAL_LOCK_SLOTS
+# bis zum Commit (Zeilen legt migrations.py an, siehe serial_index.lock)
+SERIAL_LOCK_SLOTS = 256
+serial_lock = Table(
+    "serial_lock", metadata,
+    Column("slot", Integer, primary_key=True, autoincrement=False),
+    Column("n", Integer, nullable=False, default=0),
 )
 
 brand = Table(
@@ -51,5 +186,34 @@ brand = Table(
     Column("name", String(120), unique=True, nullable=False),
 )
 
-def init_db() -> None:
-    metadata.create_all(engine)
+# EANs, die weder Icecat noch UPCitemdb kennen (Negativ-Cache)
+lookup_miss = Table(
+    "lookup_miss", metadata,
+    Column("ean", String(32), primary_key=True),
+    Column("tries", Integer, nullable=False, default=1),
+    Column("last_try", DateTime, nullable=False),
+)
+
+# Icecat-Antworten im Original (zlib) – neu auswerten statt neu abfragen, siehe icecat_reprocess.py
+icecat_raw = Table(
+    "icecat_raw", metadata,
+    Column("ean", String(32), primary_key=True),
+    Column("lang", String(8), primary_key=True),
+    Column("fetched_at", DateTime, nullable=False),
+    Column("payload", LargeBinary().with_variant(MEDIUMBLOB, "mysql", "mariadb"), nullable=False),
+)
+
+# Protokoll-Nummern: ein Zähler je Tag, erhöht in der Speicher-Transaktion (slip_numbers.py)
+slip_counter = Table(
+    "slip_counter", metadata,
+    Column("day", String(10), primary_key=True),          # YYYY-MM-DD
+    Column("last", Integer, nullable=False),
+)
+
+# eingespielte Schritte aus migrations.py
+schema_version = Table(
+    "schema_version", metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("title", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
@@ -5,15 +5,30 @@ helpers.py – EAN-Lookup, Icecat-Importer, Cache-Einträge
 • Fragt dann Open-Icecat-Live (gratis) – optional UPCitemdb-Trial
 • Legt neue Kategorien + Hersteller automatisch an
 • Liefert (name, product_id)  oder (None, None)
+• Treffer landen im Lookup-Cache (Worker + optional geteilte SQLite-Datei)
+• Unbekannte EANs landen in `lookup_miss` und werden erst nach
+  LOOKUP_MISS_RETRY_AFTER erneut extern abgefragt
+• Externe Abfragen laufen parallel über einen Keep-Alive-Pool:
+  Icecat (Sprache + en) sofort, UPCitemdb als „Hedge“ nach UPC_HEDGE_DELAY
+• Jeder Provider-Aufruf holt vorher ein Token aus dem gemeinsamen Budget (ratelimit.py);
+  Massen-Importe (bulk=True) laufen über einen eigenen Pool hinter den Scans
 """
 
 from __future__ import annotations
-import os, requests
-from typing import Tuple, Optional, Dict, Any
+import os, threading, time, zlib, requests
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta
+from typing import Tuple, Optional, Dict, Any, Callable
+from requests.adapters import HTTPAdapter
 
-from sqlalchemy import select, insert
+from sqlalchemy import select, insert, update, delete, func, event
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
-from db import engine, category, brand, product
+from db import engine, session_scope, category, brand, product, lookup_miss, icecat_raw
+from cache import make_cache, LRUCache
+import metrics, ratelimit, refdata
 
 # ---------------------------------------------------------------------------
 # Konfig
@@ -22,46 +37,301 @@ from db import engine, category, brand, product
 ICE_USER = os.getenv("ICE_USER", "openIcecat-live")
 ICE_LANG = os.getenv("ICE_LANG", "de")      # de, en, …
 
+# Lookup-Cache: EAN → {pid, name, cat, brand}
+LOOKUP_CACHE_SIZE       = int(os.getenv("LOOKUP_CACHE_SIZE", "2048"))
+LOOKUP_CACHE_TTL        = float(os.getenv("LOOKUP_CACHE_TTL", "300"))          # Sekunden, pro Worker
+LOOKUP_CACHE_FILE       = os.getenv("LOOKUP_CACHE_FILE", "")                   # leer = ohne geteilte Stufe
+LOOKUP_CACHE_SHARED_TTL = float(os.getenv("LOOKUP_CACHE_SHARED_TTL", "3600"))
+
+product_cache = make_cache("product", LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL,
+                           LOOKUP_CACHE_FILE, LOOKUP_CACHE_SHARED_TTL)
+
+# Kategorie-/Hersteller-IDs pro Worker merken (Sekunden)
+NAME_CACHE_TTL = float(os.getenv("NAME_CACHE_TTL", "3600"))
+
+# Negativ-Cache: so lange wird eine unbekannte EAN nicht erneut extern gesucht
+LOOKUP_MISS_RETRY_AFTER = float(os.getenv("LOOKUP_MISS_RETRY_AFTER", "86400"))   # Sekunden
+
+# Externe Provider
+ICE_API_URL     = os.getenv("ICE_API_URL", "https://live.icecat.biz/api")
+UPC_API_URL     = os.getenv("UPC_API_URL", "https://api.upcitemdb.com/prod/trial/lookup")
+ICE_TIMEOUT     = float(os.getenv("ICE_TIMEOUT", "5"))           # Sekunden je Request
+UPC_TIMEOUT     = float(os.getenv("UPC_TIMEOUT", "4"))
+UPC_HEDGE_DELAY = float(os.getenv("UPC_HEDGE_DELAY", "1.5"))     # UPC erst, wenn Icecat so lange nichts liefert
+LOOKUP_THREADS  = int(os.getenv("LOOKUP_THREADS", "16"))         # parallele Provider-Requests pro Worker
+BREAKER_FAILS   = int(os.getenv("PROVIDER_BREAKER_FAILS", "5"))  # Fehler in Folge → Provider pausieren
+BREAKER_RESET   = float(os.getenv("PROVIDER_BREAKER_RESET", "60"))
+
+ICE_STORE_RAW   = os.getenv("ICE_STORE_RAW", "1") != "0"        # Icecat-JSON aufbewahren
+
 # ---------------------------------------------------------------------------
 # 1) Helper: Kategorie / Brand anlegen oder ID zurückgeben
+#    • Name → ID wird pro Worker gemerkt (Tabellen sind klein, ändern sich kaum)
+#    • Anlegen per Upsert: ein Round-Trip, kein Select-then-Insert-Race
+#    • IDs landen erst nach COMMIT im Cache (Rollback → nichts gemerkt)
 # ---------------------------------------------------------------------------
 
-def _ensure_category(cat_name: str | None) -> int:
-    name = cat_name.strip() if cat_name else "Sonstiges"
+def _upsert_id(s: Session, table, values: Dict[str, Any], key: str) -> int:
+    """Legt die Zeile an oder findet sie über die Unique-Spalte `key` → ID."""
+    dialect = s.get_bind().dialect.name
+    if dialect in ("mysql", "mariadb"):
+        stmt = (mysql_insert(table).values(**values)
+                .on_duplicate_key_update(id=func.last_insert_id(table.c.id)))
+        return s.execute(stmt).lastrowid
+    if dialect in ("sqlite", "postgresql"):
+        ins  = (sqlite_insert if dialect == "sqlite" else pg_insert)(table).values(**values)
+        stmt = (ins.on_conflict_do_update(index_elements=[table.c[key]],
+                                          set_={key: ins.excluded[key]})
+                .returning(table.c.id))
+        return s.scalar(stmt)
+    # sonstige Dialekte: klassisch (nicht race-frei)
+    rid = s.scalar(select(table.c.id).where(table.c[key] == values[key]))
+    if rid is None:
+        rid = s.scalar(insert(table).values(**values).returning(table.c.id))
+    return rid
+
+class _NameResolver:
+    """Name → ID für `category` bzw. `brand`, innerhalb einer Session."""
+
+    def __init__(self, table):
+        self.table = table
+        self.cache = LRUCache(maxsize=4096, ttl=NAME_CACHE_TTL)
+
+    def _remember(self, s: Session, key: str, rid: int) -> None:
+        s.info.setdefault("pending_names", []).append((self, key, rid))
+
+    def resolve(self, name: str, s: Session) -> int:
+        key = name.casefold()                   # MariaDB vergleicht case-insensitiv
+        rid = self.cache.get(key)
+        if rid is None:
+            rid = _upsert_id(s, self.table, {"name": name}, "name")
+            self._remember(s, key, rid)
+        return rid
+
+    def resolve_many(self, names, s: Session) -> Dict[str, int]:
+        """Bulk-Variante für Importe: {Name: ID}, fehlende mit einem INSERT."""
+        ids  = {n: self.cache.get(n.casefold()) for n in {n for n in names if n}}
+        todo = [n for n, rid in ids.items() if rid is None]
+        if todo:
+            for n, rid in _ensure_many(self.table, todo, s).items():
+                ids[n] = rid
+                self._remember(s, n.casefold(), rid)
+        return {n: rid for n, rid in ids.items() if rid is not None}
+
+    def forget(self) -> None:
+        self.cache.clear()
+
+categories = _NameResolver(category)
+brands     = _NameResolver(brand)
+
+@event.listens_for(Session, "after_commit")
+def _names_committed(s: Session) -> None:
+    pending = s.info.pop("pending_names", ())
+    for resolver, key, rid in pending:
+        resolver.cache.set(key, rid)
+    if pending:                                 # evtl. neue Kategorie/Hersteller → Drop-downs
+        refdata.invalidate()
+
+@event.listens_for(Session, "after_rollback")
+def _names_rolled_back(s: Session) -> None:
+    s.info.pop("pending_names", None)
+
+def _ensure_category(cat_name: str | None, s: Optional[Session] = None) -> int:
+    name = cat_name.strip() if cat_name and cat_name.strip() else "Sonstiges"
+    if s is not None:
+        return categories.resolve(name, s)
     with Session(engine) as s, s.begin():
-        cid = s.scalar(select(category.c.id).where(category.c.name == name))
-        if cid:
-            return cid
-        return s.scalar(
-            insert(category).values(name=name).returning(category.c.id)
-        )
+        return categories.resolve(name, s)
 
-def _ensure_brand(brand_name: str | None) -> Optional[int]:
+def _ensure_brand(brand_name: str | None, s: Optional[Session] = None) -> Optional[int]:
     if not brand_name or not brand_name.strip():
         return None
     name = brand_name.strip()
+    if s is not None:
+        return brands.resolve(name, s)
     with Session(engine) as s, s.begin():
-        bid = s.scalar(select(brand.c.id).where(brand.c.name == name))
-        if bid:
-            return bid
-        return s.scalar(
-            insert(brand).values(name=name).returning(brand.c.id)
-        )
+        return brands.resolve(name, s)
+
+def _ensure_many(table, names, s: Session) -> Dict[str, int]:
+    """
+    Legt fehlende Namen in `category`/`brand` mit einem INSERT an und
+    liefert {Name: ID} – innerhalb der Session `s`, ohne Worker-Cache.
+    """
+    names = {n for n in names if n}
+    if not names:
+        return {}
+
+    def _load() -> Dict[str, int]:
+        # MariaDB vergleicht case-insensitiv → Zuordnung ebenso
+        rows = s.execute(select(table.c.name, table.c.id)
+                         .where(table.c.name.in_(names)))
+        return {r.name.casefold(): r.id for r in rows}
+
+    ids = _load()
+    missing = [n for n in names if n.casefold() not in ids]
+    if missing:
+        s.execute(insert(table).prefix_with("IGNORE"),
+                  [{"name": n} for n in sorted(missing)])
+        ids = _load()
+    return {n: ids[n.casefold()] for n in names if n.casefold() in ids}
+
+def _store_product(ean: str, name: str, cat: Optional[str],
+                   brand_name: Optional[str]) -> Dict[str, Any]:
+    """
+    Legt ein Produkt samt Kategorie/Hersteller in EINER Transaktion an
+    (bzw. findet das parallel angelegte) und liefert die Lookup-Infos.
+    """
+    cat_name = cat.strip() if cat and cat.strip() else "Sonstiges"
+    with Session(engine) as s, s.begin():
+        cat_id   = _ensure_category(cat_name, s)
+        brand_id = _ensure_brand(brand_name, s)
+        pid = _upsert_id(s, product,
+                         dict(ean=ean, name=name,
+                              category_id=cat_id, brand_id=brand_id), "ean")
+    return {"pid": pid, "name": name, "cat": cat_name,
+            "brand": brand_name.strip() if brand_name else None}
 
 # ---------------------------------------------------------------------------
-# 2) Icecat-Live-Lookup  (liefert komplettes JSON oder None)
+# 2) HTTP-Pool (Keep-Alive) + Circuit-Breaker je Provider
 # ---------------------------------------------------------------------------
 
-def _icecat_fetch_json(ean: str, lang: str) -> Optional[Dict[str, Any]]:
-    url = ( "https://live.icecat.biz/api"
-            f"?UserName={ICE_USER}&Language={lang}&GTIN={ean}&Output=json" )
-    r = requests.get(url, timeout=5)
+_http = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=LOOKUP_THREADS, max_retries=0)
+_http.mount("https://", _adapter)
+_http.mount("http://", _adapter)
+
+_pool      = ThreadPoolExecutor(max_workers=LOOKUP_THREADS, thread_name_prefix="lookup")
+_bulk_pool = ThreadPoolExecutor(max_workers=LOOKUP_THREADS, thread_name_prefix="lookup-bulk")
+
+class ProviderError(Exception):
+    """Provider nicht erreichbar, überlastet (429/5xx), Breaker offen oder Budget erschöpft."""
+
+class Throttled(ProviderError):
+    """Eigenes Anfrage-Budget erschöpft – der Provider wurde gar nicht gefragt."""
+
+class CircuitBreaker:
+    """
+    Nach `fails` Fehlern in Folge wird der Provider `reset` Sekunden lang
+    übersprungen; danach darf genau ein Probe-Request durch (half-open).
+    """
+
+    def __init__(self, name: str, fails: int, reset: float):
+        self.name, self.fails, self.reset = name, fails, reset
+        self._errors    = 0
+        self._opened_at = 0.0
+        self._lock      = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._errors < self.fails:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset:
+                self._opened_at = time.monotonic()      # eine Probe, dann wieder warten
+                return True
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            self._errors = 0
+
+    def failure(self) -> None:
+        with self._lock:
+            self._errors += 1
+            if self._errors >= self.fails:
+                self._opened_at = time.monotonic()
+
+_breakers = {
+    "icecat": CircuitBreaker("icecat", BREAKER_FAILS, BREAKER_RESET),
+    "upc":    CircuitBreaker("upc",    BREAKER_FAILS, BREAKER_RESET),
+}
+
+def _call(provider: str, fn: Callable[..., Any], *args: Any, bulk: bool = False) -> Any:
+    """Ruft einen Provider über Breaker und Budget auf; Fehler → ProviderError."""
+    breaker = _breakers[provider]
+    if not breaker.allow():
+        metrics.provider_seconds.observe(0, provider=provider, outcome="circuit_open")
+        raise ProviderError(f"{provider}: Circuit offen")
+    try:
+        ratelimit.acquire(provider, bulk)
+    except ratelimit.RateLimited as e:
+        metrics.provider_seconds.observe(0, provider=provider, outcome="rate_limited")
+        raise Throttled(str(e)) from e
+    t0 = time.perf_counter()
+    try:
+        result = fn(*args)
+    except (requests.RequestException, ValueError) as e:
+        breaker.failure()
+        resp = getattr(e, "response", None)
+        if resp is not None and resp.status_code == 429:
+            ratelimit.penalize(provider, _retry_after(resp))
+        metrics.provider_seconds.observe(time.perf_counter() - t0, provider=provider,
+                                         outcome="error")
+        raise ProviderError(f"{provider}: {e}") from e
+    breaker.success()
+    ratelimit.success(provider)
+    metrics.provider_seconds.observe(time.perf_counter() - t0, provider=provider,
+                                     outcome="hit" if result else "miss")
+    return result
+
+def _retry_after(r: requests.Response) -> Optional[float]:
+    try:
+        return float(r.headers.get("Retry-After", ""))
+    except ValueError:                          # fehlt oder HTTP-Datum → exponentiell
+        return None
+
+def _get(url: str, timeout: float, provider: Optional[str] = None) -> Optional[requests.Response]:
+    """GET über den Pool; 200 → Response, 404 & Co. → None, 429/5xx → Exception."""
+    r = _http.get(url, timeout=timeout)
+    remaining = r.headers.get("X-RateLimit-Remaining")
+    if provider and remaining and remaining.isdigit():
+        ratelimit.quota_hint(provider, int(remaining))
     if r.status_code == 200:
-        return r.json()
+        return r
+    if r.status_code == 429 or r.status_code >= 500:
+        r.raise_for_status()
     return None
 
 # ---------------------------------------------------------------------------
-# 3) Name & Meta aus Icecat-JSON extrahieren
+# 3) Icecat-Live-Lookup  (liefert komplettes JSON oder None)
+# ---------------------------------------------------------------------------
+
+def _icecat_fetch_json(ean: str, lang: str) -> Optional[Tuple[Dict[str, Any], bytes]]:
+    """(JSON, Rohantwort) oder None – gespeichert wird erst außerhalb der Zeitmessung."""
+    url = ( f"{ICE_API_URL}"
+            f"?UserName={ICE_USER}&Language={lang}&GTIN={ean}&Output=json" )
+    r = _get(url, ICE_TIMEOUT, "icecat")
+    if r is None:
+        return None
+    js = r.json()
+    if not isinstance(js, dict):                # ValueError → ProviderError in _call
+        raise ValueError(f"Icecat: unerwartete Antwort ({type(js).__name__})")
+    return js, r.content
+
+def _store_raw(ean: str, lang: str, content: bytes) -> None:
+    """Antwort komprimiert in `icecat_raw` ablegen (je EAN + Sprache die neueste)."""
+    values = dict(ean=ean, lang=lang, fetched_at=datetime.now(),
+                  payload=zlib.compress(content, 6))
+    try:
+        with Session(engine) as s, s.begin():
+            dialect = s.get_bind().dialect.name
+            if dialect in ("mysql", "mariadb"):
+                ins = mysql_insert(icecat_raw).values(**values)
+                s.execute(ins.on_duplicate_key_update(fetched_at=ins.inserted.fetched_at,
+                                                      payload=ins.inserted.payload))
+            elif dialect in ("sqlite", "postgresql"):
+                ins = (sqlite_insert if dialect == "sqlite" else pg_insert)(icecat_raw).values(**values)
+                s.execute(ins.on_conflict_do_update(
+                    index_elements=[icecat_raw.c.ean, icecat_raw.c.lang],
+                    set_={"fetched_at": ins.excluded.fetched_at, "payload": ins.excluded.payload}))
+            else:
+                s.execute(delete(icecat_raw).where(icecat_raw.c.ean == ean,
+                                                   icecat_raw.c.lang == lang))
+                s.execute(insert(icecat_raw).values(**values))
+    except Exception:
+        metrics.errors_total.inc(where="icecat_raw")   # Lookup selbst hat ja geklappt
+
+# ---------------------------------------------------------------------------
+# 4) Name & Meta aus Icecat-JSON extrahieren
 # ---------------------------------------------------------------------------
 
 def _extract_name(js: Dict[str, Any]) -> Optional[str]:
@@ -110,77 +380,258 @@ def _extract_meta(js: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
     return cat, brand
 
 # ---------------------------------------------------------------------------
-# 4) Optionaler UPCitemdb-Trial-Lookup (kleines Kontingent)
+# 5) Optionaler UPCitemdb-Trial-Lookup (kleines Kontingent)
 # ---------------------------------------------------------------------------
 
 def _upc_lookup_name(ean: str) -> Optional[str]:
-    url = f"https://api.upcitemdb.com/prod/trial/lookup?upc={ean}"
+    r = _get(f"{UPC_API_URL}?upc={ean}", UPC_TIMEOUT, "upc")
+    if r is None:
+        return None
     try:
-        r = requests.get(url, timeout=4)
-        if r.status_code == 200:
-            items = r.json().get("items", [])
-            return items[0]["title"] if items else None
-    except Exception:
-        pass
-    return None
+        items = r.json().get("items") or []
+        return items[0]["title"] if items else None
+    except (KeyError, TypeError, IndexError, AttributeError) as e:
+        # kaputte Antwort zählt als Störung (ProviderError), nicht als „unbekannt“
+        raise ValueError(f"UPCitemdb: unerwartete Antwort ({e!r})") from e
 
 # ---------------------------------------------------------------------------
-# 5) Hauptfunktion: local → Icecat → UPC
+# 6) Lookup-Engine: Icecat-Sprachen nacheinander, UPC als Hedge
 # ---------------------------------------------------------------------------
 
-def get_or_fetch_product(ean: str) -> Tuple[Optional[str], Optional[int]]:
+Hit = Tuple[str, Optional[str], Optional[str]]     # (Name, Kategorie, Hersteller)
+
+def _icecat_hit(ean: str, lang: str, bulk: bool = False) -> Optional[Hit]:
+    got = _call("icecat", _icecat_fetch_json, ean, lang, bulk=bulk)
+    if got is None:
+        return None
+    js, raw = got
+    if ICE_STORE_RAW:
+        _store_raw(ean, lang, raw)               # DB-Schreiben zählt nicht zur Provider-Zeit
+    name = _extract_name(js) if js else None
+    if not name:
+        return None
+    cat, brand_name = _extract_meta(js)
+    return name, cat, brand_name
+
+def _upc_hit(ean: str, bulk: bool = False) -> Optional[Hit]:
+    name = _call("upc", _upc_lookup_name, ean, bulk=bulk)
+    return (name, None, None) if name else None
+
+def remote_lookup(ean: str, bulk: bool = False) -> Optional[Hit]:
     """
-    • Prüft erst lokale DB
-    • Versucht dann Icecat (gewählte Sprache, dann en)
-    • Optional UPCitemdb-Trial
-    Rückgabe: (Produktname, product.id)  oder (None, None)
+    Nimmt das beste Ergebnis nach der bisherigen Priorität ICE_LANG → en →
+    UPCitemdb. Icecat `en` wird erst gefragt, wenn ICE_LANG nichts kennt (spart
+    Icecat-Kontingent); ist Icecat gestört, entfällt `en`. Liefert Icecat nicht
+    binnen UPC_HEDGE_DELAY, läuft UPCitemdb parallel. Sobald der beste mögliche
+    Treffer feststeht, werden die übrigen Aufträge abgebrochen.
+    bulk=True (Massen-Import): eigener Thread-Pool, wartet auf freies Budget
+    und lässt die Reserve für Scans unangetastet; kein Hedge – UPCitemdb
+    (knappes Tageskontingent) erst, wenn Icecat nichts hat.
+
+    Rückgabe: Treffer oder None (sicher nicht gefunden). Ist nur das Budget
+    von UPCitemdb erschöpft, zählt das als „keine Antwort“, nicht als Störung.
+    Wirft ProviderError, wenn ohne Treffer mindestens ein Provider gestört war.
     """
+    langs   = [ICE_LANG] + (["en"] if ICE_LANG.lower() != "en" else [])
+    pool    = _bulk_pool if bulk else _pool
+    pending = []
+    hedge   = None if bulk else time.monotonic() + UPC_HEDGE_DELAY
+    upc     = None
+    failed  = None
 
-    # ---- 1) lokaler Treffer
-    with Session(engine) as s:
+    try:
+        for lang in langs:                  # strikt in Prioritäts-Reihenfolge
+            fut = pool.submit(_icecat_hit, ean, lang, bulk)
+            pending.append(fut)
+            while True:
+                wait = None if upc or hedge is None else max(0.0, hedge - time.monotonic())
+                try:
+                    hit = fut.result(timeout=wait)
+                    break
+                except FutureTimeout:       # Icecat trödelt → UPC parallel starten
+                    upc = pool.submit(_upc_hit, ean, bulk)
+                    pending.append(upc)
+                except ProviderError as e:
+                    hit, failed = None, e
+                    break
+            if hit:
+                return hit
+            if failed:                      # Icecat gestört → andere Sprache nicht versuchen
+                break
+
+        if upc is None:
+            upc = pool.submit(_upc_hit, ean, bulk)
+            pending.append(upc)
+        try:
+            hit = upc.result()
+        except Throttled:                   # UPC-Kontingent aufgebraucht → wie „kein Treffer“
+            hit = None
+        except ProviderError as e:
+            hit, failed = None, e
+        if hit:
+            return hit
+        if failed:
+            raise failed
+        return None
+    finally:
+        for fut in pending:
+            fut.cancel()                    # noch nicht gestartete Requests verwerfen
+
+# ---------------------------------------------------------------------------
+# 7) Lokale DB: Produkt per EAN, Kategorie & Hersteller aus dem Stammdaten-Cache
+# ---------------------------------------------------------------------------
+
+def _load_product(ean: str) -> Optional[Dict[str, Any]]:
+    # Kategorie-/Herstellernamen aus dem Stammdaten-Cache statt per JOIN
+    with session_scope() as s:
         row = s.execute(
-            select(product.c.id, product.c.name).where(product.c.ean == ean)
+            select(product.c.id, product.c.name, product.c.category_id, product.c.brand_id)
+            .where(product.c.ean == ean)
         ).first()
-        if row:
-            return row.name, row.id
-
-    # ---- 2) Icecat (Language + en Fallback)
-    for lang in (ICE_LANG, "en" if ICE_LANG.lower() != "en" else None):
-        if not lang:
-            continue
-        js = _icecat_fetch_json(ean, lang)
-        if not js:
-            continue
-        name = _extract_name(js)
-        if name:
-            cat, brand = _extract_meta(js)
-            cat_id   = _ensure_category(cat)
-            brand_id = _ensure_brand(brand)
-
-            with Session(engine) as s, s.begin():
-                s.execute(
-                    insert(product)
-                    .values(ean=ean, name=name,
-                            category_id=cat_id, brand_id=brand_id)
-                    .prefix_with("IGNORE")          # vermeidet Duplikat-Error
-                )
-                pid = s.scalar(
-                    select(product.c.id).where(product.c.ean == ean)
-                )
-            return name, pid
-
-    # ---- 3) UPC-Trial (Name ohne Meta, seltener nötig)
-    upc_name = _upc_lookup_name(ean)
-    if upc_name:
-        cat_id = _ensure_category("Sonstiges")
-        with Session(engine) as s, s.begin():
+    if not row:
+        return None
+    return {"pid":   row.id,
+            "name":  row.name,
+            "cat":   refdata.category_name(row.category_id),
+            "brand": refdata.brand_name(row.brand_id)}
+
+def invalidate_product(*eans: Optional[str]) -> None:
+    """Nach Änderungen an `product` aufrufen (alte und neue EAN). Andere Worker verwerfen
+    ihren Cache über die geteilte Stufe (LOOKUP_CACHE_FILE), sonst nach LOOKUP_CACHE_TTL."""
+    eans = [ean for ean in eans if ean]
+    for ean in eans:
+        product_cache.delete(ean)
+    if eans:
+        product_cache.bump()
+
+# ---------------------------------------------------------------------------
+# 8) Negativ-Cache: bekannte Fehlschläge (Tabelle lookup_miss)
+# ---------------------------------------------------------------------------
+
+def _is_known_miss(ean: str) -> bool:
+    cutoff = datetime.now() - timedelta(seconds=LOOKUP_MISS_RETRY_AFTER)
+    with session_scope() as s:
+        return s.scalar(
+            select(lookup_miss.c.ean)
+            .where(lookup_miss.c.ean == ean, lookup_miss.c.last_try > cutoff)
+        ) is not None
+
+def _remember_miss(ean: str) -> None:
+    now = datetime.now()
+    with Session(engine) as s, s.begin():
+        res = s.execute(
+            update(lookup_miss)
+            .where(lookup_miss.c.ean == ean)
+            .values(tries=lookup_miss.c.tries + 1, last_try=now)
+        )
+        if not res.rowcount:
             s.execute(
-                insert(product)
-                .values(ean=ean, name=upc_name, category_id=cat_id)
-                .prefix_with("IGNORE")
+                insert(lookup_miss)
+                .values(ean=ean, tries=1, last_try=now)
+                .prefix_with("IGNORE")              # paralleler Scan war schneller
             )
-            pid = s.scalar(select(product.c.id).where(product.c.ean == ean))
-        return upc_name, pid
 
-    # nichts gefunden
-    return None, None
+def count_misses() -> int:
+    with session_scope() as s:
+        return s.scalar(select(func.count()).select_from(lookup_miss))
+
+def clear_misses() -> int:
+    """Leert den Negativ-Cache komplett, liefert die Anzahl gelöschter EANs."""
+    with Session(engine) as s, s.begin():
+        return s.execute(delete(lookup_miss)).rowcount
+
+# ---------------------------------------------------------------------------
+# 9) Extern: Treffer der Lookup-Engine in `product` speichern
+# ---------------------------------------------------------------------------
+
+def _fetch_remote(ean: str) -> Optional[Any]:
+    """
+    Rückgabe: dict  → Produkt angelegt, Lookup-Infos wie `lookup_product`
+              False → kein Provider kennt die EAN
+              None  → Provider gestört, Ergebnis unklar (kein Negativ-Cache!)
+    """
+    try:
+        hit = remote_lookup(ean)
+    except ProviderError:
+        return None
+    if not hit:
+        return False
+
+    name, cat, brand_name = hit
+    return _store_product(ean, name, cat, brand_name)
+
+# ---------------------------------------------------------------------------
+# 10) Hauptfunktionen: Cache → lokal → Negativ-Cache → Icecat → UPC
+# ---------------------------------------------------------------------------
+
+class _SingleFlight:
+    """Gleichzeitige Aufrufe mit demselben Schlüssel teilen sich einen Lauf (pro Worker)."""
+
+    class _Call:
+        def __init__(self):
+            self.done   = threading.Event()
+            self.result = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self):
+        self._lock  = threading.Lock()
+        self._calls: Dict[str, "_SingleFlight._Call"] = {}
+
+    def do(self, key: str, fn: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            call   = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:                          # läuft schon → auf dasselbe Ergebnis warten
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+_flights = _SingleFlight()
+
+def _lookup_uncached(ean: str) -> Optional[Dict[str, Any]]:
+    info = _load_product(ean)
+    if not info:
+        if _is_known_miss(ean):
+            return None
+        info = _fetch_remote(ean)
+        if info is False:
+            _remember_miss(ean)
+        if not info:
+            return None
+    product_cache.set(ean, info)
+    return info
+
+def lookup_product(ean: str) -> Optional[Dict[str, Any]]:
+    """
+    • Prüft erst den Lookup-Cache, dann die lokale DB (ein Query inkl. Meta)
+    • Fragt danach Icecat / UPCitemdb – außer die EAN ist als Fehlschlag bekannt
+    • Parallele Scans derselben EAN warten auf den ersten statt selbst zu fragen
+    Rückgabe: {"pid", "name", "cat", "brand"}  oder None
+    """
+    info = product_cache.get(ean)
+    metrics.cache_hit("lookup", bool(info))
+    if info:
+        return info
+    return _flights.do(ean, _lookup_uncached, ean)
+
+def get_or_fetch_product(ean: str) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Wie `lookup_product`, aber nur (Produktname, product.id)  oder (None, None)
+    """
+    info = lookup_product(ean)
+    if not info:
+        return None, None
+    return info["name"], info["pid"]
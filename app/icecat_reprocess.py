@@ -0,0 +1,148 @@
+"""
+icecat_reprocess.py – Gespeicherte Icecat-Antworten (icecat_raw) neu auswerten
+
+• reprocess(apply=True) → _extract_name/_extract_meta über alle gespeicherten Antworten,
+                          Produkte angleichen bzw. neu anlegen; liefert Zähler
+• CLI: flask --app app icecat-reprocess [--dry-run]
+
+Entpacken + JSON + Auswertung laufen blockweise in einem Prozess-Pool, Lesen und Schreiben
+im Hauptprozess. Je EAN gilt dieselbe Reihenfolge wie beim Live-Lookup (ICE_LANG → en).
+Geändert werden nur Felder, für die die Auswertung etwas liefert – ein fehlender Hersteller
+löscht also keinen vorhandenen. EANs, die bisher ohne Treffer waren (lookup_miss), werden
+bei einem neuen Treffer angelegt und aus dem Negativ-Cache genommen.
+"""
+
+from __future__ import annotations
+import json, multiprocessing, os, zlib
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.orm import Session
+
+import refdata
+from db import engine, product, lookup_miss, icecat_raw
+from helpers import (ICE_LANG, Hit, _extract_name, _extract_meta,
+                     categories, brands, invalidate_product)
+
+REPROCESS_PROCESSES = int(os.getenv("REPROCESS_PROCESSES", str(os.cpu_count() or 2)))
+BATCH               = 500                          # Antworten je Prozess-Auftrag
+
+Raw = Tuple[str, str, bytes]                       # (EAN, Sprache, zlib-JSON)
+
+# ---------------------------------------------------------------------------
+# 1) Auswertung (läuft in den Pool-Prozessen)
+# ---------------------------------------------------------------------------
+
+def _rank(lang: str) -> int:
+    lang = lang.lower()
+    return 0 if lang == ICE_LANG.lower() else 1 if lang == "en" else 2
+
+def _extract_batch(rows: List[Raw]) -> Dict[str, Optional[Hit]]:
+    """EAN → bester Treffer über alle Sprachen (oder None)."""
+    best: Dict[str, Tuple[int, Optional[Hit]]] = {}
+    for ean, lang, blob in rows:
+        try:
+            js = json.loads(zlib.decompress(blob))
+        except (zlib.error, ValueError):
+            js = None
+        name = _extract_name(js) if isinstance(js, dict) else None
+        hit  = (name, *_extract_meta(js)) if name else None
+        rank = _rank(lang) if hit else 99
+        if ean not in best or rank < best[ean][0]:
+            best[ean] = (rank, hit)
+    return {ean: hit for ean, (_, hit) in best.items()}
+
+# ---------------------------------------------------------------------------
+# 2) Lesen / Schreiben (Hauptprozess)
+# ---------------------------------------------------------------------------
+
+def _batches() -> Iterator[List[Raw]]:
+    """Keyset-Blöcke von bis zu BATCH Zeilen; alle Sprachen einer EAN landen im selben Block.
+    Jeder Block ist eine eigene kurze Abfrage – kein offener Cursor, während geschrieben wird."""
+    stmt = (select(icecat_raw.c.ean, icecat_raw.c.lang, icecat_raw.c.payload)
+            .order_by(icecat_raw.c.ean, icecat_raw.c.lang)
+            .limit(BATCH))
+    last = ""
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(stmt.where(icecat_raw.c.ean > last)).all()
+        if not rows:
+            return
+        if len(rows) == BATCH and rows[0].ean != rows[-1].ean:
+            rows = [r for r in rows if r.ean != rows[-1].ean]   # letzte EAN evtl. unvollständig
+        yield [(r.ean, r.lang, bytes(r.payload)) for r in rows]
+        last = rows[-1].ean
+
+def _clean(v: Optional[str]) -> Optional[str]:
+    return v.strip() if v and v.strip() else None
+
+def _apply(hits: Dict[str, Optional[Hit]], stats: Counter, apply: bool) -> None:
+    found = {ean: hit for ean, hit in hits.items() if hit}
+    stats["eans"] += len(hits)
+    stats["hits"] += len(found)
+    if not found:
+        return
+    with Session(engine) as s:
+        current = {r.ean: r for r in s.execute(
+            select(product.c.id, product.c.ean, product.c.name,
+                   product.c.category_id, product.c.brand_id)
+            .where(product.c.ean.in_(found)))}
+        cat_ids   = categories.resolve_many({_clean(c) or "Sonstiges" for _, c, _ in found.values()}, s) \
+                    if apply else {}
+        brand_ids = brands.resolve_many({_clean(b) for _, _, b in found.values()} - {None}, s) \
+                    if apply else {}
+
+        changes, new = [], []
+        for ean, (name, cat, brand_name) in found.items():
+            name, cat, brand_name = name[:product.c.name.type.length], _clean(cat), _clean(brand_name)
+            row = current.get(ean)
+            if row is None:
+                stats["created"] += 1
+                new.append(dict(ean=ean, name=name,
+                                category_id=cat_ids.get(cat or "Sonstiges"),
+                                brand_id=brand_ids.get(brand_name)))
+                continue
+            # Namen vergleichen statt IDs – im Probelauf wird nichts angelegt
+            same = (row.name == name
+                    and (cat is None or (refdata.category_name(row.category_id) or "").casefold() == cat.casefold())
+                    and (brand_name is None or (refdata.brand_name(row.brand_id) or "").casefold() == brand_name.casefold()))
+            if same:
+                stats["unchanged"] += 1
+                continue
+            stats["updated"] += 1
+            changes.append({"_id": row.id, "_name": name,
+                            "_cat": cat_ids.get(cat) if cat else row.category_id,
+                            "_brand": brand_ids.get(brand_name) if brand_name else row.brand_id})
+
+        if not apply:
+            return                                  # Probelauf: Session verwirft alles
+        if changes:
+            s.execute(update(product).where(product.c.id == bindparam("_id"))
+                      .values(name=bindparam("_name"), category_id=bindparam("_cat"),
+                              brand_id=bindparam("_brand")), changes)
+        if new:
+            s.execute(insert(product).prefix_with("IGNORE"), new)
+            s.execute(delete(lookup_miss).where(lookup_miss.c.ean.in_([r["ean"] for r in new])))
+        s.commit()
+    invalidate_product(*(r["ean"] for r in new), *(ean for ean in found if ean in current))
+
+# ---------------------------------------------------------------------------
+# 3) Ablauf
+# ---------------------------------------------------------------------------
+
+def reprocess(apply: bool = True, processes: int = REPROCESS_PROCESSES) -> Counter:
+    """Alle gespeicherten Antworten neu auswerten → Zähler (eans, hits, updated, created, …)."""
+    stats: Counter = Counter()
+    ctx     = multiprocessing.get_context("spawn")   # kein fork() aus einem Prozess mit Threads
+    pending: Deque[Future] = deque()
+    with ProcessPoolExecutor(max_workers=processes, mp_context=ctx) as ex:
+        for block in _batches():
+            stats["payloads"] += len(block)
+            pending.append(ex.submit(_extract_batch, block))
+            while pending and (len(pending) > processes * 2 or pending[0].done()):
+                _apply(pending.popleft().result(), stats, apply)
+        while pending:
+            _apply(pending.popleft().result(), stats, apply)
+    return stats
@@ -0,0 +1,286 @@
+"""
+metrics.py – Kennzahlen im Prometheus-Textformat (ohne Zusatzpaket)
+
+• Counter / Histogram / Gauge     → prozesslokal, threadsicher, mit Labels
+• instrument_app(app)             → Request-Latenz je Endpoint, SQL-Abfragen je Request
+• instrument_engine(engine)       → Dauer jeder SQL-Abfrage (SQLAlchemy-Events)
+• flush()                         → eigenen Stand (höchstens alle METRICS_FLUSH s) als JSON nach
+                                    METRICS_DIR – so sieht /metrics alle gunicorn-Worker und
+                                    Export-Prozesse, nicht nur den, der die Anfrage bekommt
+• render()                        → Summe aller Prozesse; Zähler beendeter Prozesse bleiben
+                                    erhalten (dead.json), deren Gauges entfallen
+"""
+
+from __future__ import annotations
+import atexit, bisect, fcntl, json, os, tempfile, threading, time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+METRICS_DIR   = Path(os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "ean-metrics")))
+METRICS_FLUSH = float(os.getenv("METRICS_FLUSH", "1"))
+
+# Sekunden: von Cache-Treffern (µs) bis zu großen PDFs/Timeouts
+LATENCY = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNTS  = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+_registry: Dict[str, "_Metric"] = {}
+
+# ---------------------------------------------------------------------------
+# 1) Metriken
+# ---------------------------------------------------------------------------
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self._lock   = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        _registry[name] = self
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[l]) for l in self.labels)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dump(self):
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i   = bisect.bisect_left(self.buckets, value)       # erster Bucket mit le >= value
+        with self._lock:
+            h = self._values.get(key)
+            if h is None:
+                h = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            h[0][i] += 1
+            h[1]    += value
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def dump(self):
+        with self._lock:
+            return [[list(k), [list(h[0]), h[1]]] for k, h in self._values.items()]
+
+class Gauge(_Metric):
+    """Wert wird erst beim Schreiben abgefragt: fn() → {Label-Tupel: Wert} oder Zahl."""
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn: Callable[[], Any],
+                 labels: Sequence[str] = (), merge: str = "sum"):
+        super().__init__(name, doc, labels)
+        self.fn, self.merge = fn, merge
+
+    def dump(self):
+        val = self.fn()
+        if isinstance(val, dict):
+            return [[list(k), v] for k, v in val.items()]
+        return [[[], val]]
+
+class _Timer:
+    def __init__(self, hist: Histogram, labels: Dict[str, Any]):
+        self.hist, self.labels = hist, labels
+
+    def __enter__(self) -> "_Timer":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.hist.observe(time.perf_counter() - self.t0, **self.labels)
+
+# ---------------------------------------------------------------------------
+# 2) Die Metriken der App
+# ---------------------------------------------------------------------------
+
+http_seconds     = Histogram("ean_http_request_seconds", "Antwortzeit je Endpoint",
+                             ("endpoint", "method", "status"))
+sql_seconds      = Histogram("ean_sql_query_seconds", "Dauer einzelner SQL-Abfragen")
+sql_per_request  = Histogram("ean_sql_queries_per_request", "SQL-Abfragen pro Request",
+                             ("endpoint",), buckets=COUNTS)
+provider_seconds = Histogram("ean_provider_request_seconds", "Icecat/UPCitemdb-Aufrufe",
+                             ("provider", "outcome"))
+cache_total      = Counter("ean_cache_requests_total", "Cache-Zugriffe", ("cache", "result"))
+pdf_seconds      = Histogram("ean_pdf_render_seconds", "PDF-Rendern je Phase", ("phase",))
+errors_total     = Counter("ean_errors_total", "Abgefangene Fehler", ("where",))
+throttled_total  = Counter("ean_provider_throttled_total", "Vom Anfrage-Budget gebremste Aufrufe",
+                           ("provider", "priority", "reason"))
+
+def cache_hit(cache: str, hit: bool) -> None:
+    cache_total.inc(cache=cache, result="hit" if hit else "miss")
+
+# ---------------------------------------------------------------------------
+# 3) Flask + SQLAlchemy
+# ---------------------------------------------------------------------------
+
+def instrument_engine(engine) -> None:
+    from flask import g, has_request_context
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, params, context, executemany):
+        conn.info.setdefault("query_t0", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _end(conn, cursor, statement, params, context, executemany):
+        sql_seconds.observe(time.perf_counter() - conn.info["query_t0"].pop())
+        if has_request_context():
+            g.sql_queries = g.get("sql_queries", 0) + 1
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(ctx):
+        stack = ctx.connection.info.get("query_t0") if ctx.connection is not None else None
+        if stack:
+            stack.pop()
+
+def instrument_app(app) -> None:
+    from flask import g, request
+
+    @app.before_request
+    def _t0():
+        g.t0 = time.perf_counter()
+
+    @app.after_request
+    def _observe(resp):
+        if "t0" in g:
+            endpoint = request.endpoint or "unbekannt"
+            http_seconds.observe(time.perf_counter() - g.t0, endpoint=endpoint,
+                                 method=request.method, status=resp.status_code)
+            sql_per_request.observe(g.get("sql_queries", 0), endpoint=endpoint)
+        flush()
+        return resp
+
+# ---------------------------------------------------------------------------
+# 4) Prozessübergreifend sammeln
+# ---------------------------------------------------------------------------
+
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+def _snapshot() -> Dict[str, Any]:
+    out = {}
+    for m in _registry.values():
+        entry = {"kind": m.kind, "doc": m.doc, "labels": list(m.labels), "values": m.dump()}
+        if isinstance(m, Histogram):
+            entry["buckets"] = list(m.buckets)
+        if isinstance(m, Gauge):
+            entry["merge"] = m.merge
+        out[m.name] = entry
+    return out
+
+def _write_json(path: Path, data: Dict[str, Any]) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+def flush(force: bool = False) -> None:
+    """Stand dieses Prozesses ablegen – gedrosselt, damit Requests nichts merken."""
+    global _last_flush
+    now = time.monotonic()
+    if not force and now - _last_flush < METRICS_FLUSH:
+        return
+    if not _flush_lock.acquire(blocking=force):
+        return
+    try:
+        _last_flush = now
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        _write_json(METRICS_DIR / f"{os.getpid()}.json", _snapshot())
+    except OSError:
+        pass                                   # Metriken dürfen nie einen Request kosten
+    finally:
+        _flush_lock.release()
+
+atexit.register(lambda: flush(force=True))
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _merge(into: Dict[str, Any], snap: Dict[str, Any], gauges: bool = True) -> None:
+    for name, m in snap.items():
+        if m["kind"] == "gauge" and not gauges:
+            continue
+        tgt = into.setdefault(name, {**m, "values": []})
+        vals = {tuple(k): v for k, v in tgt["values"]}
+        for k, v in m["values"]:
+            k   = tuple(k)
+            old = vals.get(k)
+            if old is None:
+                vals[k] = v
+            elif m["kind"] == "histogram":
+                vals[k] = [[a + b for a, b in zip(old[0], v[0])], old[1] + v[1]]
+            elif m.get("merge") == "max":
+                vals[k] = max(old, v)
+            else:
+                vals[k] = old + v
+        tgt["values"] = [[list(k), v] for k, v in vals.items()]
+
+def _collect() -> Dict[str, Any]:
+    flush(force=True)
+    total: Dict[str, Any] = {}
+    dead_path = METRICS_DIR / "dead.json"
+    with open(METRICS_DIR / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = json.loads(dead_path.read_text()) if dead_path.exists() else {}
+        moved = False
+        for path in METRICS_DIR.glob("[0-9]*.json"):
+            try:
+                snap = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            if _alive(int(path.stem)):
+                _merge(total, snap)
+            else:                              # Zähler aufheben, Gauges verwerfen
+                _merge(dead, snap, gauges=False)
+                path.unlink(missing_ok=True)
+                moved = True
+        if moved:
+            _write_json(dead_path, dead)
+    _merge(total, dead)
+    return total
+
+def _esc(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def render() -> str:
+    lines: List[str] = []
+    for name, m in sorted(_collect().items()):
+        lines += [f"# HELP {name} {m['doc']}", f"# TYPE {name} {m['kind']}"]
+        for key, v in m["values"]:
+            if m["kind"] != "histogram":
+                lines.append(f"{name}{_fmt_labels(m['labels'], key)} {v}")
+                continue
+            counts, total, acc = v[0], v[1], 0
+            for le, c in zip(list(m["buckets"]) + ["+Inf"], counts):
+                acc  += c
+                label = _fmt_labels(m["labels"], key, 'le="%s"' % le)
+                lines.append(f"{name}_bucket{label} {acc}")
+            lines.append(f"{name}_sum{_fmt_labels(m['labels'], key)} {total}")
+            lines.append(f"{name}_count{_fmt_labels(m['labels'], key)} {acc}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,167 @@
+"""
+migrations.py – Schema-Updates für bestehende Datenbanken
+
+• upgrade()   → neue Tabellen anlegen, dann fehlende Schritte aus MIGRATIONS der Reihe nach
+                ausführen (`flask --app app upgrade`, im Container vor dem Start von gunicorn;
+                MariaDB: GET_LOCK, damit nur einer migriert, die anderen warten)
+• status()    → (eingespielte Version, offene Schritte) – nur lesend
+• check()     → beim Worker-Start: RuntimeError, wenn Schritte fehlen (Worker migrieren nie selbst)
+
+create_all() legt nur neue Tabellen an – Indizes/Spalten auf vorhandenen Tabellen kommen hier
+dazu. Neue Schritte hinten anhängen, nie umnummerieren; jeder Schritt muss auch auf einer frisch
+per create_all() angelegten Datenbank durchlaufen (checkfirst).
+"""
+
+from __future__ import annotations
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Iterator, List, Tuple
+
+from sqlalchemy import Connection, Table, bindparam, func, insert, inspect, select, text, update
+from sqlalchemy.schema import CreateColumn
+
+from db import engine, metadata, schema_version, product, slip, slip_item, serial, serial_lock, SERIAL_LOCK_SLOTS
+from serial_search import normalize
+
+log = logging.getLogger(__name__)
+
+LOCK_NAME    = "ean_schema"
+LOCK_TIMEOUT = 600                      # s – Index auf großer Tabelle darf dauern
+BATCH        = 5000                     # Zeilen je Transaktion beim Nachtragen
+
+# ---------------------------------------------------------------------------
+# 1) Schritte
+# ---------------------------------------------------------------------------
+
+def _indexes(table: Table, *names: str) -> Callable[[Connection], None]:
+    """Schritt: die in db.py deklarierten Indizes anlegen, falls sie fehlen (MariaDB: online)."""
+    def run(conn: Connection) -> None:
+        for idx in table.indexes:
+            if not names or idx.name in names:
+                idx.create(conn, checkfirst=True)
+    return run
+
+def _add_column(table: Table, name: str) -> Callable[[Connection], None]:
+    """Schritt: Spalte wie in db.py deklariert anhängen, falls sie fehlt."""
+    def run(conn: Connection) -> None:
+        if name in {c["name"] for c in inspect(conn).get_columns(table.name)}:
+            return
+        table_name = conn.dialect.identifier_preparer.format_table(table)
+        column     = CreateColumn(table.c[name]).compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column}"))
+    return run
+
+def _steps(*steps: Callable[[Connection], None]) -> Callable[[Connection], None]:
+    def run(conn: Connection) -> None:
+        for step in steps:
+            step(conn)
+    return run
+
+def _backfill_sn_norm(conn: Connection) -> None:
+    """serial.sn_norm für Altbestand füllen – blockweise nach id, je Block ein Commit."""
+    last, done = 0, 0
+    upd = (update(serial).where(serial.c.id == bindparam("_id"))
+           .values(sn_norm=bindparam("_norm")))
+    while True:
+        rows = conn.execute(
+            select(serial.c.id, serial.c.sn)
+            .where(serial.c.id > last, serial.c.sn_norm.is_(None), serial.c.sn.is_not(None))
+            .order_by(serial.c.id)
+            .limit(BATCH)
+        ).all()
+        if not rows:
+            break
+        conn.execute(upd, [{"_id": r.id, "_norm": normalize(r.sn)} for r in rows])
+        conn.commit()
+        last  = rows[-1].id
+        done += len(rows)
+        log.info("serial.sn_norm: %d Zeilen", done)
+
+def _backfill_updated_at(conn: Connection) -> None:
+    """product.updated_at für Altbestand = jetzt (der erste Abgleich lädt ohnehin alles)."""
+    top = conn.scalar(select(func.coalesce(func.max(product.c.id), 0)))
+    for lo in range(0, top, BATCH):
+        conn.execute(update(product)
+                     .where(product.c.id > lo, product.c.id <= lo + BATCH,
+                            product.c.updated_at.is_(None))
+                     .values(updated_at=func.now()))
+        conn.commit()
+
+def _fill_serial_lock(conn: Connection) -> None:
+    """Sperr-Zeilen für serial_index.lock anlegen (fehlende nachtragen)."""
+    have = set(conn.scalars(select(serial_lock.c.slot)))
+    rows = [{"slot": i, "n": 0} for i in range(SERIAL_LOCK_SLOTS) if i not in have]
+    if rows:
+        conn.execute(insert(serial_lock), rows)
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "product: Kategorie/Hersteller, Name+id, Volltext", _indexes(product, "ix_product_category_id",
+                                                                     "ix_product_brand_id",
+                                                                     "ix_product_name_id",
+                                                                     "ft_product_name")),
+    (2, "slip_item.slip_id",                                _indexes(slip_item)),
+    (3, "serial.item_id",                                   _indexes(serial, "ix_serial_item_id")),
+    (4, "slip: created_at+id, order_no, customer",          _indexes(slip)),
+    (5, "serial.sn_norm (Seriennummern-Suche)",             _steps(_add_column(serial, "sn_norm"),
+                                                                   _backfill_sn_norm,
+                                                                   _indexes(serial, "ix_serial_sn_norm"))),
+    (6, "product.updated_at (Katalog-Abgleich)",            _steps(_add_column(product, "updated_at"),
+                                                                   _backfill_updated_at,
+                                                                   _indexes(product, "ix_product_updated_at"))),
+    (7, "serial_lock (doppelte Seriennummern sperren)",     _fill_serial_lock),
+]
+
+# ---------------------------------------------------------------------------
+# 2) Ablauf
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def _lock(conn: Connection) -> Iterator[None]:
+    """Nur ein Prozess migriert; SQLite (Tests) serialisiert ohnehin über die Datei-Sperre."""
+    if conn.dialect.name not in ("mysql", "mariadb"):
+        yield
+        return
+    if conn.scalar(text("SELECT GET_LOCK(:n, :t)"), {"n": LOCK_NAME, "t": LOCK_TIMEOUT}) != 1:
+        raise RuntimeError(f"Schema-Sperre {LOCK_NAME!r} nicht erhalten")
+    try:
+        yield
+    finally:
+        conn.execute(text("SELECT RELEASE_LOCK(:n)"), {"n": LOCK_NAME})
+
+def version(conn: Connection) -> int:
+    if not inspect(conn).has_table(schema_version.name):
+        return 0                           # noch nie migriert (leere oder Alt-Datenbank)
+    return conn.scalar(select(func.coalesce(func.max(schema_version.c.version), 0)))
+
+def status() -> Tuple[int, List[Tuple[int, str]]]:
+    """Eingespielte Version + offene Schritte (Version, Titel), ohne etwas zu ändern."""
+    with engine.connect() as conn:
+        current = version(conn)
+    return current, [(ver, title) for ver, title, _ in MIGRATIONS if ver > current]
+
+def check() -> int:
+    """Für den Worker-Start: offene Schritte → RuntimeError, statt selbst zu migrieren."""
+    current, todo = status()
+    if todo:
+        raise RuntimeError(f"Datenbank-Schema auf Stand {current}, benötigt {todo[-1][0]} – "
+                           f"zuerst `flask --app app upgrade` ausführen")
+    return current
+
+def upgrade() -> int:
+    """Neue Tabellen anlegen, offene Schritte einspielen → neue Version."""
+    with engine.connect() as conn, _lock(conn):
+        metadata.create_all(conn)
+        conn.commit()
+        current = version(conn)
+        conn.commit()
+        for ver, title, step in MIGRATIONS:
+            if ver <= current:
+                continue
+            log.info("Schema %d: %s", ver, title)
+            step(conn)
+            conn.execute(insert(schema_version).values(
+                version=ver, title=title, applied_at=datetime.now()))
+            conn.commit()                  # DDL committet auf MariaDB ohnehin sofort
+            current = ver
+        return current
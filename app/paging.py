@@ -0,0 +1,106 @@
+"""
+paging.py – Keyset-Blättern und Streaming für lange Listen (/admin, /slips)
+
+• keyset_page(s, stmt, keys, after)  → eine Seite + Cursor der nächsten (WHERE (k1,k2) > letzter
+                                       Wert statt OFFSET: jede Seite kostet gleich viel)
+• ordered(stmt, keys)                → dieselbe Sortierung ohne Blättern (Export, Streaming)
+• stream_rows(stmt)                  → alle Zeilen mit yield_per aus einem serverseitigen Cursor
+• keys = [(Ausdruck, absteigend?), …] – der letzte Schlüssel muss eindeutig sein (id)
+
+Der Cursor ist base64(JSON) der Schlüsselwerte der letzten Zeile; kaputte Cursor → ValueError.
+"""
+
+from __future__ import annotations
+import base64, json, os
+from datetime import date, datetime
+from typing import Any, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from db import engine
+
+PAGE_SIZE    = int(os.getenv("PAGE_SIZE", "100"))        # Zeilen pro Seite
+PAGE_MAX     = 1000                                      # Obergrenze für ?limit= der JSON-API
+STREAM_BATCH = int(os.getenv("STREAM_BATCH", "500"))     # yield_per beim Streamen
+
+Keys = Sequence[Tuple[Any, bool]]
+
+class Page(NamedTuple):
+    rows: List[Any]
+    next: Optional[str]                                  # Cursor oder None (letzte Seite)
+
+# ---------------------------------------------------------------------------
+# 1) Cursor
+# ---------------------------------------------------------------------------
+
+def _enc(v: Any) -> Any:
+    if isinstance(v, datetime):
+        return {"dt": v.isoformat()}
+    if isinstance(v, date):
+        return {"d": v.isoformat()}
+    return v
+
+def _dec(v: Any) -> Any:
+    if isinstance(v, dict):
+        if "dt" in v:
+            return datetime.fromisoformat(v["dt"])
+        if "d" in v:
+            return date.fromisoformat(v["d"])
+        raise ValueError("ungültiger Cursor")
+    return v
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps([_enc(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(token: str, n: int) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if not isinstance(values, list) or len(values) != n:
+            raise ValueError("falsche Länge")
+        return [_dec(v) for v in values]
+    except (ValueError, TypeError) as e:                 # binascii.Error ⊂ ValueError
+        raise ValueError("ungültiger Cursor") from e
+
+# ---------------------------------------------------------------------------
+# 2) Keyset
+# ---------------------------------------------------------------------------
+
+def ordered(stmt, keys: Keys):
+    return stmt.order_by(None).order_by(*(k.desc() if desc else k.asc() for k, desc in keys))
+
+def _after(keys: Keys, values: Sequence[Any]):
+    """(k1, k2, …) hinter values – ausgeschrieben statt Row-Value, damit jeder Index greift."""
+    terms = []
+    for i, (k, desc) in enumerate(keys):
+        past = k < values[i] if desc else k > values[i]
+        terms.append(and_(*(kk == vv for (kk, _), vv in zip(keys[:i], values[:i])), past))
+    return or_(*terms)
+
+def keyset_page(s: Session, stmt, keys: Keys, after: Optional[str] = None,
+                size: int = PAGE_SIZE) -> Page:
+    """Eine Seite ab Cursor `after`; Zeilen tragen zusätzlich die Spalten _k0 … _kN."""
+    n    = len(keys)
+    stmt = ordered(stmt.add_columns(*(k.label(f"_k{i}") for i, (k, _) in enumerate(keys))), keys)
+    if after:
+        stmt = stmt.where(_after(keys, decode_cursor(after, n)))
+    rows = s.execute(stmt.limit(size + 1)).all()
+    if len(rows) <= size:
+        return Page(rows, None)
+    rows = rows[:size]
+    return Page(rows, encode_cursor(rows[-1][-n:]))
+
+def as_dict(row) -> dict:
+    """Zeile für JSON – ohne die Hilfsspalten _k*."""
+    return {k: v.isoformat() if isinstance(v, (date, datetime)) else v
+            for k, v in row._mapping.items() if not k.startswith("_k")}
+
+# ---------------------------------------------------------------------------
+# 3) Streaming
+# ---------------------------------------------------------------------------
+
+def stream_rows(stmt, batch: int = STREAM_BATCH) -> Iterator[Any]:
+    """Zeilen blockweise lesen, solange der Aufrufer iteriert (Session lebt im Generator)."""
+    with Session(engine) as s:
+        yield from s.execute(stmt.execution_options(yield_per=batch))
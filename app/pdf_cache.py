@@ -0,0 +1,132 @@
+"""
+pdf_cache.py – Fertige Protokoll-PDFs auf der Platte
+
+• Schlüssel = Inhalts-Hash (slip_pdf.content_key) → gleichzeitig das ETag
+• Schreiben atomar (tmp-Datei + rename), mehrere Worker teilen sich das Verzeichnis;
+  write() reicht die tmp-Datei an den Renderer durch (kein PDF-Puffer im RAM)
+• Größenbegrenzung: älteste (zuletzt benutzte) Dateien fliegen zuerst
+• open_file(): Treffer schon geöffnet (bleibt lesbar, auch wenn ein Worker sie wegräumt)
+• get_or_create(): Datei-Lock je Schlüssel – parallele Anfragen (auch aus
+  anderen Workern) warten auf das laufende Rendern statt doppelt zu rendern
+• open_or_create(): dasselbe, liefert aber die schon geöffnete Datei – räumt ein anderer
+  Worker sie danach weg (unlink), liest der Download weiter aus dem offenen Handle
+"""
+
+from __future__ import annotations
+import fcntl, os, tempfile, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Optional
+
+import metrics
+
+PDF_CACHE_DIR    = Path(os.getenv("PDF_CACHE_DIR",
+                                  os.path.join(tempfile.gettempdir(), "ean-pdf-cache")))
+PDF_CACHE_MAX_MB = float(os.getenv("PDF_CACHE_MAX_MB", "200"))
+
+_lock = threading.Lock()
+
+def _path(key: str) -> Path:
+    return PDF_CACHE_DIR / f"{key}.pdf"
+
+def get(key: str) -> Optional[Path]:
+    """Pfad zur gecachten Datei oder None; Treffer zählt als „benutzt“."""
+    path = _path(key)
+    try:
+        os.utime(path)                       # mtime = letzte Nutzung (für LRU)
+    except FileNotFoundError:
+        return None
+    return path
+
+def _open(key: str) -> Optional[BinaryIO]:
+    """Gecachte Datei geöffnet oder None; Treffer zählt als „benutzt“."""
+    try:
+        f = open(_path(key), "rb")
+    except FileNotFoundError:
+        return None
+    os.utime(f.fileno())
+    return f
+
+def open_file(key: str) -> Optional[BinaryIO]:
+    """Wie get(), aber schon geöffnet – für Downloads (Aufrufer schließt die Datei)."""
+    return _open(key)
+
+def _write(key: str, fill: Callable[[BinaryIO], None]) -> BinaryIO:
+    """`fill(f)` schreibt direkt in eine tmp-Datei, die erst danach sichtbar wird → geöffnet.
+    Geöffnet wird vor dem rename, damit kein _evict() dazwischen die neue Datei löscht."""
+    PDF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=PDF_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            fill(f)
+        result = open(tmp, "rb")
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    os.replace(tmp, _path(key))
+    _evict()
+    return result
+
+def write(key: str, fill: Callable[[BinaryIO], None]) -> Path:
+    with _write(key, fill):
+        return _path(key)
+
+def put(key: str, data: bytes) -> Path:
+    return write(key, lambda f: f.write(data))
+
+@contextmanager
+def _key_lock(key: str) -> Iterator[None]:
+    PDF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(PDF_CACHE_DIR / f"{key}.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def get_or_create(key: str, fill: Callable[[BinaryIO], None]) -> Path:
+    """Gecachte Datei oder write(key, fill) – pro Schlüssel rendert nur einer."""
+    path = get(key)
+    metrics.cache_hit("pdf", path is not None)
+    if path is not None:
+        return path
+    with _key_lock(key):
+        path = get(key)                      # ein anderer war schneller
+        if path is not None:
+            return path
+        return write(key, fill)
+
+def open_or_create(key: str, fill: Callable[[BinaryIO], None]) -> BinaryIO:
+    """Wie get_or_create(), aber als offene Datei (Aufrufer schließt sie)."""
+    f = _open(key)
+    metrics.cache_hit("pdf", f is not None)
+    if f is not None:
+        return f
+    with _key_lock(key):
+        return _open(key) or _write(key, fill)
+
+def _evict() -> None:
+    limit = PDF_CACHE_MAX_MB * 1024 * 1024
+    with _lock:
+        files = []
+        for p in PDF_CACHE_DIR.glob("*.pdf"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:        # parallel von anderem Worker entfernt
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        total = sum(size for _, size, _ in files)
+        for _, size, p in sorted(files):
+            if total <= limit:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+
+        # verwaiste Lock-Dateien (leer) nach einer Stunde wegräumen
+        stale = time.time() - 3600
+        for p in PDF_CACHE_DIR.glob("*.lock"):
+            try:
+                if p.stat().st_mtime < stale:
+                    p.unlink(missing_ok=True)
+            except FileNotFoundError:
+                continue
@@ -0,0 +1,94 @@
+"""
+pdf_jobs.py – Protokoll-PDFs im Hintergrund vorrendern
+
+• save_slip stößt direkt nach dem COMMIT einen Job an (Thread-Pool, kein Broker)
+• höchstens ein Job je Protokoll-Nr. und Worker; /pdf wartet auf den laufenden Job
+• Ergebnis landet im PDF-Cache – gleiche Datei wie beim normalen Download;
+  gerendert wird seitenweise direkt in die Cache-Datei (slip_pdf.write_pdf)
+"""
+
+from __future__ import annotations
+import os, threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional
+
+import pdf_cache
+from cache import LRUCache
+from slip_pdf import load_slip, write_pdf, content_key
+
+PDF_WORKERS      = int(os.getenv("PDF_WORKERS", "2"))
+PDF_WAIT_TIMEOUT = float(os.getenv("PDF_WAIT_TIMEOUT", "120"))   # Sekunden
+
+_pool   = ThreadPoolExecutor(max_workers=PDF_WORKERS, thread_name_prefix="pdf")
+_jobs: Dict[str, Future] = {}
+_errors = LRUCache(maxsize=256, ttl=600)          # Protokoll-Nr. → letzte Fehlermeldung
+_lock   = threading.Lock()
+
+# ---------------------------------------------------------------------------
+# 1) Rendern (auch direkt aus dem Request nutzbar)
+# ---------------------------------------------------------------------------
+
+def ensure_pdf(number: str, hdr=None, rows=None) -> Optional[Path]:
+    """Pfad zum fertigen PDF (rendert bei Bedarf) oder None, wenn es das Protokoll nicht gibt."""
+    if hdr is None:
+        hdr, rows = load_slip(number)
+        if not hdr:
+            return None
+    key = content_key(number, hdr, rows)
+    return pdf_cache.get_or_create(key, lambda f: write_pdf(hdr, rows, f))
+
+def open_pdf(number: str, hdr, rows) -> BinaryIO:
+    """Wie ensure_pdf, aber schon geöffnet – für Downloads (Aufrufer schließt die Datei)."""
+    key = content_key(number, hdr, rows)
+    return pdf_cache.open_or_create(key, lambda f: write_pdf(hdr, rows, f))
+
+def _run(number: str) -> Optional[Path]:
+    try:
+        return ensure_pdf(number)
+    except Exception as e:
+        _errors.set(number, f"{type(e).__name__}: {e}")
+        raise
+
+# ---------------------------------------------------------------------------
+# 2) Jobs
+# ---------------------------------------------------------------------------
+
+def submit(number: str) -> Future:
+    with _lock:
+        fut = _jobs.get(number)
+        if fut is None:
+            _errors.delete(number)
+            fut = _pool.submit(_run, number)
+            _jobs[number] = fut
+            fut.add_done_callback(lambda f: _forget(number, f))
+    return fut
+
+def _forget(number: str, fut: Future) -> None:
+    with _lock:
+        if _jobs.get(number) is fut:
+            del _jobs[number]
+
+def wait(number: str, timeout: float = PDF_WAIT_TIMEOUT) -> None:
+    """Wartet auf einen laufenden Job dieses Workers (Fehler → normaler Render-Pfad)."""
+    fut = _jobs.get(number)
+    if fut is None:
+        return
+    try:
+        fut.result(timeout=timeout)
+    except (FutureTimeout, Exception):
+        pass
+
+def status(number: str) -> Dict[str, Any]:
+    """{"state": "rendering" | "ready" | "pending" | "error" | "missing", …}"""
+    if number in _jobs:
+        return {"state": "rendering"}
+    hdr, rows = load_slip(number)
+    if not hdr:
+        return {"state": "missing"}
+    if pdf_cache.get(content_key(number, hdr, rows)) is not None:
+        return {"state": "ready"}
+    err = _errors.get(number)
+    if err:
+        return {"state": "error", "error": err}
+    return {"state": "pending"}             # noch nicht gerendert → /pdf rendert sofort
@@ -0,0 +1,131 @@
+"""
+prefetch.py – Ganze EAN-Listen (z. B. Lieferschein-CSV) vorab in den Katalog holen
+
+• Dedupe gegen `product` und den Negativ-Cache mit je einem IN-Query
+• Holt Unbekannte parallel (PREFETCH_WORKERS) als Massen-Abfrage: das gemeinsame
+  Provider-Budget (ratelimit.py) bremst, Scans im Lager haben Vorrang
+• Legt Kategorien, Hersteller und Produkte blockweise in EINER Transaktion an
+• Liefert Fortschritt als Generator (NDJSON-Stream bzw. CLI-Ausgabe)
+• Wiederaufnehmbar: jeder Block wird sofort committet, ein erneuter Lauf
+  überspringt alles, was schon importiert oder als unbekannt gemerkt ist
+"""
+
+from __future__ import annotations
+import os, re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from sqlalchemy import select, insert, update
+from sqlalchemy.orm import Session
+from db import engine, product, lookup_miss
+from helpers import (remote_lookup, ProviderError, categories, brands,
+                     LOOKUP_MISS_RETRY_AFTER)
+
+# ---------------------------------------------------------------------------
+# Konfig
+# ---------------------------------------------------------------------------
+
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "4"))      # gleichzeitige EANs
+PREFETCH_BATCH   = int(os.getenv("PREFETCH_BATCH", "50"))       # EANs pro DB-Transaktion
+
+EAN_RE = re.compile(r"\b\d{8,14}\b")
+IN_CHUNK = 1000                                                 # max. Werte pro IN (...)
+
+# ---------------------------------------------------------------------------
+# 1) Eingabe: EANs aus CSV / Freitext
+# ---------------------------------------------------------------------------
+
+def parse_eans(text: str) -> List[str]:
+    """Alle 8–14-stelligen Ziffernfolgen, Duplikate entfernt, Reihenfolge bleibt."""
+    return list(dict.fromkeys(EAN_RE.findall(text or "")))
+
+# ---------------------------------------------------------------------------
+# 2) DB: bekannte EANs ermitteln, Ergebnisse blockweise speichern
+# ---------------------------------------------------------------------------
+
+def _known_eans(eans: List[str]) -> set[str]:
+    """EANs, die schon im Katalog stehen oder (noch gültig) als unbekannt gelten."""
+    cutoff = datetime.now() - timedelta(seconds=LOOKUP_MISS_RETRY_AFTER)
+    known: set[str] = set()
+    with Session(engine) as s:
+        for i in range(0, len(eans), IN_CHUNK):
+            chunk = eans[i:i + IN_CHUNK]
+            known.update(s.scalars(select(product.c.ean)
+                                   .where(product.c.ean.in_(chunk))))
+            known.update(s.scalars(select(lookup_miss.c.ean)
+                                   .where(lookup_miss.c.ean.in_(chunk),
+                                          lookup_miss.c.last_try > cutoff)))
+    return known
+
+def _store_batch(hits: Dict[str, Tuple[str, Any, Any]], misses: List[str]) -> None:
+    with Session(engine) as s, s.begin():
+        if hits:
+            cat_names   = {(c or "").strip() or "Sonstiges" for _, c, _ in hits.values()}
+            brand_names = {(b or "").strip() for _, _, b in hits.values()}
+            cat_ids   = categories.resolve_many(cat_names, s)
+            brand_ids = brands.resolve_many(brand_names, s)
+            s.execute(
+                insert(product).prefix_with("IGNORE"),
+                [dict(ean=ean, name=name,
+                      category_id=cat_ids[(c or "").strip() or "Sonstiges"],
+                      brand_id=brand_ids.get((b or "").strip()))
+                 for ean, (name, c, b) in hits.items()]
+            )
+        if misses:
+            now = datetime.now()
+            s.execute(update(lookup_miss)
+                      .where(lookup_miss.c.ean.in_(misses))
+                      .values(tries=lookup_miss.c.tries + 1, last_try=now))
+            s.execute(insert(lookup_miss).prefix_with("IGNORE"),
+                      [dict(ean=e, tries=1, last_try=now) for e in misses])
+
+# ---------------------------------------------------------------------------
+# 3) Pipeline
+# ---------------------------------------------------------------------------
+
+def _fetch_one(ean: str) -> Tuple[str, Any]:
+    try:
+        hit = remote_lookup(ean, bulk=True)
+    except ProviderError as e:
+        return "error", str(e)
+    return ("hit", hit) if hit else ("miss", None)
+
+def prefetch(eans: Iterable[str],
+             workers: int = PREFETCH_WORKERS,
+             batch: int = PREFETCH_BATCH) -> Iterator[Dict[str, Any]]:
+    """
+    Importiert alle unbekannten EANs und liefert Fortschritts-Events:
+    {"event": "start" | "progress" | "done", "total", "known", "todo",
+     "done", "found", "missing", "errors"}
+    Fehlerhafte EANs (Provider gestört, Budget erschöpft) bleiben offen und werden beim
+    nächsten Lauf erneut versucht.
+    """
+    eans  = list(dict.fromkeys(e.strip() for e in eans if e and e.strip()))
+    known = _known_eans(eans)
+    todo  = [e for e in eans if e not in known]
+    stats = dict(total=len(eans), known=len(known), todo=len(todo),
+                 done=0, found=0, missing=0, errors=0)
+    yield {"event": "start", **stats}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers),
+                            thread_name_prefix="prefetch") as ex:
+        for i in range(0, len(todo), batch):
+            chunk  = todo[i:i + batch]
+            hits: Dict[str, Tuple[str, Any, Any]] = {}
+            misses: List[str] = []
+            for ean, (kind, val) in zip(chunk, ex.map(_fetch_one, chunk)):
+                if kind == "hit":
+                    hits[ean] = val
+                elif kind == "miss":
+                    misses.append(ean)
+                else:
+                    stats["errors"] += 1
+            _store_batch(hits, misses)
+
+            stats["done"]    += len(chunk)
+            stats["found"]   += len(hits)
+            stats["missing"] += len(misses)
+            yield {"event": "progress", **stats}
+
+    yield {"event": "done", **stats}
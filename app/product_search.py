@@ -0,0 +1,133 @@
+"""
+product_search.py – Volltextsuche für die Produktverwaltung
+
+• init_search()              → Suchindex anlegen (MariaDB: FULLTEXT über db.py,
+                               SQLite: FTS5-Trigramm-Tabelle + Trigger)
+• apply_search(stmt, q, b)   → Freitext- und Hersteller-Filter an ein Produkt-Select hängen,
+                               dazu die Sortierschlüssel (Ranking) für paging.py
+
+Ziffernfolgen ab EAN_MIN_DIGITS Stellen gelten als EAN-Anfang (B-Tree-Index über product.ean),
+kürzere suchen im Namen (Modell-Nr.) ODER am EAN-Anfang. Wörter unter drei Zeichen kann kein
+Index finden – die laufen als LIKE über die bereits eingegrenzten Zeilen.
+"""
+
+from __future__ import annotations
+import re
+from typing import List, Tuple
+
+from sqlalchemy import Float, Integer, and_, func, or_, select, text, type_coerce
+from sqlalchemy.dialects.mysql import match as mysql_match
+
+from db import engine, brand, product
+
+MIN_TOKEN      = 3                            # innodb_ft_min_token_size / Trigramm
+EAN_MIN_DIGITS = 8                            # kürzeste EAN (EAN-8) → reine EAN-Suche
+
+# ---------------------------------------------------------------------------
+# 1) Index
+# ---------------------------------------------------------------------------
+
+_SQLITE_FTS = [
+    """CREATE VIRTUAL TABLE product_fts USING fts5(
+           name, content='product', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+           INSERT INTO product_fts(rowid, name) VALUES (new.id, new.name);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+           INSERT INTO product_fts(product_fts, rowid, name) VALUES ('delete', old.id, old.name);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF name ON product BEGIN
+           INSERT INTO product_fts(product_fts, rowid, name) VALUES ('delete', old.id, old.name);
+           INSERT INTO product_fts(rowid, name) VALUES (new.id, new.name);
+       END""",
+    "INSERT INTO product_fts(product_fts) VALUES ('rebuild')",
+]
+
+_fts = False                                   # SQLite: FTS5-Trigramm verfügbar?
+
+def init_search() -> None:
+    """SQLite bekommt eine FTS5-Trigramm-Tabelle (ab SQLite 3.34), sonst bleibt es bei LIKE."""
+    global _fts
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        if conn.scalar(text("SELECT 1 FROM sqlite_master WHERE name = 'product_fts'")):
+            _fts = True
+            return
+        try:
+            for ddl in _SQLITE_FTS:
+                conn.execute(text(ddl))
+        except Exception:                      # kein FTS5 / kein Trigramm-Tokenizer
+            conn.rollback()
+            return
+    _fts = True
+
+# ---------------------------------------------------------------------------
+# 2) Filter + Ranking
+# ---------------------------------------------------------------------------
+
+def _split(q: str) -> Tuple[List[str], List[str]]:
+    """Wörter in (indexfähig, zu kurz) teilen."""
+    words = [w for w in re.split(r"\s+", q) if w]
+    return ([w for w in words if len(w) >= MIN_TOKEN],
+            [w for w in words if len(w) <  MIN_TOKEN])
+
+def _like(words: List[str]):
+    return and_(*(product.c.name.ilike(f"%{w}%") for w in words))
+
+def _mysql_terms(words: List[str]) -> str:
+    # Boolean Mode: jedes Wort Pflicht und als Präfix; Operatorzeichen entfernen
+    clean = (re.sub(r'[+\-<>()~*"@]', " ", w).strip() for w in words)
+    return " ".join(f"+{w}*" for c in clean for w in c.split() if len(w) >= MIN_TOKEN)
+
+def _fts_terms(words: List[str]) -> str:
+    # Trigramm-FTS: jedes Wort als Phrase = Teilstring, implizit UND-verknüpft
+    return " ".join('"{}"'.format(w.replace('"', '""')) for w in words)
+
+def apply_search(stmt, q: str = "", brand_q: str = ""):
+    """Filtert ein Select über `product` → (stmt, keys); keys = Sortierung für paging.keyset_page,
+    bei Freitext zuerst nach Relevanz, sonst nach Name (immer mit id als eindeutigem Abschluss)."""
+    by_name = [(product.c.name, False), (product.c.id, False)]
+    if brand_q:
+        # kleine Tabelle → IDs zuerst, dann über den Index product.brand_id
+        stmt = stmt.where(product.c.brand_id.in_(
+            select(brand.c.id).where(brand.c.name.ilike(f"%{brand_q}%"))))
+    if not q:
+        return stmt, by_name
+
+    digits = q.isdigit()
+    if digits and len(q) >= EAN_MIN_DIGITS:    # EAN-Anfang → Index über product.ean
+        return stmt.where(product.c.ean.like(f"{q}%")), [(product.c.ean, False), (product.c.id, False)]
+
+    words, short = _split(q)
+    dialect = engine.dialect.name
+    match, keys = None, by_name
+    if short and digits:                       # kurze Ziffern: Name ODER EAN-Anfang (unten)
+        match = _like(short)
+    elif short:
+        stmt = stmt.where(_like(short))
+
+    if words and dialect in ("mysql", "mariadb") and (terms := _mysql_terms(words)):
+        score = type_coerce(mysql_match(product.c.name, against=terms).in_boolean_mode(), Float)
+        match, keys = score > 0, [(score, True)] + by_name
+
+    elif words and dialect == "sqlite" and _fts:
+        hits = (text("SELECT rowid AS id, bm25(product_fts) AS score "
+                     "FROM product_fts WHERE product_fts MATCH :terms")
+                .bindparams(terms=_fts_terms(words))
+                .columns(id=Integer, score=Float)
+                .subquery("fts"))
+        # bm25: kleiner = besser; reine EAN-Treffer (ohne Namens-Treffer) ans Ende
+        if digits:
+            stmt  = stmt.outerjoin(hits, hits.c.id == product.c.id)
+            match = hits.c.id.is_not(None)
+            keys  = [(func.coalesce(hits.c.score, 0.0), False)] + by_name
+        else:
+            return stmt.join(hits, hits.c.id == product.c.id), [(hits.c.score, False)] + by_name
+
+    elif words:
+        match = or_(_like(words), product.c.ean.like(f"%{q}%"))
+
+    if digits:
+        match = or_(match, product.c.ean.like(f"{q}%"))
+    return (stmt.where(match) if match is not None else stmt), keys
@@ -0,0 +1,176 @@
+"""
+ratelimit.py – Gemeinsames Anfrage-Budget für Icecat und UPCitemdb (alle Worker/Prozesse)
+
+• acquire(provider, bulk)  → Token holen oder RateLimited; interaktive Scans warten höchstens
+                             RATELIMIT_MAX_WAIT, Massen-Importe bis RATELIMIT_BULK_WAIT
+• penalize(provider, s)    → nach 429: Provider pausieren (Retry-After bzw. exponentiell)
+• success(provider)        → Backoff zurücksetzen
+• quota_hint(provider, n)  → vom Provider gemeldetes Restkontingent übernehmen
+
+Je Provider ein Token-Bucket (<P>_RATE pro s, <P>_BURST) plus Tageskontingent (<P>_DAILY, UTC).
+Der Stand liegt als JSON in RATELIMIT_DIR und wird unter flock gelesen/geschrieben – alle
+Prozesse eines Hosts teilen sich damit ein Budget. Massen-Importe bekommen nur, was über der
+Reserve für Scans liegt: im Bucket mindestens die halbe Burst-Menge, vom Tageskontingent
+mindestens <P>_RESERVE Anfragen bleiben den interaktiven Scans.
+"""
+
+from __future__ import annotations
+import fcntl, json, os, tempfile, time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import metrics
+
+RATELIMIT_DIR       = Path(os.getenv("RATELIMIT_DIR", os.path.join(tempfile.gettempdir(), "ean-ratelimit")))
+RATELIMIT_MAX_WAIT  = float(os.getenv("RATELIMIT_MAX_WAIT", "2"))    # s – Scan wartet höchstens
+RATELIMIT_BULK_WAIT = float(os.getenv("RATELIMIT_BULK_WAIT", "60"))  # s – Import wartet höchstens
+BACKOFF_BASE        = 5.0                                            # s – erste Pause nach 429
+BACKOFF_MAX         = 900.0
+
+class RateLimited(Exception):
+    def __init__(self, provider: str, reason: str):
+        super().__init__(f"{provider}: {reason}")
+        self.provider, self.reason = provider, reason
+
+# rate: Tokens pro s (0 = ungedrosselt) · daily: Anfragen pro Tag (0 = unbegrenzt)
+# reserve: davon nur für interaktive Scans
+Budget = namedtuple("Budget", "rate burst daily reserve")
+
+def _budget(prefix: str, rate: str, burst: str, daily: str, reserve: str) -> Budget:
+    env = lambda k, d: os.getenv(f"{prefix}_{k}", d)
+    return Budget(float(env("RATE", rate)), float(env("BURST", burst)),
+                  int(env("DAILY", daily)), int(env("RESERVE", reserve)))
+
+BUDGETS: Dict[str, Budget] = {
+    "icecat": _budget("ICE", "10", "20", "0", "0"),
+    "upc":    _budget("UPC", "0.1", "6", "100", "30"),     # Trial: 100/Tag, 6/min
+}
+
+# ---------------------------------------------------------------------------
+# 1) Gemeinsamer Zustand (Datei + flock)
+# ---------------------------------------------------------------------------
+
+def _today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+@contextmanager
+def _state(provider: str, write: bool = True) -> Iterator[Dict[str, Any]]:
+    RATELIMIT_DIR.mkdir(parents=True, exist_ok=True)
+    with open(RATELIMIT_DIR / f"{provider}.json", "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+        f.seek(0)
+        try:
+            st = json.loads(f.read() or "{}")
+        except ValueError:
+            st = {}
+        budget, now = BUDGETS[provider], time.time()
+        if st.get("day") != _today():
+            st.update(day=_today(), used=0)
+        if budget.rate:                                      # Bucket auffüllen
+            st["tokens"] = min(budget.burst, st.get("tokens", budget.burst)
+                               + (now - st.get("at", now)) * budget.rate)
+        st["at"] = now
+        yield st
+        if write:
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(st))
+
+def _try(provider: str, bulk: bool) -> float:
+    """Token nehmen → 0; sonst Sekunden bis zum nächsten Versuch (RateLimited bei Kontingent)."""
+    budget = BUDGETS[provider]
+    with _state(provider) as st:
+        wait = st.get("blocked_until", 0) - time.time()
+        if wait > 0:
+            return wait
+        if budget.daily:
+            limit = budget.daily - (budget.reserve if bulk else 0)
+            if st["used"] >= limit:
+                raise RateLimited(provider, "Tageskontingent erschöpft" + (" (Reserve für Scans)" if bulk else ""))
+        if budget.rate:
+            need = 1 + (budget.burst / 2 if bulk else 0)     # Scans haben Vorrang
+            if st["tokens"] < need:
+                return (need - st["tokens"]) / budget.rate
+            st["tokens"] -= 1
+        st["used"] += 1
+        return 0.0
+
+# ---------------------------------------------------------------------------
+# 2) API
+# ---------------------------------------------------------------------------
+
+def acquire(provider: str, bulk: bool = False) -> None:
+    """Blockiert, bis der Aufruf erlaubt ist; RateLimited, wenn das zu lange dauern würde."""
+    if provider not in BUDGETS:
+        return
+    priority = "bulk" if bulk else "interactive"
+    deadline = time.monotonic() + (RATELIMIT_BULK_WAIT if bulk else RATELIMIT_MAX_WAIT)
+    try:
+        while True:
+            wait = _try(provider, bulk)
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimited(provider, f"Budget frühestens in {wait:.0f} s wieder frei")
+            metrics.throttled_total.inc(provider=provider, priority=priority, reason="wait")
+            time.sleep(min(wait, 1.0))
+    except RateLimited:
+        metrics.throttled_total.inc(provider=provider, priority=priority, reason="rejected")
+        raise
+
+def penalize(provider: str, retry_after: Optional[float] = None) -> None:
+    """429 → alle Prozesse pausieren diesen Provider."""
+    if provider not in BUDGETS:
+        return
+    with _state(provider) as st:
+        level = st.get("backoff", 0)
+        pause = retry_after if retry_after else min(BACKOFF_MAX, BACKOFF_BASE * 2 ** level)
+        st.update(backoff=level + 1, blocked_until=time.time() + pause)
+
+def success(provider: str) -> None:
+    if provider not in BUDGETS:
+        return
+    with _state(provider, write=False) as st:
+        clean = not st.get("backoff")
+    if not clean:
+        with _state(provider) as st:
+            st["backoff"] = 0
+
+def quota_hint(provider: str, remaining: int) -> None:
+    """Restkontingent laut Provider (z. B. X-RateLimit-Remaining) – genauer als unsere Zählung."""
+    budget = BUDGETS.get(provider)
+    if not budget or not budget.daily:
+        return
+    with _state(provider) as st:
+        st["used"] = max(st["used"], budget.daily - remaining)
+
+# ---------------------------------------------------------------------------
+# 3) Kennzahlen (Stand aus der gemeinsamen Datei, in allen Prozessen gleich → max)
+# ---------------------------------------------------------------------------
+
+def _gauge(field: str):
+    def read() -> Dict[tuple, float]:
+        out = {}
+        for provider, budget in BUDGETS.items():
+            try:
+                with _state(provider, write=False) as st:
+                    if field == "remaining" and budget.daily:
+                        out[(provider,)] = budget.daily - st["used"]
+                    elif field == "tokens" and budget.rate:
+                        out[(provider,)] = round(st["tokens"], 2)
+                    elif field == "blocked":
+                        out[(provider,)] = round(max(0.0, st.get("blocked_until", 0) - time.time()), 1)
+            except OSError:
+                pass
+        return out
+    return read
+
+metrics.Gauge("ean_provider_quota_remaining", "Restliches Tageskontingent je Provider",
+              _gauge("remaining"), ("provider",), merge="max")
+metrics.Gauge("ean_provider_tokens", "Verfügbare Tokens im Bucket je Provider",
+              _gauge("tokens"), ("provider",), merge="max")
+metrics.Gauge("ean_provider_blocked_seconds", "Restliche Pause nach 429 je Provider",
+              _gauge("blocked"), ("provider",), merge="max")
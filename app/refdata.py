@@ -0,0 +1,85 @@
+"""
+refdata.py – Stammdaten (Kategorien, Hersteller) pro Worker im Speicher
+
+• categories() / brands()        → [Ref(id, name)] nach Name sortiert (Drop-downs)
+• category_name(id) / brand_name(id)
+• invalidate()                   → nach neuen Einträgen; ansonsten nach REFDATA_TTL neu laden
+
+Beide Tabellen kommen mit EINER Abfrage (UNION ALL). Eine unbekannte ID (von einem anderen
+Worker gerade angelegt) löst höchstens einmal pro Sekunde ein Nachladen aus.
+"""
+
+from __future__ import annotations
+import os, threading, time
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+from sqlalchemy import literal, select, union_all
+
+from db import session_scope, category, brand
+
+REFDATA_TTL = int(os.getenv("REFDATA_TTL", "300"))
+
+Ref = namedtuple("Ref", "id name")
+
+class _Snapshot:
+    def __init__(self, rows):
+        self.by_id: Dict[str, Dict[int, str]] = {"cat": {}, "brand": {}}
+        for kind, rid, name in rows:
+            self.by_id[kind][rid] = name
+        self.sorted = {kind: [Ref(i, n) for i, n in sorted(ids.items(), key=lambda x: x[1].casefold())]
+                       for kind, ids in self.by_id.items()}
+        self.loaded = time.monotonic()
+
+class _Store:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snap: Optional[_Snapshot] = None
+
+    def _load(self) -> _Snapshot:
+        stmt = union_all(
+            select(literal("cat").label("kind"), category.c.id, category.c.name),
+            select(literal("brand").label("kind"), brand.c.id, brand.c.name),
+        )
+        with session_scope() as s:
+            snap = _Snapshot(s.execute(stmt).all())
+        self._snap = snap
+        return snap
+
+    def get(self, max_age: float = REFDATA_TTL) -> _Snapshot:
+        snap = self._snap
+        if snap is not None and time.monotonic() - snap.loaded < max_age:
+            return snap
+        with self._lock:                       # nur ein Thread lädt nach
+            snap = self._snap
+            if snap is None or time.monotonic() - snap.loaded >= max_age:
+                snap = self._load()
+            return snap
+
+    def name(self, kind: str, rid: Optional[int]) -> Optional[str]:
+        if rid is None:
+            return None
+        name = self.get().by_id[kind].get(rid)
+        if name is None:                       # neu in einem anderen Worker
+            name = self.get(max_age=1.0).by_id[kind].get(rid)
+        return name
+
+    def invalidate(self) -> None:
+        self._snap = None
+
+_store = _Store()
+
+def categories() -> List[Ref]:
+    return _store.get().sorted["cat"]
+
+def brands() -> List[Ref]:
+    return _store.get().sorted["brand"]
+
+def category_name(rid: Optional[int]) -> Optional[str]:
+    return _store.name("cat", rid)
+
+def brand_name(rid: Optional[int]) -> Optional[str]:
+    return _store.name("brand", rid)
+
+def invalidate() -> None:
+    _store.invalidate()
@@ -0,0 +1,203 @@
+"""
+serial_index.py – Schon ausgelieferte Seriennummern erkennen (Bloom-Filter pro Worker)
+
+• duplicates(s, sns)   → Zeilen (wie serial_search.find) zu Nummern, die schon auf einem
+                         Protokoll stehen; nur Bloom-Treffer gehen an die Datenbank
+                         (exact=True beim Speichern: immer über den DB-Index)
+• add(sns)             → nach dem Speichern sofort bekannt machen
+• lock(s, sns)         → Zeilensperre je Nummer bis zum Commit: zwei Protokolle mit derselben
+                         Nummer werden nacheinander gespeichert, das zweite sieht das erste
+
+Der Filter wird einmal im Hintergrund aus serial.sn_norm aufgebaut und danach über
+`serial.id > zuletzt gesehen` nachgeführt (höchstens alle SERIAL_INDEX_REFRESH s). Lücken in
+den IDs (Transaktion eines anderen Workers noch offen) werden GAP_TTL s lang mit abgefragt –
+was eine noch längere Transaktion speichert, kennt der Filter erst nach dem nächsten Neuaufbau.
+Für die Warnung beim Scannen reicht das; save_slip fragt mit exact=True unter der Sperre
+(lock) direkt den Index ix_serial_sn_norm und sieht damit jedes abgeschlossene Protokoll.
+Bis der Filter steht, fragt duplicates() ebenfalls direkt die Datenbank.
+Fehlalarme (ca. 1 %) kosten nur eine Bestätigungs-Abfrage.
+Wächst der Bestand über die geplante Größe, wird der Filter im Hintergrund neu gebaut.
+"""
+
+from __future__ import annotations
+import logging, os, threading, time, zlib
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.orm import Session
+
+import metrics
+from db import engine, serial, serial_lock, SERIAL_LOCK_SLOTS
+from serial_search import find
+
+log = logging.getLogger(__name__)
+
+SERIAL_INDEX_REFRESH = float(os.getenv("SERIAL_INDEX_REFRESH", "1"))   # Sekunden
+BITS_PER_ENTRY       = 10                 # ≈ 1 % Fehlalarme bei 7 Hashes
+HASHES               = 7
+MIN_CAPACITY         = 100_000
+BUILD_BATCH          = 50_000
+GAP_TTL              = 60                 # s – so lange auf fehlende IDs warten
+MAX_GAPS             = 10_000
+BUILD_OVERLAP        = 1_000              # IDs vor dem Aufbau-Stand einmal nachlesen
+
+# ---------------------------------------------------------------------------
+# 1) Bloom-Filter
+# ---------------------------------------------------------------------------
+
+class _Bloom:
+    """Bitfeld + Double Hashing über hash() – pro Prozess stabil, mehr braucht es hier nicht."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.m        = capacity * BITS_PER_ENTRY
+        self.bits     = bytearray((self.m + 7) // 8)
+        self.count    = 0
+
+    def _positions(self, key: str):
+        h  = hash(key)
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) & 0xFFFFFFFF | 1
+        m  = self.m
+        return ((h1 + i * h2) % m for i in range(HASHES))
+
+    def add(self, key: str) -> None:
+        bits = self.bits
+        for p in self._positions(key):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+# ---------------------------------------------------------------------------
+# 2) Index
+# ---------------------------------------------------------------------------
+
+class _Index:
+    def __init__(self):
+        self._lock      = threading.Lock()
+        self._bloom: Optional[_Bloom] = None
+        self._last_id   = 0
+        self._refreshed = 0.0
+        self._building  = False
+        self._gaps: Dict[int, float] = {}      # fehlende id → seit wann
+
+    # -- Aufbau -------------------------------------------------------------
+    def _build(self) -> None:
+        try:
+            t0 = time.perf_counter()
+            with engine.connect() as conn:
+                max_id = conn.scalar(select(func.coalesce(func.max(serial.c.id), 0)))
+                total  = conn.scalar(select(func.count()).select_from(serial))
+                bloom  = _Bloom(max(MIN_CAPACITY, 2 * total))
+                result = conn.execution_options(yield_per=BUILD_BATCH).execute(
+                    select(serial.c.sn_norm)
+                    .where(serial.c.id <= max_id, serial.c.sn_norm.is_not(None)))
+                for part in result.partitions():
+                    for (sn,) in part:
+                        bloom.add(sn)
+            with self._lock:
+                # was seit max_id dazukam (oder davor noch offen war), holt _catch_up nach
+                self._bloom, self._refreshed = bloom, 0.0
+                self._last_id = max(0, max_id - BUILD_OVERLAP)
+                self._gaps.clear()
+            log.info("Seriennummern-Index: %d Einträge in %.1f s", bloom.count,
+                     time.perf_counter() - t0)
+        except Exception:
+            log.exception("Seriennummern-Index konnte nicht aufgebaut werden")
+        finally:
+            self._building = False
+
+    def _start_build(self) -> None:
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._build, name="serial-index", daemon=True).start()
+
+    # -- Nachführen ---------------------------------------------------------
+    def _catch_up(self, s: Session, bloom: _Bloom) -> None:
+        now, last = time.monotonic(), self._last_id
+        gaps = [i for i, t in list(self._gaps.items()) if now - t < GAP_TTL]
+        cond = serial.c.id > last
+        if gaps:
+            cond = or_(cond, serial.c.id.in_(gaps))
+        rows = s.execute(select(serial.c.id, serial.c.sn_norm).where(cond)).all()
+        with self._lock:
+            if self._bloom is not bloom or self._last_id != last:
+                return                         # neu gebaut / anderer Thread war schneller
+            seen = set()
+            for rid, sn in rows:
+                if sn is not None:
+                    bloom.add(sn)
+                seen.add(rid)
+            self._gaps = {i: t for i, t in self._gaps.items()
+                          if i not in seen and now - t < GAP_TTL}
+            top = max(seen, default=last)
+            for i in range(last + 1, top):
+                if i not in seen and len(self._gaps) < MAX_GAPS:
+                    self._gaps[i] = now
+            self._last_id, self._refreshed = max(last, top), now
+        if bloom.count > bloom.capacity:
+            self._start_build()
+
+    # -- Abfragen -----------------------------------------------------------
+    def duplicates(self, s: Session, sns: List[str], exact: bool = False) -> list:
+        if not sns:
+            return []
+        bloom = self._bloom
+        if bloom is None:                      # noch im Aufbau → direkt über den DB-Index
+            self._start_build()
+            return find(s, sns)[0]
+        if exact:                              # Speichern: ein „nein“ des Filters reicht nicht
+            return find(s, sns)[0]
+        if time.monotonic() - self._refreshed >= SERIAL_INDEX_REFRESH:
+            self._catch_up(s, bloom)
+        hits = [sn for sn in sns if sn in bloom]
+        metrics.cache_total.inc(len(sns) - len(hits), cache="serial_index", result="miss")
+        if not hits:
+            return []
+        metrics.cache_total.inc(len(hits), cache="serial_index", result="hit")
+        return find(s, hits)[0]                # Bestätigung – Fehlalarme fallen hier raus
+
+    def add(self, sns: Iterable[str]) -> None:
+        bloom = self._bloom
+        if bloom is None:
+            return
+        with self._lock:
+            for sn in sns:
+                bloom.add(sn)
+
+_index = _Index()
+
+metrics.Gauge("ean_serial_index_entries", "Seriennummern im Bloom-Filter (je Worker)",
+              lambda: _index._bloom.count if _index._bloom else 0, merge="max")
+
+def duplicates(s: Session, sns: List[str], exact: bool = False) -> list:
+    """Schon gespeicherte Vorkommen der (normalisierten) Seriennummern, neueste zuerst.
+    exact=True: maßgeblich (DB-Index) statt Bloom-Filter – für die Prüfung beim Speichern."""
+    return _index.duplicates(s, sns, exact)
+
+def add(sns: Iterable[str]) -> None:
+    _index.add(sns)
+
+def _slots(sns: Iterable[str]) -> List[int]:
+    return sorted({zlib.crc32(sn.encode()) % SERIAL_LOCK_SLOTS for sn in sns})
+
+def lock(s: Session, sns: Iterable[str]) -> None:
+    """
+    Als ERSTE Anweisung der Speicher-Transaktion aufrufen: sperrt die Zeilen der Nummern bis
+    zum Commit. MariaDB: Zeilensperren in Schlüssel-Reihenfolge (keine Verklemmung), der
+    Lese-Snapshot entsteht erst danach und enthält damit alles, was der Vorgänger gespeichert
+    hat. SQLite: das UPDATE holt die Schreibsperre der Datenbank.
+    """
+    slots = _slots(sns)
+    if slots:
+        s.execute(update(serial_lock).where(serial_lock.c.slot.in_(slots))
+                  .values(n=serial_lock.c.n + 1))
+
+def warm() -> None:
+    """Aufbau beim Start anstoßen (läuft im Hintergrund)."""
+    _index._start_build()
@@ -0,0 +1,80 @@
+"""
+serial_search.py – Rückverfolgung: Auf welchem Protokoll ging Seriennummer X raus?
+
+• normalize(sn)          → Suchform: Großbuchstaben, ohne Leerzeichen (Spalte serial.sn_norm)
+• parse_serials(text)    → eingefügte Liste (Zeilen, Komma, Semikolon, Tab) → Suchbegriffe
+• find(s, terms, prefix) → Treffer mit Protokoll, Produkt, Kunde, Datum + nicht gefundene Begriffe
+
+Gesucht wird nur über den Index auf serial.sn_norm: exakt (IN-Liste, blockweise) oder als
+Präfix (LIKE 'ABC%'). Die Originalschreibweise bleibt in serial.sn für PDF und Anzeige.
+"""
+
+from __future__ import annotations
+import os, re
+from typing import List, Tuple
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from db import serial, slip_item, slip, product
+
+SERIAL_SEARCH_LIMIT = int(os.getenv("SERIAL_SEARCH_LIMIT", "500"))   # max. Trefferzeilen
+MAX_TERMS           = 1000                                           # Begriffe pro Anfrage
+IN_CHUNK            = 500                                            # Werte je IN (…)
+
+_WS    = re.compile(r"\s+")
+_SPLIT = re.compile(r"[\r\n,;\t]+")
+
+def normalize(sn: str) -> str:
+    return _WS.sub("", sn).upper()
+
+def parse_serials(text: str) -> List[str]:
+    """Suchbegriffe normalisiert, ohne Dubletten, in Eingabe-Reihenfolge (ValueError bei zu vielen)."""
+    terms = list(dict.fromkeys(t for t in map(normalize, _SPLIT.split(text or "")) if t))
+    if len(terms) > MAX_TERMS:
+        raise ValueError(f"Höchstens {MAX_TERMS} Seriennummern pro Suche")
+    return terms
+
+def _select():
+    return (
+        select(serial.c.sn,
+               slip.c.number,
+               slip.c.created_at,
+               slip.c.customer,
+               slip.c.order_no,
+               product.c.ean,
+               product.c.name.label("product"),
+               serial.c.sn_norm)
+        .select_from(serial)
+        .join(slip_item, slip_item.c.id == serial.c.item_id)
+        .join(slip,      slip.c.id == slip_item.c.slip_id)
+        .join(product,   product.c.id == slip_item.c.product_id)
+    )
+
+def find(s: Session, terms: List[str], prefix: bool = False,
+         limit: int = SERIAL_SEARCH_LIMIT) -> Tuple[list, List[str]]:
+    """→ (Zeilen, neueste Protokolle zuerst; Begriffe ohne Treffer)."""
+    if not terms:
+        return [], []
+    if prefix:
+        conds  = [or_(*(serial.c.sn_norm.startswith(t, autoescape=True) for t in terms))]
+    else:
+        conds  = [serial.c.sn_norm.in_(terms[i:i + IN_CHUNK])
+                  for i in range(0, len(terms), IN_CHUNK)]
+    rows = []
+    for cond in conds:
+        rows += s.execute(_select().where(cond)
+                          .order_by(slip.c.created_at.desc(), serial.c.id)
+                          .limit(limit - len(rows))).all()
+        if len(rows) >= limit:
+            break
+    rows.sort(key=lambda r: r.created_at, reverse=True)
+
+    found = {r.sn_norm for r in rows}
+    if prefix:
+        missing = [t for t in terms if not any(f.startswith(t) for f in found)]
+    else:
+        missing = [t for t in terms if t not in found]
+    if len(rows) >= limit:                     # abgeschnitten → „fehlt“ wäre geraten
+        missing = []
+    return rows, missing
@@ -0,0 +1,211 @@
+"""
+slip_export.py – Sammel-Export aller Protokolle eines Filters (z. B. Monat)
+
+• slip_query(q, from, to)   → dieselbe Auswahl wie die Protokoll-Übersicht
+• iter_slips(stmt)          → Köpfe + Positionen blockweise (Keyset) mit je 2 Queries
+• export_zip(stmt)          → ZIP als Byte-Strom; PDFs parallel in Prozessen gerendert,
+                              bereits gecachte PDFs kommen direkt aus dem PDF-Cache
+• export_pdf(stmt, out)     → ein Sammel-PDF (ein Lesezeichen je Protokoll) direkt nach out
+• export_key(stmt)          → Inhalts-Hash des Sammel-PDFs = Schlüssel im PDF-Cache
+• submit_pdf(stmt, key)     → Sammel-PDF im Hintergrund in den PDF-Cache rendern; den Stand
+  liefert pdf_status(key), geladen wird es danach per Link (kein minutenlanger Request)
+"""
+
+from __future__ import annotations
+import hashlib, multiprocessing, os, threading, zipfile
+from collections import deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, BinaryIO, Deque, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, or_
+from sqlalchemy.orm import Session
+
+import pdf_cache
+from cache import LRUCache
+from db import engine, slip, slip_item
+from paging import keyset_page
+from pdf_jobs import ensure_pdf, open_pdf
+from slip_pdf import items_query, content_key, file_name, write_pdf_many
+
+EXPORT_PROCESSES = int(os.getenv("EXPORT_PROCESSES", str(os.cpu_count() or 2)))
+EXPORT_BATCH     = int(os.getenv("EXPORT_BATCH", "200"))      # Protokolle pro Query-Block
+EXPORT_JOBS      = int(os.getenv("EXPORT_JOBS", "1"))         # Sammel-PDFs gleichzeitig pro Worker
+
+CHUNK = 64 * 1024
+
+# schlanke, picklebare Zeilen für die Render-Prozesse
+SlipHdr  = namedtuple("SlipHdr",  "number order_no customer created_at id")
+SlipItem = namedtuple("SlipItem", "slip_id pos_id qty cat prod sns")
+
+# ---------------------------------------------------------------------------
+# 1) Auswahl + Daten
+# ---------------------------------------------------------------------------
+
+# Sortierung der Übersicht = Keyset-Schlüssel (neueste zuerst, id macht eindeutig)
+SLIP_KEYS = [(slip.c.created_at, True), (slip.c.id, True)]
+
+def slip_query(q: str = "", date_from: Optional[str] = None,
+               date_to: Optional[str] = None):
+    """Protokoll-Köpfe nach Suchbegriff (Bestell-Nr./Kunde) und Datumsbereich (Sortierung: SLIP_KEYS)."""
+    stmt = (
+        select(slip.c.number,
+               slip.c.order_no,
+               slip.c.customer,
+               slip.c.created_at)
+    )
+    if q:
+        like = f"%{q}%"
+        # MariaDB vergleicht ohnehin ohne Groß/Klein (…_ci) – ILIKE würde lower() um die Spalte
+        # legen, dann könnte der Server nicht einmal die schmalen Indizes durchsuchen
+        match = (lambda c: c.like(like)) if engine.dialect.name in ("mysql", "mariadb") \
+                else (lambda c: c.ilike(like))
+        stmt = stmt.where(or_(match(slip.c.order_no), match(slip.c.customer)))
+    if date_from:
+        stmt = stmt.where(slip.c.created_at >= date_from)
+    if date_to:
+        # “bis inkl.” → + 1 Tag
+        stmt = stmt.where(slip.c.created_at < f"{date_to} 23:59:59")
+    return stmt
+
+def iter_slips(stmt, batch: int = EXPORT_BATCH) -> Iterator[Tuple[str, SlipHdr, List[SlipItem]]]:
+    """(Nr., Kopf, Positionen) – je Block eine Query für Köpfe und eine für alle Positionen."""
+    stmt  = stmt.add_columns(slip.c.id)
+    after = None
+    while True:
+        with Session(engine) as s:
+            page = keyset_page(s, stmt, SLIP_KEYS, after, batch)
+            hdrs = [SlipHdr(*r[:len(SlipHdr._fields)]) for r in page.rows]
+            if not hdrs:
+                return
+            items: dict[int, List[SlipItem]] = {h.id: [] for h in hdrs}
+            for r in s.execute(items_query().where(slip_item.c.slip_id.in_(list(items)))):
+                items[r.slip_id].append(SlipItem(*r))
+        for h in hdrs:
+            yield h.number, h, items[h.id]
+        if not page.next:
+            return
+        after = page.next
+
+# ---------------------------------------------------------------------------
+# 2) Byte-Strom
+# ---------------------------------------------------------------------------
+
+class _Chunks:
+    """Schreibziel für ZipFile (nicht seekbar) – gesammelte Bytes holt drain() ab."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        parts, self._parts = self._parts, []
+        if parts:
+            yield b"".join(parts)
+
+def _done(value: Any) -> Future:
+    fut: Future = Future()
+    fut.set_result(value)
+    return fut
+
+def _rendered(stmt, ex: ProcessPoolExecutor) -> Iterator[Tuple[str, SlipHdr, List[SlipItem], Future]]:
+    """In Filter-Reihenfolge; gleichzeitig höchstens ein paar PDFs pro Prozess in Arbeit."""
+    pending: Deque[Tuple[str, SlipHdr, List[SlipItem], Future]] = deque()
+    limit = EXPORT_PROCESSES * 4
+    for number, hdr, rows in iter_slips(stmt):
+        cached = pdf_cache.get(content_key(number, hdr, rows))
+        fut = _done(cached) if cached else ex.submit(ensure_pdf, number, hdr, rows)
+        pending.append((number, hdr, rows, fut))
+        while pending and (len(pending) > limit or pending[0][3].done()):
+            yield pending.popleft()
+    yield from pending
+
+def _open_rendered(number: str, hdr: SlipHdr, rows: List[SlipItem], fut: Future) -> BinaryIO:
+    """Fertiges PDF öffnen. Hat die Cache-Begrenzung die Datei inzwischen weggeräumt, hier neu
+    holen (rendert bei Bedarf); die offene Datei bleibt auch bei erneutem Aufräumen lesbar."""
+    try:
+        return open(fut.result(), "rb")
+    except FileNotFoundError:
+        return open_pdf(number, hdr, rows)
+
+def export_zip(stmt) -> Iterator[bytes]:
+    """ZIP mit einem PDF je Protokoll; wird geliefert, sobald die PDFs der Reihe nach fertig sind."""
+    out    = _Chunks()
+    errors = []
+    ctx    = multiprocessing.get_context("spawn")   # kein fork() aus dem Thread-reichen Worker
+    with ProcessPoolExecutor(max_workers=EXPORT_PROCESSES, mp_context=ctx) as ex, \
+         zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for number, hdr, rows, fut in _rendered(stmt, ex):
+            try:
+                src = _open_rendered(number, hdr, rows, fut)
+            except Exception as e:
+                errors.append(f"{number}: {type(e).__name__}: {e}")
+                continue
+            with src, zf.open(f"{number}_{file_name(hdr)}", "w") as dst:
+                while block := src.read(CHUNK):
+                    dst.write(block)
+                    yield from out.drain()
+        if errors:
+            zf.writestr("FEHLER.txt", "\n".join(errors) + "\n")
+    yield from out.drain()                         # Zentralverzeichnis
+
+def export_pdf(stmt, out: BinaryIO) -> None:
+    """Ein PDF mit allen Protokollen, seitenweise gerendert direkt nach `out`."""
+    write_pdf_many(iter_slips(stmt), out)
+
+# ---------------------------------------------------------------------------
+# 3) Sammel-PDF als Hintergrund-Job
+#    fpdf2 schreibt das PDF erst, wenn alle Protokolle gezeichnet sind – statt den
+#    Request so lange offen zu halten, landet es im PDF-Cache und wird per Link geladen
+# ---------------------------------------------------------------------------
+
+_pdf_pool = ThreadPoolExecutor(max_workers=EXPORT_JOBS, thread_name_prefix="export")
+_jobs: Dict[str, Future] = {}
+_errors = LRUCache(maxsize=64, ttl=600)            # Schlüssel → letzte Fehlermeldung
+_lock   = threading.Lock()
+
+def export_key(stmt) -> str:
+    """Hash über die Inhalts-Hashes aller Protokolle – gleiche Auswahl + Inhalt ⇒ gleiche Datei."""
+    h = hashlib.sha256(b"export")
+    for number, hdr, rows in iter_slips(stmt):
+        h.update(content_key(number, hdr, rows).encode())
+    return h.hexdigest()
+
+def _run(stmt, key: str) -> None:
+    try:
+        # Datei-Lock je Schlüssel: stößt ein anderer Worker denselben Export an, wartet er
+        pdf_cache.get_or_create(key, lambda f: export_pdf(stmt, f))
+    except Exception as e:
+        _errors.set(key, f"{type(e).__name__}: {e}")
+        raise
+
+def submit_pdf(stmt, key: str) -> None:
+    """Sammel-PDF nach pdf_cache[key] rendern – höchstens ein Job je Schlüssel und Worker."""
+    with _lock:
+        if key in _jobs:
+            return
+        _errors.delete(key)
+        fut = _pdf_pool.submit(_run, stmt, key)
+        _jobs[key] = fut
+        fut.add_done_callback(lambda f: _forget(key, f))
+
+def _forget(key: str, fut: Future) -> None:
+    with _lock:
+        if _jobs.get(key) is fut:
+            del _jobs[key]
+
+def pdf_status(key: str) -> Dict[str, Any]:
+    """{"state": "rendering" | "ready" | "error" | "pending", …} – wie pdf_jobs.status()."""
+    if key in _jobs:
+        return {"state": "rendering"}
+    if pdf_cache.get(key) is not None:
+        return {"state": "ready"}
+    err = _errors.get(key)
+    if err:
+        return {"state": "error", "error": err}
+    return {"state": "pending"}             # Job läuft in einem anderen Worker (oder nie gestartet)
@@ -0,0 +1,90 @@
+"""
+slip_numbers.py – Protokoll-Nummern YYYY-MM-DD-NNN vergeben
+
+• preview(s)            → voraussichtliche nächste Nummer für die Maske (vergibt nichts)
+• insert_header(s, hdr) → Protokoll-Kopf mit Platzhalter-Nummer anlegen → slip.id
+• claim(s, slip_id)     → als LETZTE Anweisung vor dem Commit die nächste Nummer ziehen und
+                          eintragen → Nummer; ein atomares Statement auf den Tageszähler
+
+Gezogen wird erst beim Speichern: der Zähler steht in derselben Transaktion wie Kopf und
+Positionen, ein Rollback gibt die Nummer wieder frei – die Tagesfolge bleibt lückenlos, egal wie
+oft die Maske neu geladen oder verlassen wird. Die Zeile des Tageszählers bleibt bis zum Commit
+gesperrt; weil claim() zuletzt läuft, warten gleichzeitige Speichervorgänge nur auf den Commit
+des Vorgängers, nicht auf dessen Positionen und Seriennummern.
+"""
+
+from __future__ import annotations
+import secrets
+from datetime import date
+
+from sqlalchemy import select, insert, update, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from db import slip, slip_counter
+
+# ---------------------------------------------------------------------------
+# 1) Tageszähler
+# ---------------------------------------------------------------------------
+
+def _bump(s, day: str) -> int:
+    """Zähler des Tages um 1 erhöhen und den neuen Wert liefern – ein Statement, zeilengesperrt."""
+    dialect = s.bind.dialect.name
+    if dialect in ("mysql", "mariadb"):
+        # LAST_INSERT_ID(expr) legt den Wert für genau diese Verbindung ab → lastrowid
+        stmt = (mysql_insert(slip_counter)
+                .values(day=day, last=func.last_insert_id(1))
+                .on_duplicate_key_update(last=func.last_insert_id(slip_counter.c.last + 1)))
+        return s.execute(stmt).lastrowid
+    if dialect in ("sqlite", "postgresql"):
+        ins  = (sqlite_insert if dialect == "sqlite" else pg_insert)(slip_counter)
+        stmt = (ins.values(day=day, last=1)
+                .on_conflict_do_update(index_elements=[slip_counter.c.day],
+                                       set_={"last": slip_counter.c.last + 1})
+                .returning(slip_counter.c.last))
+        return s.scalar(stmt)
+    # andere Dialekte: Zeilensperre über SELECT … FOR UPDATE
+    last = s.scalar(select(slip_counter.c.last)
+                    .where(slip_counter.c.day == day).with_for_update())
+    if last is None:
+        s.execute(insert(slip_counter).values(day=day, last=1))
+        return 1
+    s.execute(update(slip_counter).where(slip_counter.c.day == day)
+              .values(last=slip_counter.c.last + 1))
+    return last + 1
+
+# ---------------------------------------------------------------------------
+# 2) Anzeige + Vergabe
+# ---------------------------------------------------------------------------
+
+def _number(day: str, seq: int) -> str:
+    return f"{day}-{seq:03d}"
+
+def _taken(s, number: str) -> bool:
+    # nur am Umstellungstag relevant: Nummern aus der Zeit vor dem Zähler überspringen
+    return s.scalar(select(slip.c.id).where(slip.c.number == number)) is not None
+
+def preview(s) -> str:
+    """Nächste Nummer, wie sie jetzt vergeben würde – nur zur Anzeige, ohne Schreibzugriff."""
+    day = date.today().isoformat()
+    seq = (s.scalar(select(slip_counter.c.last).where(slip_counter.c.day == day)) or 0) + 1
+    while _taken(s, _number(day, seq)):
+        seq += 1
+    return _number(day, seq)
+
+def insert_header(s, hdr: dict) -> int:
+    """Kopf (hdr ohne number) anlegen; die Platzhalter-Nummer ersetzt claim() vor dem Commit."""
+    placeholder = "~" + secrets.token_hex(12)     # eindeutig, nie im Format YYYY-MM-DD-NNN
+    return s.execute(insert(slip).values(number=placeholder, **hdr)).inserted_primary_key[0]
+
+def claim(s, slip_id: int) -> str:
+    """Nummer ziehen und beim Kopf eintragen → Nummer. Letzte Anweisung der Transaktion, die
+    Kopf und Positionen speichert – ab hier ist der Tageszähler bis zum Commit gesperrt."""
+    day = date.today().isoformat()
+    while True:
+        number = _number(day, _bump(s, day))
+        if not _taken(s, number):
+            break
+    s.execute(update(slip).where(slip.c.id == slip_id).values(number=number))
+    return number
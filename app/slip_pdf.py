@@ -0,0 +1,583 @@
+"""
+slip_pdf.py – Seriennummernprotokoll als PDF
+
+• load_slip(number)        → Kopf + Positionen aus der DB (eine Session)
+• items_query()            → Positionen-Query (auch für viele Protokolle auf einmal)
+• write_pdf(hdr, rows, f)  → PDF seitenweise nach f streamen (ohne DB-Zugriff)
+• render_pdf(hdr, rows)    → dasselbe als Bytes
+• write_pdf_many(slips, f) → mehrere Protokolle in einem PDF (Sammel-Export)
+• template()               → Dokument-Vorlage je Worker (Schrift, Logo, Briefkopf)
+• file_name(hdr)           → Download-Name
+• LAYOUT_KEY               → ändert sich mit jeder Layout-Konstante (für Caches)
+"""
+
+from __future__ import annotations
+import copy, hashlib, io, json, os, re, tempfile, threading, time, zlib
+from itertools import islice
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from fontTools import ttLib
+from fpdf import FPDF
+from fpdf.fonts import SubsetMap
+from fpdf.image_parsing import preload_image
+from fpdf.output import OutputProducer
+from fpdf.syntax import Name, PDFContentStream, PDFObject
+from sqlalchemy import select, func
+
+from db import session_scope, category, product, slip, slip_item, serial
+import barcode, metrics
+
+# ───────────────────────── Ressourcen ──────────────────────────
+BASE_DIR  = Path(__file__).parent
+FONT_PATH = BASE_DIR / "fonts" / "DejaVuSans.ttf"
+LOGO_PATH = BASE_DIR / "Logo.png"
+
+PDF_SPOOL_MB = float(os.getenv("PDF_SPOOL_MB", "4"))   # fertige Seiten bis dahin im RAM
+
+FONT_FAMILY = "DejaVu"
+FONT_FILES  = {                               # Stil → TTF; fehlende Stile nutzen ""
+    "":  FONT_PATH,
+    "B": BASE_DIR / "fonts" / "DejaVuSans-Bold.ttf",
+    "I": BASE_DIR / "fonts" / "DejaVuSans-Oblique.ttf",
+}
+
+# ───────────────────────── Layout-Konstanten ────────────────────
+PAGE_MARGIN = 15
+LINE_H      = 7
+PADDING     = 1          # mm Innenabstand je Zelle
+BARCODE_H   = 6          # mm DataMatrix-Höhe
+SERIAL_PT   = 6          # Schriftgröße der Seriennummern
+BC_MAX_CHARS = 1000      # max. Zeichen je DataMatrix – längere Listen → Folgezeilen
+COLS   = ["Pos.", "Menge", "Kategorie", "Produkt", "Serien-Nr", "BC"]
+WIDTHS = [10,      13,       27,          85,       35,          10]
+
+ADDR_LEFT = (
+    "<FIRMENNAME>\n"
+    "<STANDORT-BEZEICHNUNG>\n"
+    "<STRASSE> <HAUSNUMMER>\n"
+    "<PLZ> <ORT>\n"
+    "Tel.: <LÄNDERVORWAHL> <TELEFONNUMMER>"
+)
+
+ADDR_RIGHT = (
+    "<FIRMENNAME>\n"
+    "<STANDORT-BEZEICHNUNG>\n"
+    "<STRASSE> <HAUSNUMMER>\n"
+    "<PLZ> <ORT>\n"
+    "Tel.: <LÄNDERVORWAHL> <TELEFONNUMMER>"
+)
+
+# Bei Änderungen am Zeichnen (_draw & Co.) hochzählen → alte Cache-Einträge verfallen
+LAYOUT_VERSION = 4
+
+def _layout_key() -> str:
+    logo = LOGO_PATH.stat() if LOGO_PATH.exists() else None
+    fonts = {st: p.stat().st_size for st, p in FONT_FILES.items() if p.exists()}
+    parts = [LAYOUT_VERSION, PAGE_MARGIN, LINE_H, PADDING, BARCODE_H, SERIAL_PT,
+             BC_MAX_CHARS, COLS, WIDTHS,
+             ADDR_LEFT, ADDR_RIGHT, fonts,
+             [logo.st_size, logo.st_mtime] if logo else None]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()[:16]
+
+LAYOUT_KEY = _layout_key()
+
+# ────────────────────────────────────────────────────────────────
+
+TRANSLATE = str.maketrans(
+    "ÄÖÜäöüß", "AOUaouB")     # Minimal-Ersatz, gern anpassen
+
+def slug(txt: str) -> str:
+    txt = (txt or "-").translate(TRANSLATE)
+    txt = re.sub(r"[^A-Za-z0-9_-]+", "_", txt.strip())
+    return txt or "-"
+
+def file_name(hdr) -> str:
+    safe_order = slug(hdr.order_no)          # Bestell-Nr.
+    safe_cust  = slug(hdr.customer)
+    safe_date  = hdr.created_at.strftime("%d.%m.%Y")
+    return f"{safe_order}_{safe_cust}_{safe_date}_SNProtokoll.pdf"
+
+# ---------------------------------------------------------------------------
+# 1) Daten laden
+# ---------------------------------------------------------------------------
+
+def items_query():
+    """Positionen inkl. Seriennummern (sortiert, kommagetrennt); WHERE setzt der Aufrufer."""
+    return (
+        select(
+            slip_item.c.slip_id,
+            slip_item.c.id.label("pos_id"),
+            slip_item.c.quantity.label("qty"),
+            category.c.name.label("cat"),
+            product.c.name.label("prod"),
+            func.group_concat(serial.c.sn.op("ORDER BY")(serial.c.sn))
+                .label("sns")
+        )
+        .select_from(slip_item)
+        .join(product,   product.c.id       == slip_item.c.product_id)
+        .join(category,  category.c.id      == product.c.category_id)
+        .outerjoin(serial, serial.c.item_id == slip_item.c.id)
+        .group_by(
+            slip_item.c.slip_id,
+            slip_item.c.id,
+            slip_item.c.quantity,
+            category.c.name,
+            product.c.name
+        )
+        .order_by(slip_item.c.id)
+    )
+
+def load_slip(number: str) -> Tuple[Optional[Any], List[Any]]:
+    """(Kopf, Positionen) – Kopf None, wenn es das Protokoll nicht gibt."""
+    with session_scope() as s:
+        hdr = s.execute(
+            select(slip.c.id, slip.c.order_no, slip.c.customer, slip.c.created_at)
+            .where(slip.c.number == number)
+        ).first()
+        if not hdr:
+            return None, []
+        rows = s.execute(items_query().where(slip_item.c.slip_id == hdr.id)).all()
+    return hdr, rows
+
+def content_key(number: str, hdr, rows) -> str:
+    """Hash über Kopf, Positionen und Layout – identischer Inhalt ⇒ identisches PDF."""
+    payload = json.dumps(
+        [LAYOUT_KEY, number, hdr.order_no, hdr.customer, hdr.created_at.isoformat(),
+         [[r.qty, r.cat, r.prod, r.sns] for r in rows]],
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+# ---------------------------------------------------------------------------
+# 2) Dokument-Vorlage (einmal pro Worker)
+# ---------------------------------------------------------------------------
+
+class _SlipPDF(FPDF):
+    """FPDF, das fehlende Schriftstile auf den Normalstil abbildet.
+
+    Bisher wurde dieselbe DejaVuSans.ttf als "", "B" und "I" registriert –
+    optisch identisch, aber dreimal geparst, subsettet und eingebettet.
+    """
+
+    def set_font(self, family=None, style="", size=0):
+        fam = (family or self.font_family or "").lower()
+        if style and fam + style not in self.fonts:
+            style = ""
+        super().set_font(family, style, size)
+
+    def flush_page(self, page_no: int) -> None:
+        """Inhalt einer fertigen Seite komprimiert in den Spool schieben."""
+        page = self.pages[page_no]
+        data = zlib.compress(bytes(page.contents))
+        self._spool.seek(0, io.SEEK_END)
+        self._flushed[page_no] = (self._spool.tell(), len(data))
+        self._spool.write(data)
+        page.contents = bytearray()
+
+    def file_id(self):
+        sink = getattr(self, "_sink", None)
+        return sink.file_id(self.creation_date) if sink is not None else super().file_id()
+
+class DocTemplate:
+    """
+    Alles, was bei jedem Protokoll gleich ist – einmal vorbereitet:
+    • TTF-Metriken (cmap, Breiten, Glyph-IDs) je Schriftdatei
+    • Logo als fertig dekodierte/komprimierte Bildinfo
+    • Briefkopf: Adresszeilen bereits umbrochen
+    new_document() liefert ein frisches FPDF, das sich diese Teile teilt;
+    pro Dokument neu sind nur Subset-Tabelle und fontTools-Objekt
+    (fpdf2 verändert es beim Subsetten in output()).
+    """
+
+    def __init__(self):
+        proto = _SlipPDF()
+        self._fonts: List[Tuple[str, Any, bytes]] = []      # (fontkey, TTFFont, TTF-Bytes)
+        for style, path in FONT_FILES.items():
+            if path.exists():
+                proto.add_font(FONT_FAMILY, style, str(path))
+                key = FONT_FAMILY.lower() + style
+                self._fonts.append((key, proto.fonts[key], path.read_bytes()))
+
+        self._images: Dict[str, dict] = {}
+        if LOGO_PATH.exists():
+            preload_image(proto.image_cache, str(LOGO_PATH))
+            for name, info in proto.image_cache.images.items():
+                self._images[name] = copy.copy(info)          # RasterImageInfo
+                self._images[name]["usages"] = 0
+        self._icc = dict(proto.image_cache.icc_profiles)
+
+        proto.add_page()                                     # nur zum Umbrechen
+        proto.set_font(FONT_FAMILY, "", 8)
+        self.addr_left  = proto.multi_cell(60, 4, ADDR_LEFT,  split_only=True)
+        self.addr_right = proto.multi_cell(60, 4, ADDR_RIGHT, split_only=True)
+
+    def new_document(self) -> FPDF:
+        pdf = _SlipPDF()
+        pdf.alias_nb_pages(None)                  # Seitenzahlen stehen vorab fest
+
+        # Zeichen, die fpdf2 für die Seitenzahl-Ersetzung fest im Subset braucht
+        reserved = "\x00 \r\n" + ("0123456789" + pdf.str_alias_nb_pages
+                                   if pdf.str_alias_nb_pages else "")
+        for key, proto, data in self._fonts:
+            font = copy.copy(proto)
+            font.i = len(pdf.fonts) + 1
+            font.ttfont = ttLib.TTFont(io.BytesIO(data), recalcTimestamp=False,
+                                       fontNumber=0, lazy=True)
+            font.missing_glyphs = []
+            font.subset = SubsetMap(font, [ord(c) for c in reserved])
+            pdf.fonts[key] = font
+
+        for name, info in self._images.items():
+            pdf.image_cache.images[name] = copy.copy(info)
+        pdf.image_cache.icc_profiles.update(self._icc)
+        return pdf
+
+    def letterhead(self, pdf: FPDF) -> None:
+        """Adressen links/rechts, Logo mittig, Trennlinie."""
+        pdf.set_font(FONT_FAMILY, "", 8)
+        for x, lines, align in ((PAGE_MARGIN, self.addr_left, "L"),
+                                (pdf.w - PAGE_MARGIN - 60, self.addr_right, "R")):
+            pdf.set_xy(x, PAGE_MARGIN)
+            for line in lines:
+                pdf.cell(60, 4, line, align=align, new_x="LEFT", new_y="NEXT")
+
+        # Logo (40 mm) wirklich zentriert am oberen Seitenrand
+        logo_w = 40
+        logo_y = PAGE_MARGIN
+        if self._images:
+            pdf.image(str(LOGO_PATH), x=(pdf.w - logo_w) / 2, y=logo_y, w=logo_w)
+
+        # Trennlinie unter Logo/Adressen
+        pdf.set_y(logo_y + logo_w + 0.1)
+        pdf.line(PAGE_MARGIN, pdf.get_y(), pdf.w - PAGE_MARGIN, pdf.get_y())
+        pdf.ln(4)
+
+_template: Optional[DocTemplate] = None
+_template_lock = threading.Lock()
+
+def template() -> DocTemplate:
+    """Vorlage dieses Workers (beim ersten Aufruf gebaut, danach nur gelesen)."""
+    global _template
+    if _template is None:
+        with _template_lock:
+            if _template is None:
+                _template = DocTemplate()
+    return _template
+
+# ---------------------------------------------------------------------------
+# 3) Streaming-Ausgabe: fertige Seiten sofort aus dem Speicher
+# ---------------------------------------------------------------------------
+
+class _Sink:
+    """bytearray-Ersatz für fpdf2s OutputProducer – schreibt direkt nach `out`."""
+
+    def __init__(self, out: BinaryIO):
+        self._out  = out
+        self._len  = 0
+        self._hash = hashlib.md5(usedforsecurity=False)
+
+    def __len__(self) -> int:               # Offsets für die xref-Tabelle
+        return self._len
+
+    def __iadd__(self, data: bytes) -> "_Sink":
+        self._out.write(data)
+        self._hash.update(data)
+        self._len += len(data)
+        return self
+
+    def file_id(self, created) -> str:
+        """Wie fpdf2s Standard-/ID: MD5 über das bisher Geschriebene + Erstelldatum."""
+        h = self._hash.copy()
+        if created:
+            h.update(created.strftime("%Y%m%d%H%M%S").encode("utf8"))
+        hx = h.hexdigest().upper()
+        return f"<{hx}><{hx}>"
+
+class _SpooledStream(PDFContentStream):
+    """Seiteninhalt, der schon komprimiert im Spool liegt – erst beim Schreiben gelesen."""
+
+    def __init__(self, spool: BinaryIO, offset: int, length: int):
+        PDFObject.__init__(self)
+        self._spool  = spool
+        self._offset = offset
+        self.filter  = Name("FlateDecode")
+        self.length  = length
+
+    def content_stream(self) -> bytes:
+        self._spool.seek(self._offset)
+        return self._spool.read(self.length)
+
+class _StreamingProducer(OutputProducer):
+    """Schreibt Objekt für Objekt in den Sink; ausgelagerte Seiten kommen aus dem Spool."""
+
+    def __init__(self, fpdf):
+        super().__init__(fpdf)
+        self.buffer = fpdf._sink
+
+    def _add_pages(self, _slice=slice(0, None)):
+        page_objs = super()._add_pages(_slice)
+        for page in page_objs:
+            spooled = self.fpdf._flushed.get(page.index())
+            if spooled:
+                cs = page.contents
+                assert self.pdf_objs[cs.id] is cs          # [0] = Header, danach id == Index
+                stream = _SpooledStream(self.fpdf._spool, *spooled)
+                stream.id = cs.id
+                self.pdf_objs[cs.id] = page.contents = stream
+        return page_objs
+
+# ---------------------------------------------------------------------------
+# 4) Layout
+# ---------------------------------------------------------------------------
+
+class _RowLayout(NamedTuple):
+    cells:   List[List[str]]        # Zeilen für Pos., Menge, Kategorie, Produkt
+    serials: List[str]              # Zeilen der Seriennummern (dieser Abschnitt)
+    payload: str                    # Inhalt der DataMatrix
+    h:       float                  # Zeilenhöhe inkl. Innenabstand
+
+def _serial_text(row) -> str:
+    sns_list = [sn.strip() for sn in (row.sns or "").split(",") if sn.strip()]
+    return ", ".join(sns_list) if sns_list else "-"
+
+def _split_serials(lines: List[str], max_lines: int) -> Iterator[List[str]]:
+    """Serien-Zeilen in Abschnitte, die auf eine Seite und in eine DataMatrix passen."""
+    chunk: List[str] = []
+    chars = 0
+    for line in lines:
+        if chunk and (len(chunk) >= max_lines or chars + len(line) + 1 > BC_MAX_CHARS):
+            yield chunk
+            chunk, chars = [], 0
+        chunk.append(line)
+        chars += len(line) + 1
+    yield chunk
+
+def _wrap(pdf: FPDF, w: float, text: str) -> List[str]:
+    """
+    Zeilen wie multi_cell(split_only=True), aber linear: fpdf2s Umbruch misst die
+    Zeile bei jedem Zeichen neu, bei Tausenden Seriennummern dauert das Sekunden.
+    Zeilenumbrüche im Text oder überlange Wörter → doch multi_cell.
+    """
+    max_w = w - 2 * pdf.c_margin
+    if "\n" in text:
+        return pdf.multi_cell(w, LINE_H, text, split_only=True)
+    space = pdf.get_string_width(" ")
+    lines: List[str] = []
+    cur: List[str] = []
+    cur_w = 0.0
+    for word in text.split(" "):
+        word_w = pdf.get_string_width(word)
+        if word_w > max_w:
+            return pdf.multi_cell(w, LINE_H, text, split_only=True)
+        if cur and cur_w + space + word_w > max_w:
+            lines.append(" ".join(cur))
+            cur, cur_w = [word], word_w
+        else:
+            cur_w += (space if cur else 0) + word_w
+            cur.append(word)
+    lines.append(" ".join(cur))
+    return lines
+
+def _layout_rows(pdf: FPDF, rows, max_h: float) -> Iterator[_RowLayout]:
+    """Umbruch und Höhe jeder Zeile – genau einmal pro Zeile berechnet."""
+    sn_line_h = SERIAL_PT * 25.4 / 72
+    max_lines = max(1, int((max_h - 2 * PADDING) // sn_line_h))
+    for pos, row in enumerate(rows, 1):
+        pdf.set_font(FONT_FAMILY, "", 8)
+        cells = [_wrap(pdf, w, t)
+                 for w, t in zip(WIDTHS[:4], (str(pos), str(row.qty),
+                                              row.cat or "-", row.prod or "-"))]
+        pdf.set_font(FONT_FAMILY, "", SERIAL_PT)
+        serial_text = _serial_text(row)
+        lines  = _wrap(pdf, WIDTHS[4], serial_text)
+        chunks = list(_split_serials(lines, max_lines))
+        for i, chunk in enumerate(chunks):
+            if i:                                   # Folgezeile einer langen Liste
+                cells = [[str(pos)], [""], [""], ["(Fortsetzung)"]]
+            payload = serial_text if len(chunks) == 1 else " ".join(chunk).rstrip(",")
+            content_h = max(max(len(c) for c in cells) * LINE_H,
+                            BARCODE_H, len(chunk) * sn_line_h)
+            yield _RowLayout(cells, chunk, payload, content_h + 2 * PADDING)
+
+def _paginate(heights: List[float], first_top: float, top: float,
+              bottom: float) -> List[Tuple[int, int]]:
+    """(Start, Ende) der Zeilen je Seite."""
+    pages: List[Tuple[int, int]] = []
+    start, y = 0, first_top
+    for i, h in enumerate(heights):
+        if y + h > bottom and i > start:
+            pages.append((start, i))
+            start, y = i, top
+        y += h
+    pages.append((start, len(heights)))
+    return pages
+
+# ---------------------------------------------------------------------------
+# 5) Zeichnen
+# ---------------------------------------------------------------------------
+
+def _title(pdf: FPDF, hdr) -> None:
+    pdf.set_font(FONT_FAMILY, "B", 14)
+    pdf.set_x(PAGE_MARGIN)
+    pdf.cell(0, 8, "Seriennummernprotokoll", ln=1)
+
+    pdf.set_font(FONT_FAMILY, "B", 11)
+    LBL = 32                                     # Label-Spaltenbreite
+    for label, value in (("Bestell-Nr.:", hdr.order_no or "-"),
+                         ("Kunde:",       hdr.customer or "-"),
+                         ("Datum:",       f"{hdr.created_at:%d.%m.%Y}")):
+        pdf.set_x(PAGE_MARGIN)
+        pdf.cell(LBL, 6, label)
+        pdf.cell(0,   6, value, ln=1)
+    pdf.ln(4)
+
+def _table_header(pdf: FPDF) -> None:
+    pdf.set_fill_color(230, 230, 230)
+    pdf.set_font(FONT_FAMILY, "B", 9)
+    pdf.set_x(PAGE_MARGIN)
+    for w, label in zip(WIDTHS, COLS):
+        pdf.cell(w, LINE_H, label, 1, 0, "C", fill=True)
+    pdf.ln(LINE_H)
+
+def _footer(pdf: FPDF, page_no: int, total: int) -> None:
+    pdf.set_y(-15)
+    pdf.set_font(FONT_FAMILY, "I", 7)
+    pdf.cell(0, 5, f"Seite {page_no}/{total}", 0, 0, "C")
+
+def _draw_row(pdf: FPDF, lay: _RowLayout, y: float, img) -> None:
+    row_h = lay.h
+
+    # ── Spalten 1–4 (vertikal zentriert, linksbündig) ────
+    pdf.set_font(FONT_FAMILY, "", 8)
+    x = PAGE_MARGIN
+    for w, lines in zip(WIDTHS[:4], lay.cells):
+        y_text = y + (row_h - len(lines) * LINE_H) / 2
+        for line in lines:
+            pdf.set_xy(x, y_text)
+            pdf.cell(w, LINE_H, line, border=0, align="L")
+            y_text += LINE_H
+        pdf.rect(x, y, w, row_h)
+        x += w
+
+    # ── Seriennummern-Spalte ─────────────────────────
+    w_sn = WIDTHS[4]
+    sn_line_h = SERIAL_PT * 25.4 / 72
+    pdf.rect(x, y, w_sn, row_h)
+    pdf.set_font(FONT_FAMILY, "", SERIAL_PT)
+    y_text = y + (row_h - len(lay.serials) * sn_line_h) / 2
+    for line in lay.serials:
+        pdf.set_xy(x, y_text)
+        pdf.cell(w_sn, sn_line_h, line, border=0, align="C")
+        y_text += sn_line_h
+    x += w_sn
+
+    # ── DataMatrix-Spalte (optional) ─────────────────
+    if img is not None:
+        w_bc = WIDTHS[5]
+        pdf.rect(x, y, w_bc, row_h)
+        inner_w = w_bc - 2 * PADDING
+        aspect  = img.width / img.height
+        bc_h    = BARCODE_H
+        bc_w    = bc_h * aspect
+        if bc_w > inner_w:
+            bc_w = inner_w
+            bc_h = bc_w / aspect
+        pdf.image(img, x=x + (w_bc - bc_w) / 2, y=y + (row_h - bc_h) / 2, w=bc_w, h=bc_h)
+
+def _new_document(spool: BinaryIO) -> FPDF:
+    pdf = template().new_document()
+    pdf.set_auto_page_break(auto=False)          # Umbrüche kommen aus _paginate()
+    pdf._spool, pdf._flushed = spool, {}
+    return pdf
+
+def _next_page(pdf: FPDF) -> None:
+    pdf.add_page()
+    if pdf.page > 1:
+        pdf.flush_page(pdf.page - 1)             # vorige Seite ist fertig → raus aus dem RAM
+
+def _draw(pdf: FPDF, hdr, rows, section: Optional[str] = None) -> None:
+    """
+    Ein Protokoll ab neuer Seite; Seitenzählung („Seite x/y“) je Protokoll.
+    Zwei Durchläufe über `rows`: erst nur die Zeilenhöhen (→ Seitenaufteilung),
+    dann Umbruch und Zeichnen Seite für Seite – Layouts liegen nie für alle
+    Positionen gleichzeitig im Speicher.
+    """
+    tpl = template()
+    _next_page(pdf)
+    if section:
+        pdf.start_section(section)               # Lesezeichen im Sammel-PDF
+    tpl.letterhead(pdf)
+    _title(pdf, hdr)
+    _table_header(pdf)
+
+    t0        = time.perf_counter()
+    first_top = pdf.get_y()
+    bottom    = pdf.h - PAGE_MARGIN
+    heights   = [l.h for l in _layout_rows(pdf, rows, bottom - first_top)]
+    pages     = _paginate(heights, first_top, PAGE_MARGIN + LINE_H, bottom)
+    del heights
+    layouts   = _layout_rows(pdf, rows, bottom - first_top)
+    t_layout  = time.perf_counter() - t0
+
+    t_barcode = t_draw = 0.0
+    for page_no, (start, end) in enumerate(pages, 1):
+        t0 = time.perf_counter()
+        if page_no > 1:
+            _next_page(pdf)
+            pdf.set_y(PAGE_MARGIN)
+            _table_header(pdf)
+
+        tl      = time.perf_counter()
+        chunk   = list(islice(layouts, end - start))
+        t1      = time.perf_counter()
+        t_layout += t1 - tl
+        symbols = barcode.encode_many(l.payload for l in chunk) if len(WIDTHS) > 5 else {}
+        t2      = time.perf_counter()
+        y = pdf.get_y()
+        for lay in chunk:
+            _draw_row(pdf, lay, y, symbols.get(lay.payload))
+            y += lay.h
+        _footer(pdf, page_no, len(pages))
+        t_barcode += t2 - t1
+        t_draw    += (tl - t0) + (time.perf_counter() - t2)
+    metrics.pdf_seconds.observe(t_layout, phase="layout")
+    metrics.pdf_seconds.observe(t_barcode, phase="barcode")
+    metrics.pdf_seconds.observe(t_draw, phase="draw")
+
+# ---------------------------------------------------------------------------
+# 6) Ausgabe
+# ---------------------------------------------------------------------------
+
+def _write(slips: Iterable[Tuple[Any, List[Any], Optional[str]]], out: BinaryIO) -> None:
+    with metrics.pdf_seconds.time(phase="total"), \
+         tempfile.SpooledTemporaryFile(max_size=int(PDF_SPOOL_MB * 1024 * 1024)) as spool:
+        pdf = _new_document(spool)
+        for hdr, rows, section in slips:
+            _draw(pdf, hdr, rows, section)
+        if pdf.page == 0:
+            pdf.add_page()                       # leere Auswahl → eine leere Seite
+        pdf._sink = _Sink(out)
+        with metrics.pdf_seconds.time(phase="output"):
+            pdf.output(output_producer_class=_StreamingProducer)
+
+def write_pdf(hdr, rows, out: BinaryIO) -> None:
+    """
+    Rendert das Protokoll seitenweise nach `out` (Datei, Socket-Wrapper, BytesIO).
+    `rows` wird zweimal durchlaufen (Liste oder anderes wiederholbares Iterable).
+    Unkomprimiert im Speicher liegt immer nur die aktuelle Seite; fertige Seiten
+    werden komprimiert in einen Spool geschoben (ab PDF_SPOOL_MB auf der Platte),
+    das PDF selbst wird ohne Zwischenpuffer geschrieben.
+    """
+    _write([(hdr, rows, None)], out)
+
+def write_pdf_many(slips: Iterable[Tuple[str, Any, List[Any]]], out: BinaryIO) -> None:
+    """Mehrere Protokolle (Nr., Kopf, Positionen) als ein PDF mit Lesezeichen je Protokoll."""
+    _write(((hdr, rows, f"{number} – {hdr.customer or '-'}") for number, hdr, rows in slips),
+           out)
+
+def render_pdf(hdr, rows) -> bytes:
+    """Wie write_pdf(), aber als Bytes (kleine Protokolle, Benchmarks)."""
+    buf = io.BytesIO()
+    write_pdf(hdr, rows, buf)
+    return buf.getvalue()
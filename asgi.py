@@ -0,0 +1,100 @@
+"""
+asgi.py – ASGI-Einstieg: /lookup/<ean> asynchron, alles andere über Flask (WSGI im Thread-Pool)
+
+• Start: gunicorn asgi:app -k uvicorn.workers.UvicornWorker   (siehe Dockerfile)
+• Ein Scan, der auf Icecat/UPCitemdb wartet, belegt nur einen Lookup-Thread – der Worker
+  selbst nimmt weiter Requests an; die Flask-Routen laufen in WSGI_THREADS Threads
+• Gleichzeitige Scans derselben EAN teilen sich einen Lookup (helpers._SingleFlight)
+• Antwort und Login-Prüfung wie die Flask-Route lookup_ean (Session über Flasks
+  session_interface, Rollen über app.is_staff), das Frontend (`fetch('/lookup/' + ean)`)
+  bleibt unverändert
+"""
+
+import asyncio, json, os, re, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.wrappers import Request
+
+from app import app as flask_app, is_staff, start_worker
+from helpers import lookup_product
+import metrics
+
+WSGI_THREADS         = int(os.getenv("WSGI_THREADS", "16"))           # Flask-Requests parallel
+ASYNC_LOOKUP_THREADS = int(os.getenv("ASYNC_LOOKUP_THREADS", "64"))   # wartende Lookups
+
+_wsgi        = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+_lookup_pool = ThreadPoolExecutor(max_workers=ASYNC_LOOKUP_THREADS, thread_name_prefix="alookup")
+
+start_worker()   # Schema prüfen, Suche + Bloom-Filter – einmal pro Worker-Prozess
+
+_LOOKUP = re.compile(r"^/lookup/([^/]+)$")
+
+# ---------------------------------------------------------------------------
+# 1) Login (Flask-Session-Cookie lesen)
+# ---------------------------------------------------------------------------
+
+def _session(scope):
+    """Flask-Session zum Request – gelesen wie in Flask selbst, nur ohne WSGI-Umweg."""
+    raw = b"; ".join(v for k, v in scope["headers"] if k == b"cookie").decode("latin-1")
+    return flask_app.session_interface.open_session(flask_app, Request({"HTTP_COOKIE": raw})) or {}
+
+# ---------------------------------------------------------------------------
+# 2) Lookup
+# ---------------------------------------------------------------------------
+
+async def _send(send, status: int, body: bytes = b"", headers=()) -> None:
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-length", str(len(body)).encode()), *headers]})
+    await send({"type": "http.response.body", "body": body})
+
+async def _lookup(scope, send, ean: str) -> int:
+    if not is_staff(_session(scope)):
+        nxt = quote(scope["path"], safe="/")
+        await _send(send, 302, headers=[(b"location", f"/login?next={nxt}".encode())])
+        return 302
+    try:
+        # gleichzeitige Scans derselben EAN bündelt lookup_product selbst (helpers._SingleFlight)
+        info = await asyncio.get_running_loop().run_in_executor(_lookup_pool, lookup_product, ean)
+    except Exception:
+        flask_app.logger.exception("Lookup %s", ean)
+        metrics.errors_total.inc(where="lookup")
+        info, status = None, 500
+    else:
+        status = 200
+    if info:
+        payload = {"ok": True, "pid": info["pid"], "name": info["name"],
+                   "cat": info["cat"], "brand": info["brand"]}
+    else:
+        payload = {"ok": False}
+    await _send(send, status, json.dumps(payload).encode(),
+                [(b"content-type", b"application/json")])
+    return status
+
+# ---------------------------------------------------------------------------
+# 3) ASGI-App
+# ---------------------------------------------------------------------------
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        msg = await receive()
+        if msg["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif msg["type"] == "lifespan.shutdown":
+            _lookup_pool.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    m = _LOOKUP.match(scope.get("path", "")) if scope["type"] == "http" else None
+    if m and scope["method"] == "GET":
+        t0 = time.perf_counter()
+        status = await _lookup(scope, send, m.group(1))
+        metrics.http_seconds.observe(time.perf_counter() - t0, endpoint="lookup_ean",
+                                     method="GET", status=status)
+        metrics.flush()
+        return
+    await _wsgi(scope, receive, send)
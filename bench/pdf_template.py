@@ -0,0 +1,98 @@
+"""
+pdf_template.py – Micro-Benchmark: FPDF-Setup pro Request vs. Worker-Vorlage
+
+Aufruf (im Container bzw. mit installierten requirements):
+    python bench/pdf_template.py [--rows 30] [--runs 20]
+
+Misst
+• „vorher“: FPDF() + 3× add_font(DejaVuSans.ttf) + Logo von Platte + Briefkopf
+• „nachher“: template().new_document() + Briefkopf
+jeweils inkl. output() (Subsetting/Einbetten gehört zu den Setup-Kosten),
+dazu den einmaligen Aufbau der Vorlage und render_pdf() komplett.
+Keine DB nötig – Kopf und Positionen sind synthetisch.
+"""
+
+from __future__ import annotations
+import argparse, statistics, sys, time
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from fpdf import FPDF                                             # noqa: E402
+import slip_pdf                                                   # noqa: E402
+from slip_pdf import (FONT_PATH, LOGO_PATH, PAGE_MARGIN,          # noqa: E402
+                      ADDR_LEFT, ADDR_RIGHT, DocTemplate, template, render_pdf)
+
+Hdr = namedtuple("Hdr", "order_no customer created_at")
+Row = namedtuple("Row", "pos_id qty cat prod sns")
+
+def _legacy_setup() -> bytes:
+    """Das bisherige Setup je Request (wie vor der Vorlage)."""
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=PAGE_MARGIN)
+    pdf.add_font("DejaVu", "",  str(FONT_PATH))
+    pdf.add_font("DejaVu", "B", str(FONT_PATH))
+    pdf.add_font("DejaVu", "I", str(FONT_PATH))
+    pdf.alias_nb_pages()
+    pdf.add_page()
+    pdf.set_font("DejaVu", "", 8)
+    pdf.set_xy(PAGE_MARGIN, PAGE_MARGIN)
+    pdf.multi_cell(60, 4, ADDR_LEFT)
+    if LOGO_PATH.exists():
+        pdf.image(str(LOGO_PATH), x=(pdf.w - 40) / 2, y=PAGE_MARGIN, w=40)
+    pdf.set_xy(pdf.w - PAGE_MARGIN - 60, PAGE_MARGIN)
+    pdf.multi_cell(60, 4, ADDR_RIGHT, align="R")
+    for style in ("", "B", "I"):
+        pdf.set_font("DejaVu", style, 10)
+        pdf.cell(0, 6, "Seriennummernprotokoll", new_x="LMARGIN", new_y="NEXT")
+    return bytes(pdf.output())
+
+def _template_setup() -> bytes:
+    tpl = template()
+    pdf = tpl.new_document()
+    pdf.add_page()
+    tpl.letterhead(pdf)
+    for style in ("", "B", "I"):
+        pdf.set_font(slip_pdf.FONT_FAMILY, style, 10)
+        pdf.cell(0, 6, "Seriennummernprotokoll", new_x="LMARGIN", new_y="NEXT")
+    return bytes(pdf.output())
+
+def _time(fn, runs: int) -> list[float]:
+    out = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+def _report(label: str, ms: list[float]) -> None:
+    print(f"{label:<28} median {statistics.median(ms):7.1f} ms   "
+          f"min {min(ms):7.1f} ms   (n={len(ms)})")
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=30)
+    ap.add_argument("--runs", type=int, default=20)
+    args = ap.parse_args()
+
+    hdr  = Hdr("B-4711", "Muster GmbH", datetime(2026, 1, 1))
+    rows = [Row(i, 1, "Notebook", f"Testgerät {i} – 14\" äöü", f"SN{i:06d},SN{i + 1:06d}")
+            for i in range(args.rows)]
+
+    _report("Vorlage aufbauen (1×/Worker)", _time(DocTemplate, 5))
+    template()                                   # wie im Worker: vorab gebaut
+    _legacy_setup(); _template_setup()           # Aufwärmen (Imports, Caches)
+
+    before = _time(_legacy_setup, args.runs)
+    after  = _time(_template_setup, args.runs)
+    _report("Setup vorher", before)
+    _report("Setup mit Vorlage", after)
+    print(f"{'Ersparnis':<28} {statistics.median(before) - statistics.median(after):7.1f} ms "
+          f"pro PDF ({statistics.median(before) / statistics.median(after):.1f}×)")
+
+    _report(f"render_pdf ({args.rows} Zeilen)", _time(lambda: render_pdf(hdr, rows), args.runs))
+
+if __name__ == "__main__":
+    main()
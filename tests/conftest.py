@@ -0,0 +1,41 @@
+"""
+Gemeinsame Test-Umgebung: SQLite-Datei statt MariaDB, Ablagen in einem Temp-Verzeichnis.
+
+Die Module in app/ importieren sich flach (`import metrics`) – deshalb kommt app/ auf sys.path,
+und DB_DSN & Co. müssen gesetzt sein, bevor db.py das erste Mal geladen wird.
+"""
+
+import os, sys, tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT / "app"), str(ROOT)]
+
+_tmp = Path(tempfile.mkdtemp(prefix="ean-tests-"))
+os.environ.setdefault("DB_DSN", f"sqlite:///{_tmp / 'test.db'}")
+os.environ.setdefault("METRICS_DIR", str(_tmp / "metrics"))
+os.environ.setdefault("RATELIMIT_DIR", str(_tmp / "ratelimit"))
+os.environ.setdefault("PDF_CACHE_DIR", str(_tmp / "pdf"))
+
+from sqlalchemy import text                                     # noqa: E402
+from sqlalchemy.ext.compiler import compiles                    # noqa: E402
+from sqlalchemy.sql.expression import Insert                    # noqa: E402
+
+@compiles(Insert, "sqlite")
+def _insert_ignore(insert, compiler, **kw):
+    # Die App schreibt MariaDB-„INSERT IGNORE“; SQLite kennt dafür „INSERT OR IGNORE“
+    return compiler.visit_insert(insert, **kw).replace("INSERT IGNORE", "INSERT OR IGNORE")
+
+import db, migrations                                           # noqa: E402
+
+@pytest.fixture
+def engine():
+    """Leeres, aktuelles Schema je Test."""
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS product_fts"))
+    db.metadata.drop_all(db.engine)
+    migrations.upgrade()
+    yield db.engine
+    db.engine.dispose()
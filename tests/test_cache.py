@@ -0,0 +1,25 @@
+"""Lookup-Cache: Invalidierung aus einem anderen Prozess (z. B. icecat-reprocess), Aufräumen."""
+
+import cache
+
+def test_bump_clears_other_workers(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "GEN_CHECK", 0)
+    path = str(tmp_path / "kv.sqlite")
+    worker = cache.make_cache("product", 10, 300, path)
+    cli    = cache.make_cache("product", 10, 300, path)
+    worker.set("4001", {"name": "alt"})
+    assert worker.get("4001") == {"name": "alt"}
+    cli.delete("4001")
+    assert worker.get("4001") == {"name": "alt"}          # nur die Worker-Stufe kennt es noch
+    cli.bump()
+    assert worker.get("4001") is None
+
+def test_expired_rows_are_purged(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "PURGE_EVERY", 3)
+    store = cache.SqliteStore(str(tmp_path / "kv.sqlite"), "product")
+    store.set("alt1", 1, ttl=-1)
+    store.set("alt2", 2, ttl=-1)
+    rows = lambda: store._conn().execute("SELECT key FROM kv ORDER BY key").fetchall()
+    assert len(rows()) == 2                                # abgelaufen, aber noch da
+    store.set("neu", 3)                                    # 3. set() → purge()
+    assert rows() == [("neu",)]
@@ -0,0 +1,118 @@
+"""Parallele Provider-Abfragen (helpers.remote_lookup) gegen einen lokalen Stub-Server."""
+
+import json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import helpers, ratelimit
+
+class _Stub(BaseHTTPRequestHandler):
+    # (Pfad, EAN, Sprache) → (Status, Name oder None, Verzögerung s)
+    routes: dict = {}
+    calls:  list = []
+
+    def log_message(self, *a):
+        pass
+
+    def do_GET(self):
+        u, q = urlparse(self.path), parse_qs(urlparse(self.path).query)
+        if u.path == "/ice":
+            key = ("ice", q["GTIN"][0], q["Language"][0])
+        else:
+            key = ("upc", q["upc"][0], None)
+        self.calls.append(key)
+        status, name, delay = self.routes.get(key, (404, None, 0))
+        time.sleep(delay)
+        self.send_response(status)
+        self.end_headers()
+        if isinstance(name, bytes):                 # Rohantwort (kaputtes JSON o. ä.)
+            self.wfile.write(name)
+        elif status == 200 and key[0] == "ice":
+            self.wfile.write(json.dumps({"data": {"GeneralInfo": {
+                "Title": name, "CategoryName": "Cat", "Brand": "B"}}}).encode())
+        elif status == 200:
+            self.wfile.write(json.dumps({"items": [{"title": name}] if name else []}).encode())
+
+@pytest.fixture
+def stub(engine, monkeypatch):
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{srv.server_port}"
+    monkeypatch.setattr(helpers, "ICE_API_URL", base + "/ice")
+    monkeypatch.setattr(helpers, "UPC_API_URL", base + "/upc")
+    monkeypatch.setattr(helpers, "ICE_LANG", "de")
+    monkeypatch.setattr(helpers, "UPC_HEDGE_DELAY", 0.1)
+    for name in ("icecat", "upc"):
+        monkeypatch.setitem(helpers._breakers, name, helpers.CircuitBreaker(name, 5, 60))
+        monkeypatch.setitem(ratelimit.BUDGETS, name, ratelimit.Budget(0, 0, 0, 0))
+    _Stub.routes, _Stub.calls = {}, []
+    yield _Stub
+    srv.shutdown()
+    srv.server_close()
+
+EAN = "4000000000009"
+
+def test_priority_beats_speed(stub):
+    stub.routes = {("ice", EAN, "de"): (200, "Deutsch", 0.3),
+                   ("ice", EAN, "en"): (200, "English", 0),
+                   ("upc", EAN, None): (200, "UPC", 0)}
+    assert helpers.remote_lookup(EAN)[0] == "Deutsch"
+    assert ("ice", EAN, "en") not in stub.calls     # en nur, wenn ICE_LANG nichts hat
+
+def test_english_before_upc(stub):
+    stub.routes = {("ice", EAN, "en"): (200, "English", 0.2),
+                   ("upc", EAN, None): (200, "UPC", 0)}
+    assert helpers.remote_lookup(EAN) == ("English", "Cat", "B")
+
+def test_hedge_asks_upc_while_icecat_is_slow(stub):
+    stub.routes = {("ice", EAN, "de"): (404, None, 0.4),
+                   ("upc", EAN, None): (200, "UPC", 0.3)}
+    t0 = time.monotonic()
+    assert helpers.remote_lookup(EAN) == ("UPC", None, None)
+    assert time.monotonic() - t0 < 0.65          # nacheinander wären es ≥ 0,7 s
+
+def test_provider_error_without_hit_raises(stub):
+    stub.routes = {("ice", EAN, "de"): (500, None, 0)}
+    with pytest.raises(helpers.ProviderError):
+        helpers.remote_lookup(EAN)
+
+def test_icecat_error_skips_english(stub):
+    stub.routes = {("ice", EAN, "de"): (500, None, 0),
+                   ("upc", EAN, None): (200, "UPC", 0)}
+    assert helpers.remote_lookup(EAN) == ("UPC", None, None)
+    assert ("ice", EAN, "en") not in stub.calls
+
+@pytest.mark.parametrize("body", [b"kein json", b"[]", b'{"items": [{}]}', b'{"items": "x"}'])
+def test_broken_upc_answer_is_provider_error(stub, body):
+    stub.routes = {("upc", EAN, None): (200, body, 0)}
+    with pytest.raises(helpers.ProviderError):
+        helpers.remote_lookup(EAN, bulk=True)
+
+def test_broken_icecat_answer_is_provider_error(stub):
+    stub.routes = {("ice", EAN, "de"): (200, b"[1, 2]", 0)}
+    with pytest.raises(helpers.ProviderError):
+        helpers.remote_lookup(EAN, bulk=True)
+
+def test_bulk_skips_hedge_while_icecat_is_slow(stub):
+    stub.routes = {("ice", "4000000000001", "de"): (200, "Langsam", 0.4),
+                   ("upc", "4000000000001", None): (200, "UPC", 0)}
+    assert helpers.remote_lookup("4000000000001", bulk=True)[0] == "Langsam"
+    assert ("upc", "4000000000001", None) not in stub.calls
+
+def test_bulk_asks_upc_after_icecat_miss(stub):
+    stub.routes = {("upc", "4000000000002", None): (200, "UPC", 0)}
+    assert helpers.remote_lookup("4000000000002", bulk=True)[0] == "UPC"
+
+def test_throttled_upc_counts_as_no_answer(stub, monkeypatch):
+    real = ratelimit.acquire
+    def acquire(provider, bulk=False):
+        if provider == "upc":
+            raise ratelimit.RateLimited(provider, "Tageskontingent erschöpft")
+        real(provider, bulk)
+    monkeypatch.setattr(ratelimit, "acquire", acquire)
+    # Icecat: sicher nicht gefunden, UPC: nicht gefragt → Miss statt Störung
+    assert helpers.remote_lookup("4000000000003", bulk=True) is None
+    assert helpers.remote_lookup("4000000000003") is None
+    assert all(c[0] == "ice" for c in stub.calls)
@@ -0,0 +1,73 @@
+"""Schema-Updates: eine Datenbank im Stand vor den Migrationen auf den aktuellen Stand bringen."""
+
+import pytest
+from sqlalchemy import (MetaData, Table, Column, Integer, String, DateTime, ForeignKey,
+                        func, inspect, insert, select, text)
+
+import db, migrations
+from serial_search import normalize
+
+def _baseline_tables(meta: MetaData) -> None:
+    """Tabellen wie im ersten Release (ohne sn_norm, updated_at, Indizes, neue Tabellen)."""
+    Table("category", meta, Column("id", Integer, primary_key=True),
+          Column("name", String(100), unique=True, nullable=False))
+    Table("brand", meta, Column("id", Integer, primary_key=True),
+          Column("name", String(120), unique=True, nullable=False))
+    Table("product", meta, Column("id", Integer, primary_key=True),
+          Column("ean", String(32), unique=True, nullable=False),
+          Column("name", String(255), nullable=False),
+          Column("category_id", Integer, ForeignKey("category.id"), nullable=False),
+          Column("brand_id", Integer, ForeignKey("brand.id")))
+    Table("slip", meta, Column("id", Integer, primary_key=True),
+          Column("number", String(30), unique=True, nullable=False),
+          Column("order_no", String(30)), Column("customer", String(120)),
+          Column("created_at", DateTime, server_default=func.now()))
+    Table("slip_item", meta, Column("id", Integer, primary_key=True),
+          Column("slip_id", Integer, ForeignKey("slip.id"), nullable=False),
+          Column("product_id", Integer, ForeignKey("product.id"), nullable=False),
+          Column("quantity", Integer, nullable=False, default=1))
+    Table("serial", meta, Column("id", Integer, primary_key=True),
+          Column("item_id", Integer, ForeignKey("slip_item.id"), nullable=False),
+          Column("sn", String(100)))
+
+@pytest.fixture
+def baseline(engine):
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS product_fts"))
+    db.metadata.drop_all(engine)
+    meta = MetaData()
+    _baseline_tables(meta)
+    meta.create_all(engine)
+    t = meta.tables
+    with engine.begin() as conn:
+        conn.execute(insert(t["category"]).values(id=1, name="X"))
+        conn.execute(insert(t["product"]).values(id=1, ean="4001", name="P", category_id=1))
+        conn.execute(insert(t["slip"]).values(id=1, number="2024-01-02-001"))
+        conn.execute(insert(t["slip_item"]).values(id=1, slip_id=1, product_id=1))
+        conn.execute(insert(t["serial"]), [{"item_id": 1, "sn": sn} for sn in (" ab-12 ", "CD 34")])
+    return engine
+
+def test_upgrade_from_baseline(baseline):
+    current, todo = migrations.status()
+    assert current == 0 and len(todo) == len(migrations.MIGRATIONS)
+    with pytest.raises(RuntimeError):
+        migrations.check()
+
+    latest = migrations.MIGRATIONS[-1][0]
+    assert migrations.upgrade() == latest
+    assert migrations.check() == latest
+
+    with baseline.connect() as conn:
+        assert conn.execute(select(db.serial.c.sn, db.serial.c.sn_norm)).all() == \
+            [(sn, normalize(sn)) for sn in (" ab-12 ", "CD 34")]
+        assert conn.scalar(select(db.product.c.updated_at)) is not None
+        assert conn.scalar(select(func.count()).select_from(db.serial_lock)) == db.SERIAL_LOCK_SLOTS
+        insp = inspect(conn)
+        assert "ix_serial_sn_norm" in {i["name"] for i in insp.get_indexes("serial")}
+        assert "ix_product_name_id" in {i["name"] for i in insp.get_indexes("product")}
+
+def test_upgrade_is_idempotent(engine):
+    latest = migrations.MIGRATIONS[-1][0]
+    assert migrations.upgrade() == latest
+    with engine.connect() as conn:
+        assert conn.scalar(select(func.count()).select_from(db.schema_version)) == latest
@@ -0,0 +1,43 @@
+"""PDF-Cache: Verdrängung darf laufende Downloads nicht abschneiden; Sammel-PDF als Hintergrund-Job."""
+
+from datetime import datetime
+
+import pdf_cache
+
+def test_open_handle_survives_eviction(monkeypatch, tmp_path):
+    monkeypatch.setattr(pdf_cache, "PDF_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(pdf_cache, "PDF_CACHE_MAX_MB", 0)      # jede neue Datei verdrängt alles
+    with pdf_cache.open_or_create("a", lambda f: f.write(b"A" * 1000)) as a:
+        assert not pdf_cache._path("a").exists()                # schon wieder weggeräumt …
+        assert a.read() == b"A" * 1000                          # … gelesen wird trotzdem
+
+def test_hit_returns_open_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(pdf_cache, "PDF_CACHE_DIR", tmp_path)
+    pdf_cache.put("b", b"B")
+    with pdf_cache.open_or_create("b", lambda f: f.write(b"neu")) as b:
+        pdf_cache._path("b").unlink()                           # anderer Worker räumt auf
+        assert b.read() == b"B"
+
+def test_export_rerenders_evicted_pdf(monkeypatch, tmp_path):
+    import pdf_jobs, slip_export
+    monkeypatch.setattr(pdf_cache, "PDF_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(pdf_jobs, "write_pdf", lambda hdr, rows, f: f.write(b"neu"))
+    hdr = slip_export.SlipHdr("2024-01-02-001", "A1", "Kunde", datetime(2024, 1, 2), 1)
+    gone = slip_export._done(tmp_path / "weg.pdf")              # Render fertig, Datei schon verdrängt
+    with slip_export._open_rendered(hdr.number, hdr, [], gone) as src:
+        assert src.read() == b"neu"
+
+def test_export_pdf_renders_in_background(engine, monkeypatch, tmp_path):
+    import slip_export
+    monkeypatch.setattr(pdf_cache, "PDF_CACHE_DIR", tmp_path)
+    stmt = slip_export.slip_query()
+    key  = slip_export.export_key(stmt)
+    assert slip_export.pdf_status(key) == {"state": "pending"}
+    slip_export.submit_pdf(stmt, key)
+    fut = slip_export._jobs.get(key)
+    if fut is not None:
+        fut.result(timeout=30)
+    assert slip_export.pdf_status(key) == {"state": "ready"}
+    with pdf_cache.open_file(key) as f:
+        assert f.read(5) == b"%PDF-"                            # leere Auswahl → eine leere Seite
+    assert slip_export.export_key(stmt) == key                  # gleicher Inhalt ⇒ gleicher Schlüssel
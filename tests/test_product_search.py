@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import insert, select
+
+import product_search
+from db import category, product
+from paging import keyset_page
+from sqlalchemy.orm import Session
+
+@pytest.fixture
+def products(engine):
+    with engine.begin() as conn:
+        conn.execute(insert(category), [{"id": 1, "name": "Monitor"}])
+        conn.execute(insert(product), [
+            {"ean": "4006381333931", "name": "Dell P2400 Monitor",      "category_id": 1},
+            {"ean": "4711000000017", "name": "HP Z24n G2400 Display",    "category_id": 1},
+            {"ean": "2400000000011", "name": "Noname Kabel",             "category_id": 1},
+            {"ean": "5000000000012", "name": "Logitech MX Keys",         "category_id": 1},
+        ])
+    product_search._fts = False
+    product_search.init_search()
+    return engine
+
+def _search(q):
+    stmt, keys = product_search.apply_search(select(product.c.ean, product.c.name), q)
+    with Session(product_search.engine) as s:
+        return [r.ean for r in keyset_page(s, stmt, keys).rows]
+
+def test_short_digits_match_name_and_ean_prefix(products):
+    # Modell-Nr. im Namen zuerst (Ranking), reiner EAN-Anfang dahinter
+    assert set(_search("2400")) == {"4006381333931", "4711000000017", "2400000000011"}
+    assert _search("2400")[-1] == "2400000000011"
+
+def test_very_short_digits_use_like(products):
+    assert set(_search("24")) == {"4006381333931", "4711000000017", "2400000000011"}
+
+def test_long_digits_are_ean_prefix_only(products):
+    assert _search("40063813") == ["4006381333931"]
+
+def test_words(products):
+    assert _search("monitor") == ["4006381333931"]
+    assert _search("mx keys") == ["5000000000012"]
+    assert _search("Kabel") == ["2400000000011"]
+
+def test_digits_without_fts(products):
+    product_search._fts = False                # LIKE-Weg wie ohne Trigramm-Tokenizer
+    assert set(_search("2400")) == {"4006381333931", "4711000000017", "2400000000011"}
@@ -0,0 +1,65 @@
+"""/api/save-slip: Positionen + Seriennummern speichern, doppelte Nummern nur mit Bestätigung."""
+
+import pytest
+from sqlalchemy import insert, select
+
+from db import category, product, slip, slip_item, serial
+
+@pytest.fixture
+def client(engine, monkeypatch):
+    import app as app_module
+    import pdf_jobs
+    monkeypatch.setattr(pdf_jobs, "submit", lambda number: None)     # kein Vorrendern im Test
+    with engine.begin() as conn:
+        conn.execute(insert(category).values(id=1, name="Notebook"))
+        conn.execute(insert(product), [dict(id=1, ean="4000000000001", name="P1", category_id=1),
+                                       dict(id=2, ean="4000000000002", name="P2", category_id=1)])
+    c = app_module.app.test_client()
+    with c.session_transaction() as sess:
+        sess["role"] = "tech"
+    return c
+
+def _body(*sns_per_item, **extra):
+    return {"order_no": "A-1", "customer": "Kunde", **extra,
+            "items": [{"product_id": pid, "quantity": len(sns), "sns": list(sns)}
+                      for pid, sns in enumerate(sns_per_item, 1)]}
+
+@pytest.mark.parametrize("returning", [True, False], ids=["returning", "per-row"])
+def test_save_persists_items_and_serials(client, engine, monkeypatch, returning):
+    monkeypatch.setattr(engine.dialect, "insert_executemany_returning_sort_by_parameter_order",
+                        returning)
+    r = client.post("/api/save-slip", json=_body(["SN-1", "SN-2"], ["SN-3"]))
+    assert r.status_code == 200, r.get_json()
+    number = r.get_json()["number"]
+    with engine.connect() as conn:
+        slip_id = conn.scalar(select(slip.c.id).where(slip.c.number == number))
+        items = conn.execute(select(slip_item.c.id, slip_item.c.product_id, slip_item.c.quantity)
+                             .where(slip_item.c.slip_id == slip_id)
+                             .order_by(slip_item.c.id)).all()
+        sns = conn.execute(select(serial.c.item_id, serial.c.sn, serial.c.sn_norm)
+                           .order_by(serial.c.sn)).all()
+    assert [(pid, qty) for _, pid, qty in items] == [(1, 2), (2, 1)]
+    assert sns == [(items[0].id, "SN-1", "SN-1"), (items[0].id, "SN-2", "SN-2"),
+                   (items[1].id, "SN-3", "SN-3")]
+
+def test_duplicate_needs_signed_confirmation(client, engine):
+    assert client.post("/api/save-slip", json=_body(["SN-1"])).status_code == 200
+
+    r = client.post("/api/save-slip", json=_body(["sn -1", "SN-9"]))
+    assert r.status_code == 409
+    token = r.get_json()["confirm"]
+    assert [d["sn"] for d in r.get_json()["duplicates"]] == ["SN-1"]
+
+    # gefälschtes Token oder Admin-Schalter als Techniker → weiterhin abgelehnt
+    assert client.post("/api/save-slip",
+                       json=_body(["sn -1"], confirm_duplicates=token + "x")).status_code == 409
+    assert client.post("/api/save-slip",
+                       json=_body(["sn -1"], allow_duplicates=True)).status_code == 409
+
+    r = client.post("/api/save-slip", json=_body(["sn -1", "SN-9"], confirm_duplicates=token))
+    assert r.status_code == 200, r.get_json()
+    with engine.connect() as conn:
+        norms = conn.scalars(select(serial.c.sn_norm).order_by(serial.c.id)).all()
+        slips = conn.scalar(select(slip.c.id).order_by(slip.c.id.desc()))
+    assert norms == ["SN-1", "SN-1", "SN-9"]
+    assert slips == 2                                            # abgelehnte Versuche ohne Kopf
@@ -0,0 +1,73 @@
+"""Doppelte Seriennummern: Sperre beim Speichern, Bloom-Filter und Nachführen."""
+
+import threading, time
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import serial_index
+from db import category, product, slip, slip_item, serial
+
+@pytest.fixture
+def item(engine):
+    with engine.begin() as conn:
+        conn.execute(insert(category).values(id=1, name="X"))
+        conn.execute(insert(product).values(id=1, ean="1", name="P", category_id=1))
+        conn.execute(insert(slip).values(id=1, number="N1"))
+        conn.execute(insert(slip_item).values(id=1, slip_id=1, product_id=1))
+    return 1
+
+def _save(engine, item, sn, results, pause=0.3):
+    """Wie save_slip: sperren, prüfen, (langsam) speichern."""
+    with Session(engine) as s, s.begin():
+        serial_index.lock(s, [sn])
+        if serial_index.duplicates(s, [sn], exact=True):
+            results.append("409")
+            return
+        time.sleep(pause)
+        s.execute(insert(serial).values(item_id=item, sn=sn, sn_norm=sn))
+        results.append("ok")
+
+def test_concurrent_saves_of_same_serial_are_serialised(engine, item):
+    results = []
+    threads = [threading.Thread(target=_save, args=(engine, item, "SN1", results)) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results) == ["409", "ok"]
+
+def _serial(engine, id, sn):
+    with engine.begin() as conn:
+        conn.execute(insert(serial).values(id=id, item_id=1, sn=sn, sn_norm=sn))
+
+def _found(engine, sn, **kw):
+    with Session(engine) as s:
+        return [r.sn_norm for r in serial_index.duplicates(s, [sn], **kw)]
+
+@pytest.fixture
+def index(monkeypatch, item, engine):
+    """Eigener, fertig aufgebauter Filter mit Seriennummer A (id 1)."""
+    _serial(engine, 1, "A")
+    idx = serial_index._Index()
+    idx._build()
+    monkeypatch.setattr(serial_index, "_index", idx)
+    monkeypatch.setattr(serial_index, "BUILD_OVERLAP", 0)
+    monkeypatch.setattr(serial_index, "SERIAL_INDEX_REFRESH", 0)
+    return idx
+
+def test_gap_is_filled_when_transaction_commits(engine, index):
+    _serial(engine, 3, "C")                    # id 2 gehört einer noch offenen Transaktion
+    assert _found(engine, "C") == ["C"]
+    assert 2 in index._gaps
+    _serial(engine, 2, "B")                    # … die jetzt committet
+    assert _found(engine, "B") == ["B"]
+    assert not index._gaps
+
+def test_exact_check_sees_serial_behind_expired_gap(monkeypatch, engine, index):
+    _serial(engine, 3, "C")
+    assert _found(engine, "C") == ["C"]
+    monkeypatch.setattr(serial_index, "GAP_TTL", 0)   # Transaktion länger als GAP_TTL
+    _serial(engine, 2, "B")
+    assert _found(engine, "B", exact=True) == ["B"]
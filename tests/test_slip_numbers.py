@@ -0,0 +1,55 @@
+"""Protokoll-Nummern: Vergabe erst beim Speichern, lückenlos und eindeutig unter Last."""
+
+import threading
+from datetime import date
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import slip_numbers
+from db import slip
+
+DAY = date.today().isoformat()
+
+def _save(s, hdr):
+    """Wie save_slip: Kopf anlegen, Nummer zuletzt ziehen."""
+    return slip_numbers.claim(s, slip_numbers.insert_header(s, hdr))
+
+def test_preview_does_not_allocate(engine):
+    with Session(engine) as s:
+        assert slip_numbers.preview(s) == f"{DAY}-001"
+        assert slip_numbers.preview(s) == f"{DAY}-001"
+
+def test_rollback_leaves_no_gap(engine):
+    with Session(engine) as s:
+        _save(s, {})
+        s.rollback()
+    with Session(engine) as s, s.begin():
+        assert _save(s, {}) == f"{DAY}-001"
+
+def test_skips_numbers_from_before_the_counter(engine):
+    with Session(engine) as s, s.begin():
+        s.execute(slip.insert().values(number=f"{DAY}-001"))
+    with Session(engine) as s, s.begin():
+        assert slip_numbers.preview(s) == f"{DAY}-002"
+        assert _save(s, {}) == f"{DAY}-002"
+
+def test_concurrent_claims_are_unique_and_gapless(engine):
+    numbers, errors = [], []
+
+    def save():
+        try:
+            with Session(engine) as s, s.begin():
+                numbers.append(_save(s, {"customer": "x"}))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert sorted(numbers) == [f"{DAY}-{i:03d}" for i in range(1, 21)]
+    with Session(engine) as s:
+        assert len(s.scalars(select(slip.c.number)).all()) == 20
@@ -0,0 +1,51 @@
+"""PDF-Rendering: Seitenaufteilung, DataMatrix je Zeile, Logo – ohne libdmtx (encode gestubbt)."""
+
+import io, re
+from datetime import datetime
+from types import SimpleNamespace
+
+from PIL import Image
+
+import barcode, slip_pdf
+
+HDR = SimpleNamespace(order_no="A-1", customer="Kunde", created_at=datetime(2024, 1, 2))
+
+def _rows(n, sns_per_row=3):
+    return [SimpleNamespace(qty=sns_per_row, cat="Notebook", prod=f"Gerät {i}",
+                            sns=",".join(f"SN{i:04d}-{j}" for j in range(sns_per_row)))
+            for i in range(n)]
+
+def _pages(pdf: bytes) -> int:
+    return len(re.findall(rb"/Type /Page\b", pdf))
+
+def _stub_encode(monkeypatch):
+    payloads = []
+    def encode(payload):
+        payloads.append(payload)
+        return Image.new("1", (12, 12))
+    monkeypatch.setattr(barcode, "encode", encode)
+    return payloads
+
+def test_render_many_rows_over_several_pages(monkeypatch):
+    payloads = _stub_encode(monkeypatch)
+    rows = _rows(80)
+    pdf  = slip_pdf.render_pdf(HDR, rows)
+    assert pdf.startswith(b"%PDF-") and pdf.rstrip().endswith(b"%%EOF")
+    assert _pages(pdf) > 1
+    assert sorted(payloads) == sorted(", ".join(r.sns.split(",")) for r in rows)
+    assert slip_pdf.LOGO_PATH.exists()
+    assert slip_pdf.template()._images                      # Logo steckt in der Vorlage
+
+def test_long_serial_list_continues_on_next_rows(monkeypatch):
+    payloads = _stub_encode(monkeypatch)
+    pdf = slip_pdf.render_pdf(HDR, _rows(1, sns_per_row=400))
+    assert _pages(pdf) > 1
+    assert len(payloads) > 1                                # je Fortsetzungszeile eine DataMatrix
+    assert all(len(p) <= slip_pdf.BC_MAX_CHARS for p in payloads)
+
+def test_many_slips_in_one_pdf(monkeypatch):
+    _stub_encode(monkeypatch)
+    one  = _pages(slip_pdf.render_pdf(HDR, _rows(5)))
+    buf  = io.BytesIO()
+    slip_pdf.write_pdf_many([(f"2024-01-02-00{i}", HDR, _rows(5)) for i in range(3)], buf)
+    assert _pages(buf.getvalue()) == 3 * one